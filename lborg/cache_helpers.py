@@ -0,0 +1,174 @@
+import os
+import json
+import pickle
+import hashlib
+import threading
+
+# Directory of the parse cache, set LBORG_CACHE_DIR to an empty string to disable it
+CACHE_DIR = os.environ.get('LBORG_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'lborg'))
+# Version of the cached objects, to be increased when the parsers change their output
+CACHE_VERSION = 3
+
+_index_lock = threading.Lock()
+
+
+def file_hash(file_name, block_size=1<<20):
+    """Computes the SHA-256 hash of the content of a file
+
+    Args:
+        file_name (str): the file name
+        block_size (int, optional): the size of the blocks read at once. Defaults to 1 MiB.
+
+    Returns:
+        str: the hexadecimal digest
+    """
+    sha = hashlib.sha256()
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _write_atomic(file_name, content, mode='wb'):
+    tmp_name = f'{file_name}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_name, mode) as f:
+        f.write(content)
+    os.replace(tmp_name, file_name)
+
+
+def _read_index(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, 'index.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _cache_file(file_name, kind, cache_dir):
+    """Name of the cache file of a parse of a file, keyed by the kind of parse
+    and the SHA-256 hash of the file. The hash is computed again only if the
+    path, size or modification time of the file change."""
+    os.makedirs(cache_dir, exist_ok=True)
+    stat = os.stat(file_name)
+    key = f'{kind}:{os.path.abspath(file_name)}'
+    with _index_lock:
+        entry = _read_index(cache_dir).get(key)
+    if entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+        digest = entry['hash']
+    else:
+        digest = file_hash(file_name)
+        with _index_lock:
+            index = _read_index(cache_dir)
+            index[key] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'hash': digest}
+            _write_atomic(os.path.join(cache_dir, 'index.json'), json.dumps(index), 'w')
+    return os.path.join(cache_dir, f'{kind}-v{CACHE_VERSION}-{digest}.pkl')
+
+
+def cached_parse(file_name, parser, kind, cache_dir=None):
+    """Parses a file, or loads the result of a previous parse of the same content.
+
+    The results are pickled in the cache directory, keyed by the kind of parse
+    and the SHA-256 hash of the file. The hash is computed again only if the
+    path, size or modification time of the file change.
+
+    Args:
+        file_name (str): the file name
+        parser (callable): the function parsing the file, called with the file name
+        kind (str): the name of the parse, e.g. 'json'
+        cache_dir (str, optional): the cache directory. Defaults to `CACHE_DIR`.
+
+    Returns:
+        any: the result of the parse
+    """
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    if not cache_dir:
+        return parser(file_name)
+    cache_file = _cache_file(file_name, kind, cache_dir)
+    try:
+        with open(cache_file, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        pass
+    result = parser(file_name)
+    _write_atomic(cache_file, pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+    return result
+
+
+def cached_parse_chunks(file_name, parser, kind, cache_dir=None):
+    """Parses a file in chunks, or loads the chunks of a previous parse of the
+    same content, as `cached_parse` does but a chunk at a time: the chunks are
+    pickled one after the other while they are yielded, and read back one at
+    a time, so that a single chunk is held in memory.
+
+    Args:
+        file_name (str): the file name
+        parser (callable): the generator parsing the file, called with the file name
+        kind (str): the name of the parse, e.g. 'excel_attendance'
+        cache_dir (str, optional): the cache directory. Defaults to `CACHE_DIR`.
+
+    Yields:
+        any: the chunks of the parse
+    """
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    if not cache_dir:
+        yield from parser(file_name)
+        return
+    cache_file = _cache_file(file_name, kind, cache_dir)
+    n_read = 0
+    try:
+        with open(cache_file, 'rb') as f:
+            while True:
+                chunk = pickle.load(f)
+                # the parse is complete at the end marker
+                if chunk is None:
+                    return
+                yield chunk
+                n_read += 1
+    except (OSError, pickle.UnpicklingError, EOFError):
+        pass
+    # parse again, skipping the chunks already read from a damaged cache file
+    tmp_name = f'{cache_file}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(tmp_name, 'wb') as f:
+            for n, chunk in enumerate(parser(file_name)):
+                pickle.dump(chunk, f, protocol=pickle.HIGHEST_PROTOCOL)
+                if n >= n_read:
+                    yield chunk
+            pickle.dump(None, f)
+        os.replace(tmp_name, cache_file)
+    finally:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+
+
+def clear_cache(cache_dir=None):
+    """Removes all the cached parses
+
+    Args:
+        cache_dir (str, optional): the cache directory. Defaults to `CACHE_DIR`.
+    """
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    if not cache_dir or not os.path.exists(cache_dir):
+        return
+    with _index_lock:
+        for file_name in os.listdir(cache_dir):
+            if file_name.endswith('.pkl') or file_name == 'index.json':
+                os.remove(os.path.join(cache_dir, file_name))
+
+
+def _load_json(file_name):
+    with open(file_name) as f:
+        return json.load(f)
+
+
+def load_json(json_file, cache_dir=None):
+    """Loads a json file through the parse cache
+
+    Args:
+        json_file (str): the json file name
+        cache_dir (str, optional): the cache directory. Defaults to `CACHE_DIR`.
+
+    Returns:
+        any: the content of the json file
+    """
+    return cached_parse(json_file, _load_json, 'json', cache_dir)
@@ -1,23 +1,31 @@
 import os
-import json
-import pandas as pd
-from datetime import datetime
-from lborg.excel_helpers import get_dates_from_excel_columns, get_attendance_from_excel
-from lborg.db_items import db_student, db_date, db_exam, db_exam_results
-from lborg.db import create_database, insert_items, check_column, update_db, create_query, query_database, check_entry, add_row, get_entry
+import sqlite3
+import threading
+import numpy as np
+from lborg.excel_helpers import get_dates_from_excel_columns, load_excel_headers, load_attendance_from_excel
+from lborg.date_helpers import date_key, date_ordinal
+from lborg.cache_helpers import load_json
+from lborg.record_helpers import iter_records, batched, as_bool
+from itertools import chain
+from lborg.db_items import db_student, db_date, db_exam
+from lborg.db import Session, get_session, get_db_indexes, create_indexes, migrate_indexes, create_database, create_table, get_tables, quote_identifier, insert_items, bulk_insert, check_column, create_query, query_database, get_db_columns, invalidate_schema_cache, search_table
+
+# Structure of the attendance table in the 'long' layout, one row per student and date
+ATTENDANCE_LOG_STRUCTURE = {'matricola':'integer','date':'text','present':'boolean'}
 
 
 def add_participants_to_db(json_file, cohort='2023/24',db_name='data/dummy.db', 
-                           update=False, overwrite=False, verbose=False):
+                           update=False, overwrite=False, verbose=False, chunk_size=1000):
     """Add participants to a database
 
     Args:
-        json_file (str): the file name of the json file with participants
+        json_file (str): the file name of the json (or NDJSON/CSV) file with participants
         cohort (str, optional): the academic year of attendance. Defaults to '2023/24'.
         db_name (str, optional): the file name with the database. Defaults to 'data/dummy.db'.
         update (bool, optional): update the database. Defaults to False.
         overwrite (bool, optional): overwrites the database. Defaults to False.
         verbose (bool, optional): verbose mode. Defaults to False.
+        chunk_size (int, optional): the number of participants written at once. Defaults to 1000.
 
     Raises:
         ValueError: database already exists and neither update nor overwrite are set
@@ -27,28 +35,31 @@ def add_participants_to_db(json_file, cohort='2023/24',db_name='data/dummy.db',
     if os.path.exists(db_name) and not (update or overwrite):
         raise ValueError(f'Database {db_name} already exists! Use `update` to update it')
     # load participants
-    with open(json_file) as f:
-        data = json.load(f)
-    if not data:
+    records = iter_records(json_file, 'roster')
+    first = next(records, None)
+    if first is None:
         raise ValueError(f'No data found in {json_file}')
     # create database
     if not os.path.exists(db_name) or overwrite:
         create_database(db_name, overwrite=overwrite)
     # add participants to database
-    students = []
-    for student in data[0]:
-        students += [ db_student(student['cognome'].replace("'", "''"),
-                                 student['nome'].replace("'", "''"),
-                                 student['matricola'],
-                                 student['indirizzoemail'],
-                                 cohort,
-                                 0) ]
-    insert_items(db_name, students, ignore_keys=['gruppo'], verbose=verbose)
-    print(f'Added {len(students)} students from {cohort} cohort to {db_name}')
+    n_students = [0]
+    def students():
+        for student in chain([first], records):
+            n_students[0] += 1
+            yield db_student(student['cognome'],
+                             student['nome'],
+                             student['matricola'],
+                             student.get('indirizzoemail', student.get('mail')),
+                             cohort,
+                             0)
+    with Session(db_name, 'bulk'):
+        insert_items(db_name, students(), ignore_keys=['gruppo'], verbose=verbose, chunk_size=chunk_size)
+    print(f'Added {n_students[0]} students from {cohort} cohort to {db_name}')
     return
 
 def create_attendance_db_from_excel(excel_file, db_name='data/dummy.db', 
-                         update=False, overwrite=False):
+                         update=False, overwrite=False, layout='wide'):
     """Add dates to attendance database
 
     Args:
@@ -56,6 +67,7 @@ def create_attendance_db_from_excel(excel_file, db_name='data/dummy.db',
         db_name (str, optional): the file name with the database. Defaults to 'data/dummy.db'.
         update (bool, optional): update the database. Defaults to False.
         overwrite (bool, optional): overwrites the database. Defaults to False.
+        layout (str, optional): 'wide' (a column per date) or 'long' (a row per student and date). Defaults to 'wide'.
 
     Raises:
         ValueError: database already exists and neither update nor overwrite are set
@@ -64,25 +76,22 @@ def create_attendance_db_from_excel(excel_file, db_name='data/dummy.db',
     # check if database exists
     if os.path.exists(db_name) and not (update or overwrite):
         raise ValueError(f'Database {db_name} already exists! Use `update` to update it')
-    # load participants
-    data = pd.read_excel(excel_file)
-    if data is None or data.empty:
+    # extract dates from the header of the sheets
+    dates = {}
+    for header in load_excel_headers(excel_file).values():
+        dates.update(get_dates_from_excel_columns(header))
+    if not dates:
         raise ValueError(f'No data found in {excel_file}')
-    # extract dates from the dataframe
-    dates = get_dates_from_excel_columns(data.keys())
     # create database
     if not os.path.exists(db_name) or overwrite: 
-        db_columns = {'matricola':'integer'}
-        for date in dates.keys():
-            db_columns[date] = 'boolean'
-        create_database(db_name, 'attendance', db_columns, overwrite=overwrite)
+        create_attendance_table(db_name, dates.keys(), layout, overwrite=overwrite)
     # Message   
     print(f'Created attendance database in {db_name}')
     return
 
 
 def create_attendance_db(json_file, db_name='data/dummy.db', 
-                         update=False, overwrite=False):
+                         update=False, overwrite=False, layout='wide'):
     """Add dates to attendance database
 
     Args:
@@ -90,6 +99,7 @@ def create_attendance_db(json_file, db_name='data/dummy.db',
         db_name (str, optional): the file name with the database. Defaults to 'data/dummy.db'.
         update (bool, optional): update the database. Defaults to False.
         overwrite (bool, optional): overwrites the database. Defaults to False.
+        layout (str, optional): 'wide' (a column per date) or 'long' (a row per student and date). Defaults to 'wide'.
 
     Raises:
         ValueError: database already exists and neither update nor overwrite are set
@@ -99,21 +109,157 @@ def create_attendance_db(json_file, db_name='data/dummy.db',
     if os.path.exists(db_name) and not (update or overwrite):
         raise ValueError(f'Database {db_name} already exists! Use `update` to update it')
     # load participants
-    with open(json_file) as f:
-        data = json.load(f)
+    data = load_json(json_file)
     if not data:
         raise ValueError(f'No data found in {json_file}')
     # create database
     if not os.path.exists(db_name) or overwrite: 
-        db_columns = {'matricola':'integer'}
-        for date in data.keys():
-            db_columns[date] = 'boolean'
-        create_database(db_name, 'attendance', db_columns, overwrite=overwrite)
+        create_attendance_table(db_name, data.keys(), layout, overwrite=overwrite)
     # Message   
     print(f'Created attendance database in {db_name}')
     return
 
 
+def create_attendance_table(db_name, dates, layout='wide', overwrite=False):
+    """Create the attendance database in the given layout
+
+    Args:
+        db_name (str): the file name with the database
+        dates (list): the dates of the course, used as columns in the 'wide' layout
+        layout (str, optional): 'wide' (a column per date) or 'long' (a row per student and date). Defaults to 'wide'.
+        overwrite (bool, optional): overwrites the database. Defaults to False.
+
+    Raises:
+        ValueError: unknown layout
+    """
+    if layout == 'wide':
+        db_columns = {'matricola':'integer'}
+        for date in dates:
+            db_columns[date_key(date)] = 'boolean'
+        create_database(db_name, 'attendance', db_columns, overwrite=overwrite)
+    elif layout == 'long':
+        create_database(db_name, 'attendance_log', ATTENDANCE_LOG_STRUCTURE, overwrite=overwrite)
+    else:
+        raise ValueError(f'Unknown attendance layout {layout}')
+    return
+
+
+def get_attendance_layout(db_name):
+    """Returns the layout of an attendance database
+
+    Args:
+        db_name (str): the file name with the database
+
+    Raises:
+        ValueError: database not found
+
+    Returns:
+        str: 'long' if the database has the `attendance_log` table, 'wide' otherwise
+    """
+    if not os.path.exists(db_name):
+        raise ValueError(f'Database {db_name} not found!')
+    return 'long' if 'attendance_log' in get_tables(db_name) else 'wide'
+
+
+def migrate_attendance_to_long(db_name, drop=False):
+    """Copies the attendance from the 'wide' layout (a column per date) to the
+    'long' one (a row per student and date) in the same database
+
+    Args:
+        db_name (str): the file name with the database
+        drop (bool, optional): drop the 'wide' table after the migration. Defaults to False.
+
+    Raises:
+        ValueError: database not found
+        ValueError: the database has no 'wide' attendance table
+        ValueError: the database has already a 'long' attendance table
+
+    Returns:
+        int: the number of rows written in the 'long' table
+    """
+    if not os.path.exists(db_name):
+        raise ValueError(f'Database {db_name} not found!')
+    tables = get_tables(db_name)
+    if 'attendance' not in tables:
+        raise ValueError(f'No attendance table in {db_name}!')
+    if 'attendance_log' in tables:
+        raise ValueError(f'Attendance in {db_name} already migrated!')
+    data, desc = query_database(db_name, create_query(db_name, 'attendance'))
+    dates = [d[0] for d in desc[1:]]
+    rows = ((student[0], date_key(date), present) for student in data 
+            for date, present in zip(dates, student[1:]) if present is not None)
+    create_table(db_name, 'attendance_log', ATTENDANCE_LOG_STRUCTURE)
+    n_rows, _ = bulk_insert(db_name, rows, 'attendance_log')
+    if drop:
+        get_session(db_name).execute('DROP TABLE attendance')
+        invalidate_schema_cache(db_name, 'attendance')
+    print(f'Migrated {n_rows} attendance entries in {db_name}')
+    return n_rows
+
+
+def get_students_ids(db_name):
+    """Returns the ids of the students keyed by name, with a single query.
+    For students with the same name, the first one in the database is kept.
+
+    Args:
+        db_name (str): the file name of the database with students
+
+    Returns:
+        dict: the student ids (matricola) keyed by (cognome, nome)
+    """
+    query = create_query(db_name, columns=['cognome','nome','matricola'])
+    data, desc = query_database(db_name, query)
+    ids = {}
+    for cognome, nome, matricola in data:
+        ids.setdefault((cognome, nome), matricola)
+    return ids
+
+
+def write_attendance(db_name, cells, layout=None):
+    """Writes the attendance of many students and dates in a single transaction,
+    adding the missing students (and the missing date columns in the 'wide' layout)
+
+    Args:
+        db_name (str): the file name with the database
+        cells (dict): the presence (bool) keyed by (matricola, date)
+        layout (str, optional): the layout of the database, read from the database if None. Defaults to None.
+    """
+    if layout is None:
+        layout = get_attendance_layout(db_name)
+    session = get_session(db_name)
+    if layout == 'long':
+        session.executemany("INSERT INTO attendance_log (matricola, date, present) VALUES (?, ?, ?) "
+                            "ON CONFLICT (matricola, date) DO UPDATE SET present = excluded.present",
+                            [(matricola, date_key(date), present) for (matricola, date), present in cells.items()])
+        return
+    by_date = {}
+    for (matricola, date), present in cells.items():
+        by_date.setdefault(date_key(date), []).append((present, matricola))
+    with session.lock:
+        try:
+            # add the missing students and dates
+            existing, _ = session.query("SELECT matricola FROM attendance")
+            existing = set(e[0] for e in existing)
+            missing = sorted(set(matricola for matricola, date in cells.keys()) - existing)
+            session.executemany("INSERT INTO attendance (matricola) VALUES (?)", [(m,) for m in missing], commit=False)
+            # match the dates with the existing columns, whatever their format
+            columns = {date_key(column): column for column in get_db_columns(db_name, 'attendance')[1:]}
+            for date in by_date.keys():
+                if date not in columns:
+                    session.execute(f"ALTER TABLE attendance ADD COLUMN {quote_identifier(date)} boolean", commit=False)
+                    columns[date] = date
+            # update the dates one column at a time
+            for date, values in by_date.items():
+                session.executemany(f"UPDATE attendance SET {quote_identifier(columns[date])} = ? WHERE matricola = ?", 
+                                    values, commit=False)
+            session.commit()
+        except sqlite3.Error:
+            session.rollback()
+            raise
+    invalidate_schema_cache(db_name, 'attendance')
+    return
+
+
 def create_exams_db(db_name='data/dummy_exams.db', 
                     update=False, overwrite=False):
     """Create the exams database
@@ -151,17 +297,28 @@ def create_exams_db(db_name='data/dummy_exams.db',
     return
 
 
-def assign_group(json_file, db_name='data/dummy.db', verbose=False):
-    """Assign groups to participants in database
+def assign_group(json_file, db_name='data/dummy.db', verbose=False, chunk_size=1000, 
+                 cohort=None, by_matricola=False):
+    """Assign groups to participants in database, all at once: the groups are
+    loaded in a temporary table and applied with a single join, in one transaction.
+    Students matching more than one participant in the database are left unchanged.
 
     Args:
-        json_file (str): the file name of the json file with participants and groups
+        json_file (str): the file name of the json (or NDJSON/CSV) file with participants and groups
         db_name (str, optional): the file name with the database to update. Defaults to 'data/dummy.db'.
+        verbose (bool, optional): verbose mode. Defaults to False.
+        chunk_size (int, optional): the number of participants loaded at once. Defaults to 1000.
+        cohort (str, optional): match only the participants of a cohort. Defaults to None.
+        by_matricola (bool, optional): match the participants by id instead of by name. Defaults to False.
 
     Raises:
         ValueError: database not found
         ValueError: group column not found
         ValueError: no data found in json file
+
+    Returns:
+        dict: the number of students 'matched' and the lists of the 'unmatched' and 
+        'ambiguous' ones, as (cognome, nome, matricola) tuples
     """    
     # check if database exists
     if not os.path.exists(db_name):
@@ -169,28 +326,53 @@ def assign_group(json_file, db_name='data/dummy.db', verbose=False):
     # check if group column is present
     if not check_column(db_name, 'gruppo'):
         raise ValueError(f'Column "gruppo" not found in {db_name}!')
-    # load participants
-    with open(json_file) as f:
-        data = json.load(f)
-    if not data:
-        raise ValueError(f'No data found in {json_file}')
-    # update participants group to database
-    for student in data[0]:
-        st_item = db_student(student['nome'].replace("'", "''"),  # Escape single quotes
-                             student['cognome'].replace("'", "''"),  # Escape single quotes
-                             student['matricola'] if 'matricola' in student.keys() else None,
-                             student['indirizzoemail'] if 'indirizzoemail' in student.keys() else None,
-                             None,
-                             student['gruppo'])
-        if verbose: print(student, st_item)
-        update_db(db_name, 'gruppo', student['gruppo'],
-                  f"cognome = \'{student['cognome'].replace("'", "''")}\' AND nome = \'{student['nome'].replace("'", "''")}\'", 
-                  verbose=verbose)
-    return
+    session = get_session(db_name)
+    create_indexes(db_name, 'students')
+    match = 's.matricola = a.matricola' if by_matricola else 's.cognome = a.cognome AND s.nome = a.nome'
+    same = 'b.matricola IS a.matricola' if by_matricola else 'b.cognome IS a.cognome AND b.nome IS a.nome'
+    if cohort is not None:
+        match += ' AND s.coorte = ?'
+    params = (cohort,) if cohort is not None else ()
+    with session.lock:
+        try:
+            # load participants
+            session.execute("CREATE TEMP TABLE IF NOT EXISTS group_assignments "
+                            "(cognome text, nome text, matricola integer, gruppo integer, n_matches integer)", commit=False)
+            session.execute("DELETE FROM temp.group_assignments", commit=False)
+            n_students = 0
+            for batch in batched(iter_records(json_file, 'groups'), chunk_size):
+                if verbose: 
+                    for student in batch: print(student)
+                session.executemany("INSERT INTO temp.group_assignments (cognome, nome, matricola, gruppo) VALUES (?, ?, ?, ?)",
+                                    [(student.get('cognome'), student.get('nome'), student.get('matricola'), student['gruppo']) 
+                                     for student in batch], commit=False)
+                n_students += len(batch)
+            if not n_students:
+                raise ValueError(f'No data found in {json_file}')
+            # count the students matching each participant
+            session.execute("UPDATE temp.group_assignments AS a SET n_matches = "
+                            f"(SELECT COUNT(*) FROM students AS s WHERE {match})", params, commit=False)
+            # update participants group to database, the last assignment of a participant wins
+            updated = session.execute(f"UPDATE students AS s SET gruppo = a.gruppo FROM temp.group_assignments AS a "
+                                      f"WHERE {match} AND a.n_matches = 1 AND a.rowid = "
+                                      f"(SELECT MAX(b.rowid) FROM temp.group_assignments AS b WHERE {same})",
+                                      params, commit=False)
+            data, _ = session.query("SELECT cognome, nome, matricola, n_matches FROM temp.group_assignments ORDER BY rowid")
+            session.execute("DELETE FROM temp.group_assignments", commit=False)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+    summary = {'matched': updated,
+               'unmatched': [d[:3] for d in data if d[3] == 0],
+               'ambiguous': [d[:3] for d in data if d[3] > 1]}
+    print(f'Assigned {updated} students to their groups in {db_name}, '+
+          f'{len(summary["unmatched"])} unmatched and {len(summary["ambiguous"])} ambiguous')
+    return summary
 
 
 def get_groups(cohort, db_name='data/dummy.db'):
-    """Returns a dictionary with groups from a database
+    """Returns a dictionary with groups from a database, for the students of a cohort
 
     Args:
         cohort (str): the academic year of attendance
@@ -200,26 +382,81 @@ def get_groups(cohort, db_name='data/dummy.db'):
         ValueError: Database not found
 
     Returns:
-        dict: a dictionary with students keyed by group number
+        dict: a dictionary with students (cognome, nome, mail, gruppo) keyed by
+        group number, sorted by group and surname. The students without a group are left out.
     """    
     # check if database exists
     if not os.path.exists(db_name):
         raise ValueError(f'Database {db_name} not found!')
-    # query the database
-    query = create_query(db_name, columns=['cognome','nome','mail','gruppo'], order='cognome')
-    data, desc = query_database(db_name,query)
-    # order data by group number
-    sorted_array = sorted(data, key=lambda x: x[3])
+    # query the database, grouped and sorted by the index on (coorte, gruppo, cognome),
+    # created with the table or by macros/migrate_indexes.py
+    data, desc = get_session(db_name).query("SELECT cognome, nome, mail, gruppo FROM students "
+                                            "WHERE coorte = ? ORDER BY gruppo, cognome", (cohort,))
     # create dictionary with groups
     groups = {}
-    for student in sorted_array:
-        if student[3] not in groups.keys():
-            groups[student[3]] = []
+    for student in data:
+        students = groups.setdefault(student[3], [])
         if student[3]: 
-            groups[student[3]].append(student) 
+            students.append(student) 
     return groups
 
 
+def search_students(text, db_name='data/dummy.db', cohort=None, limit=20):
+    """Searches the students by name, surname or mail, without accents and
+    case, by prefix and with typos, through the search index of the database
+
+    Args:
+        text (str): the searched text, e.g. 'rossi mario'
+        db_name (str, optional): the file name of the database. Defaults to 'data/dummy.db'.
+        cohort (str, optional): search only the students of a cohort. Defaults to None.
+        limit (int, optional): the maximum number of students returned. Defaults to 20.
+
+    Raises:
+        ValueError: Database not found
+
+    Returns:
+        list: the students (cognome, nome, matricola, mail, coorte, gruppo, score), the best matches first
+    """
+    if not os.path.exists(db_name):
+        raise ValueError(f'Database {db_name} not found!')
+    return search_table(db_name, text, 'students', columns=['cognome','nome','matricola','mail','coorte','gruppo'],
+                        filter='t.coorte = ?' if cohort is not None else None,
+                        params=(cohort,) if cohort is not None else (), limit=limit)
+
+
+def iter_groups(cohort, db_name='data/dummy.db', groups=None, unassigned=False):
+    """Yields the students of a cohort one group at a time, sorted by group
+    and surname, with a query per group on the index on (coorte, gruppo, cognome)
+
+    Args:
+        cohort (str): the academic year of attendance
+        db_name (str, optional): the file name of the database. Defaults to 'data/dummy.db'.
+        groups (list, optional): the groups to yield. Defaults to all the groups of the cohort.
+        unassigned (bool, optional): yield also the students without a group (group 0 or None),
+            left out as in `get_groups` otherwise. Defaults to False.
+
+    Raises:
+        ValueError: Database not found
+
+    Yields:
+        tuple: the group number and the list of its students (cognome, nome, mail, gruppo)
+    """
+    if not os.path.exists(db_name):
+        raise ValueError(f'Database {db_name} not found!')
+    session = get_session(db_name)
+    if groups is None:
+        data, _ = session.query("SELECT DISTINCT gruppo FROM students WHERE coorte = ? ORDER BY gruppo", (cohort,))
+        groups = [d[0] for d in data]
+    for group in groups:
+        if not group and not unassigned:
+            yield group, []
+            continue
+        data, _ = session.query("SELECT cognome, nome, mail, gruppo FROM students "
+                                f"WHERE coorte = ? AND gruppo {'IS' if group is None else '='} ? ORDER BY cognome",
+                                (cohort, group))
+        yield group, data
+
+
 def add_dates_db(json_file,db_name='data/dummy_dates.db'):
     """Creates a database with dates and hours from a json file
 
@@ -232,10 +469,10 @@ def add_dates_db(json_file,db_name='data/dummy_dates.db'):
     if not os.path.exists(db_name):
         create_database(db_name,table_name,{'date':'text','hours':'INTEGER'})
     # update dates to database
-    data = json.load(open(json_file))
+    data = load_json(json_file)
     items = []
     for date, hours in data.items():
-        items += [db_date(date, hours)]
+        items += [db_date(date_key(date), hours)]
     insert_items(db_name, items, 'dates')
     return
 
@@ -276,7 +513,7 @@ def add_exams_db(json_file,db_name='data/dummy_exams_dates.db'):
     if not os.path.exists(db_name):
         create_database(db_name,table_name,{'date':'text','type':'text'})
     # update dates to database
-    data = json.load(open(json_file))
+    data = load_json(json_file)
     items = []
     for date, exam_type in data.items():
         items += [db_exam(date, exam_type)]
@@ -314,6 +551,22 @@ def compact_report(marks):
     return txt[:-1]
 
 
+def expand_report(txt):
+    """Translate the compact string of the reports marks back to a dictionary
+
+    Args:
+        txt (str): the compact string with the marks
+
+    Returns:
+        dict: a dictionary with the marks for each experience
+    """
+    marks = {}
+    for item in txt.split(' '):
+        experience, _, mark = item.rpartition(':')
+        marks[experience] = mark
+    return marks
+
+
 def int_mark(mark,exam_type='written'):
     """Translates the exam mark to an integer
 
@@ -336,153 +589,413 @@ def int_mark(mark,exam_type='written'):
     return int_mark
 
 
-def update_exams_entry(matricola, mark, db_exams_name, date, exam_type, force=False):
-    """Update the exams database with the exam results
+def keep_old_mark(matricola, old_mark, old_date, mark, date, exam_type, force=False):
+    """Check whether the mark of a student has to be kept instead of the new one:
+    a mark from an earlier date is replaced only by a better mark, unless forced
 
     Args:
         matricola (int): the student id
-        mark (str/dict): the mark value in the database
-        db_exams_name (str): the name of the exams database
-        date (str): the date of the exam
+        old_mark (str): the mark in the database
+        old_date (str): the date of the mark in the database
+        mark (str/dict): the new mark
+        date (str): the date of the new mark
         exam_type (str): the type of the exam
         force (bool, optional): force the update of the database. Defaults to False.
-    """    
-    # add student's entry if not present
-    if not check_entry(db_exams_name, 'matricola', matricola, 'exams'):
-        add_row(db_exams_name, 'matricola', matricola, 'exams')
-    # check if the student has already a result
-    date_column = exam_type+'_date' if exam_type != 'result' else 'oral_date'
-    old_entry = db_exam_results(*(get_entry(db_exams_name, 'matricola', matricola, 'exams')[0]))
-    old_date = old_entry.__getattribute__(date_column)
-    if old_date is not None and int(old_date) < int(date):
-        old_mark = old_entry.__getattribute__(exam_type)
-        print(f'Warning: {matricola} already has a {exam_type} mark from a different date!'+
-              f' ({old_date}({old_mark}) vs {date}({mark}))')
-        if int_mark(mark) <= int_mark(old_mark) and not force: 
-            return
-        print('Forcing update...')
+
+    Returns:
+        bool: True if the old mark has to be kept
+    """
+    if old_date is None or old_mark is None or date_ordinal(old_date) >= date_ordinal(date):
+        return False
+    print(f'Warning: {matricola} already has a {exam_type} mark from a different date!'+
+          f' ({old_date}({old_mark}) vs {date}({mark}))')
+    mark_type = 'oral' if exam_type == 'result' else exam_type
     if exam_type == 'reports':
-        mark = compact_report(mark)
-    update_db(db_exams_name, exam_type, mark, 
-              filter=f'matricola = {matricola}',
-              table_name='exams')
-    update_db(db_exams_name, date_column, date, 
-              filter=f'matricola = {matricola}', 
-              table_name='exams')
-    return
+        old_mark = expand_report(old_mark) if isinstance(old_mark, str) else old_mark
+        mark = expand_report(mark) if isinstance(mark, str) else mark
+    if int_mark(mark, mark_type) <= int_mark(old_mark, mark_type) and not force: 
+        return True
+    print('Forcing update...')
+    return False
+
+
+def get_exams_ids(db_students_name, exam_type='written'):
+    """Returns the students the marks of a type of exam refer to, with a single query:
+    reports are given per group, the other exams per student
+
+    Args:
+        db_students_name (str): the file name of the database with students
+        exam_type (str, optional): the type of exams (written, reports, result). Defaults to 'written'.
+
+    Returns:
+        dict: the lists of student ids keyed by group or student id (as strings)
+    """
+    query = create_query(db_students_name, columns=['matricola','gruppo'], order='matricola')
+    students, desc = query_database(db_students_name, query)
+    ids = {}
+    if exam_type == 'reports':
+        for matricola, group in students:
+            ids.setdefault(str(group), []).append(matricola)
+    else:
+        ids = {str(matricola): [matricola] for matricola, group in students}
+    return ids
+
+
+def resolve_exams(records, ids):
+    """Resolves the marks of an exams file to the student ids
+
+    Args:
+        records (iterable): the marks records (with 'date', 'key' and 'mark'), as read by `iter_records`
+        ids (dict): the student ids, as returned by `get_exams_ids`
+
+    Returns:
+        list: a list of (matricola, mark, date) tuples, in the order of the file
+    """
+    return [(matricola, record['mark'], record['date']) for record in records 
+            for matricola in ids.get(str(record['key']), [])]
+
+
+def merge_exams_marks(marks, results, exam_type, force=False):
+    """Applies new marks to the current ones, keeping the marks from earlier
+    dates that are better than the new ones unless forced
+
+    Args:
+        marks (dict): the current (mark, date) keyed by student id, updated in place
+        results (list): a list of (matricola, mark, date) tuples
+        exam_type (str): the type of exams (written, reports, result)
+        force (bool, optional): force the update of the marks. Defaults to False.
+
+    Returns:
+        set: the ids of the students whose mark has been updated
+    """
+    updated = set()
+    for matricola, mark, date in results:
+        old_mark, old_date = marks.get(matricola, (None, None))
+        if keep_old_mark(matricola, old_mark, old_date, mark, date, exam_type, force):
+            continue
+        marks[matricola] = (compact_report(mark) if isinstance(mark, dict) else mark, date_key(date))
+        updated.add(matricola)
+    return updated
 
 
-def update_exams_db(json_file, db_students_name, db_exams_name, exam_type='written', force=False):
-    """Updates the exams database with the data from a json file
+def update_exams_db(json_file, db_students_name, db_exams_name, exam_type='written', force=False,
+                    chunk_size=1000):
+    """Updates the exams database with the data from a json (or NDJSON/CSV) file
 
     Args:
         json_file (str): the json file name with attendance data
         db_students_name (str): the file name of the database with students
         db_exams_name (str): the file name of the database with the exams results
         exam_type (str): the type of exams given (written, reports, result)
+        force (bool, optional): force the update of the database. Defaults to False.
+        chunk_size (int, optional): the number of marks read and written at once. Defaults to 1000.
     """    
-    data = json.load(open(json_file))
-    for date, students in data.items():
-        if exam_type == 'reports':
-            for group, marks in students.items():
-                # get the students in the group by their id (matricola)
-                query = create_query(db_students_name,columns=['matricola'], 
-                                     order='matricola', filter=f'gruppo = {group}')
-                data, desc = query_database(db_students_name,query)
-                if not data: continue
-                ids =  [i[0] for i in data]
-                # add report results to exams database
-                for matricola in ids:
-                    update_exams_entry(matricola, marks, db_exams_name, date,
-                                       exam_type, force=False)
-        else:
-            for matricola, mark in students.items():
-                print(matricola, mark)
-                query = create_query(db_students_name, 
-                                     columns=['cognome','nome','matricola'], 
-                                     filter=f'matricola = "{matricola}"')
-                result, description = query_database(db_students_name,query)
-                if not result: continue
-                # add student to exams database if not present
-                update_exams_entry(result[0][2], mark, db_exams_name, 
-                                   date, exam_type, force=False)
+    updated = set()
+    with Session(db_students_name, 'read'), Session(db_exams_name, 'bulk'):
+        create_indexes(db_students_name, 'students')
+        create_indexes(db_exams_name, 'exams')
+        # resolve the students ids and the groups once
+        ids = get_exams_ids(db_students_name, exam_type)
+        # apply the marks to the current ones, in the order of the file
+        marks = get_exams_marks(db_exams_name, exam_type)
+        for batch in batched(iter_records(json_file, 'marks'), chunk_size):
+            batch_updated = merge_exams_marks(marks, resolve_exams(batch, ids), exam_type, force)
+            write_exams_marks(db_exams_name, exam_type, 
+                              [(matricola,) + marks[matricola] for matricola in sorted(batch_updated)])
+            updated |= batch_updated
+    print(f'Updated {len(updated)} {exam_type} marks in {db_exams_name}')
+    return
+
+
+def get_exams_marks(db_exams_name, exam_type):
+    """Returns the marks of a type of exam from the exams database
+
+    Args:
+        db_exams_name (str): the file name of the database with the exams results
+        exam_type (str): the type of exams (written, reports, result)
+
+    Returns:
+        dict: the mark and its date, keyed by student id
+    """
+    date_column = exam_type+'_date' if exam_type != 'result' else 'oral_date'
+    query = create_query(db_exams_name, 'exams', columns=['matricola', exam_type, date_column])
+    data, desc = query_database(db_exams_name, query)
+    return {d[0]: (d[1], d[2]) for d in data}
+
+
+def write_exams_marks(db_exams_name, exam_type, marks):
+    """Writes many marks of a type of exam in a single transaction, adding the
+    students missing from the exams database
+
+    Args:
+        db_exams_name (str): the file name of the database with the exams results
+        exam_type (str): the type of exams (written, reports, result)
+        marks (list): a list of (matricola, mark, date) tuples
+    """
+    date_column = exam_type+'_date' if exam_type != 'result' else 'oral_date'
+    session = get_session(db_exams_name)
+    if (('matricola',), True) in get_db_indexes(db_exams_name, 'exams').values():
+        session.executemany(f"INSERT INTO exams (matricola, {exam_type}, {date_column}) VALUES (?, ?, ?) "
+                            f"ON CONFLICT (matricola) DO UPDATE SET {exam_type} = excluded.{exam_type}, "
+                            f"{date_column} = excluded.{date_column}", marks)
+        return
+    # without a unique key on matricola, update the existing rows and insert the others
+    with session.lock:
+        existing = set(get_exams_marks(db_exams_name, exam_type).keys())
+        session.executemany(f"UPDATE exams SET {exam_type} = ?, {date_column} = ? WHERE matricola = ?", 
+                            [(m[1], m[2], m[0]) for m in marks if m[0] in existing], commit=False)
+        session.executemany(f"INSERT INTO exams (matricola, {exam_type}, {date_column}) VALUES (?, ?, ?)",
+                            [m for m in marks if m[0] not in existing])
     return
 
-def update_attendance_db(json_file, db_students_name, db_attendance_name):
-    """Updates the attendance database with the data from a json file
+
+def update_exams_entry(matricola, mark, db_exams_name, date, exam_type, force=False):
+    """Update the exams database with the exam results of a single student,
+    as `update_exams_db` does for a whole file
+
+    Args:
+        matricola (int): the student id
+        mark (str/dict): the mark value in the database
+        db_exams_name (str): the name of the exams database
+        date (str): the date of the exam
+        exam_type (str): the type of the exam
+        force (bool, optional): force the update of the database. Defaults to False.
+    """    
+    # check if the student has already a result
+    date_column = exam_type+'_date' if exam_type != 'result' else 'oral_date'
+    data, _ = get_session(db_exams_name).query(f"SELECT {exam_type}, {date_column} FROM exams WHERE matricola = ?", 
+                                               (matricola,))
+    marks = {matricola: tuple(data[0])} if data else {}
+    if merge_exams_marks(marks, [(matricola, mark, date)], exam_type, force):
+        write_exams_marks(db_exams_name, exam_type, [(matricola,) + marks[matricola]])
+    return
+
+
+def update_attendance_db(json_file, db_students_name, db_attendance_name, chunk_size=1000):
+    """Updates the attendance database with the data from a json (or NDJSON/CSV) file
 
     Args:
         json_file (str): the json file name with attendance data
         db_students_name (str): the file name of the database with students
         db_attendance_name (str): the file name of the database with attendance
+        chunk_size (int, optional): the number of entries read and written at once. Defaults to 1000.
     """    
-    data = json.load(open(json_file))
-    for date, students in data.items():
-        for student in students:
-            query = create_query(db_students_name, columns=['cognome','nome','matricola'], filter=f'cognome = "{student["cognome"]}" AND nome = "{student["nome"]}"')
-            result, description = query_database(db_students_name,query)
-            if not result: continue
-            # add student to attendance database if not present
-            if not check_entry(db_attendance_name, 'matricola', result[0][2], 'attendance'):
-                add_row(db_attendance_name, 'matricola', result[0][2], 'attendance')
-            update_db(db_attendance_name, date, student['presente']==1, filter=f'matricola = {result[0][2]}', table_name='attendance')
+    with Session(db_students_name, 'read'), Session(db_attendance_name, 'bulk'):
+        migrate_indexes(db_attendance_name)
+        # resolve the students once
+        ids = get_students_ids(db_students_name)
+        for batch in batched(iter_records(json_file, 'attendance'), chunk_size):
+            write_attendance(db_attendance_name, resolve_attendance(batch, ids))
     return
 
-def update_attendance_db_from_excel(excel_file, db_students_name, db_attendance_name):
-    """Updates the attendance database with the data from a json file
+
+def resolve_attendance(records, ids):
+    """Resolves the attendance records to the student ids, skipping the
+    students not in the database
+
+    Args:
+        records (iterable): the attendance records (with 'date', 'cognome', 'nome' and 'presente'), as read by `iter_records`
+        ids (dict): the student ids keyed by (cognome, nome), as returned by `get_students_ids`
+
+    Returns:
+        dict: the presence (bool) keyed by (matricola, date)
+    """
+    cells = {}
+    for student in records:
+        matricola = ids.get((student['cognome'], student['nome']))
+        if matricola is None: continue
+        cells[(matricola, date_key(student['date']))] = as_bool(student['presente'])
+    return cells
+
+
+def resolve_attendance_from_excel(excel_file, ids, chunk_size=1000):
+    """Resolves the attendance of an excel file to the student ids, chunk by
+    chunk, skipping the students not in the database
+
+    Args:
+        excel_file (str): the excel file name with attendance data
+        ids (dict): the student ids keyed by (cognome, nome), as returned by `get_students_ids`
+        chunk_size (int, optional): the number of rows read at once. Defaults to 1000.
+
+    Yields:
+        tuple: the number of rows read and the presence (bool) keyed by (matricola, date) of a chunk of rows
+    """
+    for names, dates, presence in load_attendance_from_excel(excel_file, chunk_size):
+        cells = {}
+        for name, row in zip(names, presence):
+            matricola = ids.get(name)
+            if matricola is None: continue
+            for date, present in zip(dates, row):
+                cells[(matricola, date)] = bool(present)
+        yield len(names), cells
+
+def update_attendance_db_from_excel(excel_file, db_students_name, db_attendance_name, chunk_size=1000):
+    """Updates the attendance database with the data from an excel file. The
+    file is read lazily and written in chunks of rows, for all the sheets with
+    'Cognome' and 'Nome' columns. The parsed chunks are cached one at a time,
+    and read back from the cache in the same way, so a single chunk is held in memory
 
     Args:
         excel_file (str): the excel file name with attendance data
         db_students_name (str): the file name of the database with students
         db_attendance_name (str): the file name of the database with attendance
+        chunk_size (int, optional): the number of rows read and written at once. Defaults to 1000.
     """
-    data = pd.read_excel(excel_file)
-    if data is None or data.empty:
+    n_rows = 0
+    with Session(db_students_name, 'read'), Session(db_attendance_name, 'bulk'):
+        migrate_indexes(db_attendance_name)
+        # resolve the students once
+        ids = get_students_ids(db_students_name)
+        for n_chunk, cells in resolve_attendance_from_excel(excel_file, ids, chunk_size):
+            write_attendance(db_attendance_name, cells)
+            n_rows += n_chunk
+    if not n_rows:
         raise ValueError(f'No data found in {excel_file}')
-    attendance_data = get_attendance_from_excel(data)
-    for date, students in attendance_data.items():
-        for student in students:
-            query = create_query(db_students_name, columns=['cognome','nome','matricola'], filter=f'cognome = "{student["cognome"]}" AND nome = "{student["nome"]}"')
-            result, description = query_database(db_students_name,query)
-            if not result: continue
-            # add student to attendance database if not present
-            if not check_entry(db_attendance_name, 'matricola', result[0][2], 'attendance'):
-                add_row(db_attendance_name, 'matricola', result[0][2], 'attendance')
-            update_db(db_attendance_name, date, student['presente']==1, filter=f'matricola = {result[0][2]}', table_name='attendance')
     return
 
 def get_attendance(db_name='data/dummy_attendance.db', matricola=None):
-    """Returns the attendance from the database
+    """Returns the attendance from the database, with a column per date
+    whatever the layout of the database
 
     Returns:
         list: a list with the attendance
     """
-    query = create_query(db_name, 'attendance', order='matricola', 
-                         filter=f"matricola = {matricola}" if matricola is not None else None)
-    data, desc = query_database(db_name,query)
+    if get_attendance_layout(db_name) == 'wide':
+        query = create_query(db_name, 'attendance', order='matricola', 
+                             filter=f"matricola = {matricola}" if matricola is not None else None)
+        data, desc = query_database(db_name,query)
+        return data, desc
+    # pivot the 'long' layout, dates are sorted
+    session = get_session(db_name)
+    dates, _ = session.query("SELECT DISTINCT date FROM attendance_log ORDER BY date")
+    params = [d[0] for d in dates]
+    query = "SELECT matricola"
+    for date in params:
+        query += f", MAX(CASE WHEN date = ? THEN present END) AS {quote_identifier(date)}"
+    query += " FROM attendance_log"
+    if matricola is not None:
+        query += " WHERE matricola = ?"
+        params.append(matricola)
+    query += " GROUP BY matricola ORDER BY matricola"
+    data, desc = session.query(query, params)
     return data, desc
 
-def calculate_attendance(db_name='data/dummy_attendance.db', db_dates='data/dummy_dates.db', matricola=None):
-    """Calculates the fraction attendance from the database
+
+def count_attendance(db_name='data/dummy_attendance.db', by='matricola'):
+    """Counts the presences per student or per date
+
+    Args:
+        db_name (str, optional): the file name with the database. Defaults to 'data/dummy_attendance.db'.
+        by (str, optional): either 'matricola' or 'date'. Defaults to 'matricola'.
+
+    Raises:
+        ValueError: unknown aggregation
+
+    Returns:
+        dict: the number of presences and of recorded entries, keyed by student id or date
+    """
+    if by not in ('matricola', 'date'):
+        raise ValueError(f'Cannot count attendance by {by}')
+    if get_attendance_layout(db_name) == 'long':
+        data, _ = get_session(db_name).query(f"SELECT {by}, SUM(present), COUNT(present) FROM attendance_log GROUP BY {by} ORDER BY {by}")
+        return {d[0]: (d[1], d[2]) for d in data}
+    data, desc = get_attendance(db_name)
+    if by == 'matricola':
+        return {d[0]: (sum(1 for p in d[1:] if p), sum(1 for p in d[1:] if p is not None)) for d in data}
+    return {desc[i][0]: (sum(1 for d in data if d[i]), sum(1 for d in data if d[i] is not None)) 
+            for i in range(1, len(desc))}
+
+def get_attendance_matrix(db_name='data/dummy_attendance.db', db_dates='data/dummy_dates.db', with_dates=False):
+    """Loads the attendance of the whole cohort as a matrix
+
+    Args:
+        db_name (str, optional): the file name with the attendance database. Defaults to 'data/dummy_attendance.db'.
+        db_dates (str, optional): the file name with the dates database. Defaults to 'data/dummy_dates.db'.
+        with_dates (bool, optional): return also the dates of the columns. Defaults to False.
+
+    Returns:
+        tuple: the student ids, the presence matrix (students x dates, NaN where
+        there is no data) and the hours of each date, followed by the dates of
+        the columns if `with_dates` is set
     """
     # get the data
-    data, desc = get_attendance(db_name, matricola)
+    data, desc = get_attendance(db_name)
     # get dates
     dates, desc_dates = get_dates(db_dates)
-    # calculate attendance
-    valid_hours = 0
-    attendance = {}
-    for student in data:
-        days = [student[i] for i in range(1,len(student))]
-        if valid_hours == 0:
-            valid_hours = [dates[i][1] for i in range(len(days)) if days[i] is not None]
-            valid_hours = sum(valid_hours)
-            if valid_hours > 56: valid_hours = 56
-        hours = 0
-        for d, p in zip(dates,days):
-            if p is not None and p:
-                hours += d[1]
-        att = float(hours)/valid_hours
-        if att > 1: att = 1
-        attendance[student[0]] = att
-    return attendance
\ No newline at end of file
+    # match the columns to the dates by name, as in the 'wide' layout the
+    # columns are in the order the dates were added, and sort them by date
+    hours = {date_key(d[0]): d[1] for d in dates}
+    columns = sorted(range(1, len(desc)), key=lambda i: date_key(desc[i][0]))
+    keys = [date_key(desc[i][0]) for i in columns]
+    ids = np.array([d[0] for d in data])
+    presence = np.array([[d[i] for i in columns] for d in data], dtype=float).reshape(len(data), len(columns))
+    hours = np.array([hours.get(key, 0) for key in keys], dtype=float)
+    if with_dates:
+        return ids, presence, hours, keys
+    return ids, presence, hours
+
+
+def attendance_fractions(ids, presence, hours, max_hours=56):
+    """Computes the attendance fraction of all the students at once: the hours
+    of presence are divided by the hours of the dates with data for any
+    student, capped at `max_hours`, and the fraction is capped at 1
+
+    Args:
+        ids (np.array): the student ids
+        presence (np.array): the presence matrix (students x dates, NaN where there is no data)
+        hours (np.array): the hours of each date
+        max_hours (int, optional): the maximum number of hours required. Defaults to 56.
+
+    Returns:
+        np.array: the attendance fraction of each student
+    """
+    valid_hours = min(hours[(~np.isnan(presence)).any(axis=0)].sum(), max_hours)
+    attended = (np.nan_to_num(presence) != 0) @ hours
+    if valid_hours <= 0:
+        return np.zeros(len(ids))
+    return np.minimum(attended/valid_hours, 1.)
+
+
+# Attendance fractions of the cohorts, keyed by the databases and stored
+# along with the version of their data
+_attendance_cache = {}
+_attendance_cache_lock = threading.Lock()
+
+def calculate_attendance(db_name='data/dummy_attendance.db', db_dates='data/dummy_dates.db', matricola=None, max_hours=56):
+    """Calculates the fraction attendance from the database.
+
+    The fractions of the whole cohort are computed at once and cached until
+    the data of the databases change, so that the queries for single students
+    are answered from the same result.
+
+    Args:
+        db_name (str, optional): the file name with the attendance database. Defaults to 'data/dummy_attendance.db'.
+        db_dates (str, optional): the file name with the dates database. Defaults to 'data/dummy_dates.db'.
+        matricola (int, optional): the id of a single student. Defaults to None.
+        max_hours (int, optional): the maximum number of hours required. Defaults to 56.
+
+    Raises:
+        ValueError: database not found
+
+    Returns:
+        dict: the attendance fraction keyed by student id
+    """
+    # check the files before opening them, which would create them
+    for name in (db_name, db_dates):
+        if not os.path.exists(name):
+            raise ValueError(f'Database {name} not found!')
+    key = (os.path.abspath(db_name), os.path.abspath(db_dates), max_hours)
+    version = (get_session(db_name).data_version(), get_session(db_dates).data_version())
+    with _attendance_cache_lock:
+        cached = _attendance_cache.get(key)
+    if cached is not None and cached[0] == version:
+        attendance = cached[1]
+    else:
+        ids, presence, hours = get_attendance_matrix(db_name, db_dates)
+        fractions = attendance_fractions(ids, presence, hours, max_hours)
+        attendance = {matr.item(): frac.item() for matr, frac in zip(ids, fractions)}
+        with _attendance_cache_lock:
+            _attendance_cache[key] = (version, attendance)
+    if matricola is None:
+        return dict(attendance)
+    return {matricola: attendance[matricola]} if matricola in attendance else {}
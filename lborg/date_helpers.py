@@ -0,0 +1,108 @@
+import re
+from functools import lru_cache
+from datetime import datetime, date as dt_date
+
+MONTHS_IT_TO_EN = {
+    'gen': 'jan', 'feb': 'feb', 'mar': 'mar', 'apr': 'apr',
+    'mag': 'may', 'giu': 'jun', 'lug': 'jul', 'ago': 'aug',
+    'set': 'sep', 'ott': 'oct', 'nov': 'nov', 'dic': 'dec'
+}
+
+# Month numbers keyed by the first three letters of the Italian and English names
+MONTHS = {}
+for n, (it, en) in enumerate(MONTHS_IT_TO_EN.items()):
+    MONTHS[it] = MONTHS[en] = n+1
+
+# Date formats found in the Excel registers and in the json files, tried in order
+DATE_PATTERNS = (
+    # 2024-03-05, 2024-03-05 10:30:00, 2024/3/5
+    (re.compile(r'(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})(?:[ t].*)?'), ('year', 'month', 'day')),
+    # 20240305
+    (re.compile(r'(\d{4})(\d{2})(\d{2})'), ('year', 'month', 'day')),
+    # 05/03/2024, 5-3-2024, 05.03.2024
+    (re.compile(r'(\d{1,2})[-/.](\d{1,2})[-/.](\d{4})'), ('day', 'month', 'year')),
+    # 5 mar 2024, 5 marzo 2024, 5 March 2024
+    (re.compile(r'(\d{1,2})\s+([^\W\d_]{3})[^\W\d_]*\.?\s+(\d{4})'), ('day', 'month', 'year')),
+)
+
+@lru_cache(maxsize=4096)
+def parse_date(date):
+    """Parses a date in any of the formats of `DATE_PATTERNS`, with or without
+    the enclosing quotes, with Italian or English month names
+
+    Args:
+        date (str/datetime.date): the date
+
+    Raises:
+        ValueError: the date is not in a known format
+
+    Returns:
+        datetime.date: the date
+    """
+    if isinstance(date, datetime):
+        return date.date()
+    if isinstance(date, dt_date):
+        return date
+    text = str(date).strip().strip("'\"").strip().lower()
+    for pattern, fields in DATE_PATTERNS:
+        match = pattern.fullmatch(text)
+        if match is None:
+            continue
+        parts = dict(zip(fields, match.groups()))
+        month = parts['month']
+        month = int(month) if month.isdigit() else MONTHS.get(month)
+        if month is None:
+            break
+        try:
+            return dt_date(int(parts['year']), month, int(parts['day']))
+        except ValueError:
+            break
+    raise ValueError(f'Unknown date format {date!r}')
+
+
+def normalize_date(date):
+    """Returns the canonical key of a date, in ISO format (YYYY-MM-DD), which
+    sorts as the dates do
+
+    Args:
+        date (str/datetime.date): the date
+
+    Raises:
+        ValueError: the date is not in a known format
+
+    Returns:
+        str: the date in ISO format
+    """
+    return parse_date(date).isoformat()
+
+
+def date_ordinal(date):
+    """Returns the ordinal of a date, to compare dates given in any format
+
+    Args:
+        date (str/datetime.date): the date
+
+    Raises:
+        ValueError: the date is not in a known format
+
+    Returns:
+        int: the proleptic Gregorian ordinal of the date
+    """
+    return parse_date(date).toordinal()
+
+
+def date_key(date):
+    """Returns the canonical key of a date, or the text without the enclosing
+    quotes if it is not a date, so that free-form keys are kept as they are
+
+    Args:
+        date (str): the date
+
+    Returns:
+        str: the date in ISO format
+    """
+    try:
+        return normalize_date(date)
+    except ValueError:
+        date = str(date)
+        return date[1:-1] if len(date) > 1 and date[0] == date[-1] == "'" else date
@@ -1,5 +1,408 @@
-import os, sqlite3
-from lborg.db_items import db_item, print_db_item_as_tuple
+import os, sqlite3, threading, atexit, time, difflib, unicodedata
+from itertools import islice, chain
+from lborg.db_items import db_item
+from lborg.date_helpers import date_key, normalize_date
+
+# Connection pragmas tuned for the different workloads
+PRAGMA_PRESETS = {
+    'default': {},
+    'read': {'cache_size': -32000, 'mmap_size': 268435456, 'temp_store': 'MEMORY'},
+    'bulk': {'cache_size': -64000, 'synchronous': 'NORMAL', 'temp_store': 'MEMORY'},
+}
+
+# Indexes of the tables, as (columns, unique)
+DB_INDEXES = {
+    'students': [(('matricola',), False),
+                 (('cognome', 'nome'), False),
+                 (('coorte', 'gruppo', 'cognome'), False)],
+    'attendance': [(('matricola',), True)],
+    'attendance_log': [(('matricola', 'date'), True),
+                       (('date',), False)],
+    'exams': [(('matricola',), True),
+              (('written_date',), False),
+              (('oral_date',), False)],
+    'dates': [(('date',), False)],
+}
+
+# Columns of the tables holding dates, stored as ISO keys
+DATE_COLUMNS = {
+    'attendance_log': ('date',),
+    'exams': ('written_date', 'reports_date', 'oral_date'),
+    'dates': ('date',),
+}
+
+# Columns of the tables with a full-text search index, maintained by triggers
+SEARCH_INDEXES = {
+    'students': ('cognome', 'nome', 'mail'),
+}
+
+# Triggers maintaining the search indexes, named after the tables
+SEARCH_TRIGGERS = ('insert', 'remove', 'update', 'delete')
+
+# Rows inserted at once above which the search index is rebuilt instead of
+# being updated by its triggers, if also above this fraction of the rows of the table
+SEARCH_REBUILD_ROWS = 1000
+SEARCH_REBUILD_FRACTION = 0.5
+
+# Accented characters folded to their base letter in the search indexes
+SEARCH_FOLDING = {
+    'a': 'àáâäãå', 'e': 'èéêë', 'i': 'ìíîï', 'o': 'òóôöõø',
+    'u': 'ùúûü', 'c': 'ç', 'n': 'ñ', 'y': 'ýÿ',
+}
+# Number of replacements nested in a single SQL expression when folding the text
+FOLDING_STAGE_SIZE = 20
+# Texts with characters to be folded: anything but the printable ASCII characters, or an apostrophe
+FOLDING_PATTERN = "'*[^ -&(-~]*'"
+_FOLDING_TABLE = str.maketrans({c: base for base, chars in SEARCH_FOLDING.items() for c in chars + chars.upper()})
+
+
+class Session:
+    """A persistent connection to a database file.
+
+    The session is shared by all the functions of `lborg.db` operating on the
+    same file. It can be used as a context manager: within the `with` block all
+    the calls on the file go through this session, which is closed at the end.
+    The statements are committed as they are executed, as outside the block:
+    at the end of the block only the pending changes are committed, or rolled
+    back on errors. Use a `Batch` to write all-or-nothing. The shared session
+    returned by `get_session` can also be used in a `with` block: it is then
+    committed at the end, but left open. Access to the connection is
+    serialised with a lock, so a session can be shared among threads.
+
+    Args:
+        name (str): the file name containing the database
+        pragmas (str or dict, optional): a preset in `PRAGMA_PRESETS` or a dictionary of pragmas. Defaults to 'default'.
+    """
+    def __init__(self, name, pragmas='default'):
+        self.name = name
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(name, check_same_thread=False)
+        self.batch = None
+        self._previous = []
+        self.set_pragmas(pragmas)
+
+    def __enter__(self):
+        self._previous.append(_register_session(self))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        previous = self._previous.pop()
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        # the session was already the registered one, e.g. from `get_session`: keep it open
+        if previous is self:
+            return False
+        self.close()
+        _unregister_session(self, previous)
+        return False
+
+    def set_pragmas(self, pragmas):
+        """Set the connection pragmas
+
+        Args:
+            pragmas (str or dict): a preset in `PRAGMA_PRESETS` or a dictionary of pragmas
+        """
+        if isinstance(pragmas, str):
+            pragmas = PRAGMA_PRESETS[pragmas]
+        with self.lock:
+            for key, value in pragmas.items():
+                self.connection.execute(f"PRAGMA {key} = {value}")
+
+    def query(self, query, params=()):
+        """Run a query and fetch its results
+
+        Args:
+            query (str): the query
+            params (tuple, optional): the parameters bound to the query. Defaults to ().
+
+        Returns:
+            tuple: the result of the query and its description
+        """
+        with self.lock:
+            self.flush()
+            cursor = self.connection.execute(query, params)
+            return cursor.fetchall(), cursor.description
+
+    def execute(self, query, params=(), commit=True):
+        """Execute a statement modifying the database
+
+        Args:
+            query (str): the statement
+            params (tuple, optional): the parameters bound to the statement. Defaults to ().
+            commit (bool, optional): if True, commits the changes. Defaults to True.
+
+        Returns:
+            int: the number of rows affected
+        """
+        with self.lock:
+            self.flush()
+            cursor = self.connection.execute(query, params)
+            if commit:
+                self.commit()
+            return cursor.rowcount
+
+    def executemany(self, query, seq_of_params, commit=True):
+        """Execute a statement modifying the database once per set of parameters
+
+        Args:
+            query (str): the statement
+            seq_of_params (iterable): the sets of parameters bound to the statement
+            commit (bool, optional): if True, commits the changes. Defaults to True.
+
+        Returns:
+            int: the number of rows affected
+        """
+        with self.lock:
+            self.flush()
+            cursor = self.connection.executemany(query, seq_of_params)
+            if commit:
+                self.commit()
+            return cursor.rowcount
+
+    def flush(self):
+        """Execute the writes buffered by an open batch, if any"""
+        if self.batch is not None:
+            self.batch.flush()
+
+    def data_version(self):
+        """Returns a value changing whenever the data of the database change,
+        either through this session or through other connections
+
+        Returns:
+            tuple: the version of the data
+        """
+        with self.lock:
+            self.flush()
+            version = self.connection.execute("PRAGMA data_version").fetchone()[0]
+            return (id(self), version, self.connection.total_changes)
+
+    def commit(self):
+        """Commit the changes, unless a batch is open: its changes are committed by the batch itself"""
+        if self.batch is not None:
+            return
+        with self.lock:
+            self.connection.commit()
+
+    def rollback(self):
+        with self.lock:
+            self.connection.rollback()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class Batch:
+    """A batch of writes on a database file.
+
+    Within a `with Batch(name):` block, the calls to `update_db` and `add_row`
+    on the file are buffered instead of being executed and committed one by
+    one. Repeated updates of the same cell are coalesced, keeping the last
+    value. The buffer is flushed before any other statement on the file, so
+    that reads see the buffered writes, and at the end of the block.
+
+    With `mode='atomic'` all the writes are committed in a single transaction
+    at the end of the block, and none is if an error occurs. With
+    `mode='chunk'` the writes are committed every `chunk_size` statements, and
+    on errors only the current chunk is rolled back. The database is switched
+    to WAL journaling.
+
+    Args:
+        name (str): the file name containing the database
+        mode (str, optional): the commit mode, either 'atomic' or 'chunk'. Defaults to 'atomic'.
+        chunk_size (int, optional): the number of statements per commit in 'chunk' mode. Defaults to 1000.
+        verbose (bool, optional): if True, prints a summary of the flushed writes. Defaults to False.
+    """
+    def __init__(self, name, mode='atomic', chunk_size=1000, verbose=False):
+        if mode not in ('atomic', 'chunk'):
+            raise ValueError(f'Unknown batch mode {mode}')
+        self.name = name
+        self.mode = mode
+        self.chunk_size = chunk_size
+        self.verbose = verbose
+        self.session = None
+        self._writes = {}
+        self._n_inserts = 0
+        self._n_uncommitted = 0
+        self._n_buffered = 0
+        self._n_executed = 0
+
+    def __enter__(self):
+        self.session = get_session(self.name)
+        with self.session.lock:
+            if self.session.batch is not None:
+                raise ValueError(f'A batch is already open on {self.name}')
+            self.session.commit()
+            self.session.connection.execute("PRAGMA journal_mode = WAL")
+            self.session.batch = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with self.session.lock:
+            try:
+                if exc_type is None:
+                    self.flush()
+                    self.session.connection.commit()
+                else:
+                    self._writes.clear()
+                    self.session.connection.rollback()
+            finally:
+                self.session.batch = None
+        if self.verbose:
+            print(f'Batch on {self.name}: {self._n_buffered} writes buffered, {self._n_executed} executed')
+        return False
+
+    def update(self, table_name, column, value, filter='', params=()):
+        """Buffer the update of a column, replacing a previous update of the same cells
+
+        Args:
+            table_name (str): the name of the table
+            column (str): the column to update
+            value (any): the new value for the column
+            filter (str, optional): the condition selecting the rows to update. Defaults to ''.
+            params (tuple, optional): the parameters bound to the placeholders in `filter`. Defaults to ().
+        """
+        exec_str = f"UPDATE {table_name} SET {column} = ?"
+        if filter!='':
+            exec_str += f" WHERE {filter}"
+        key = (exec_str, tuple(params))
+        with self.session.lock:
+            # the coalesced update takes the position of the last one
+            self._writes.pop(key, None)
+            self._writes[key] = (exec_str, (value,) + tuple(params))
+            self._n_buffered += 1
+
+    def insert(self, table_name, column, value):
+        """Buffer the insertion of a row with a single column set
+
+        Args:
+            table_name (str): the name of the table
+            column (str): the column to set
+            value (any): the value of the column
+        """
+        exec_str = f"INSERT INTO {table_name} ({column}) VALUES (?)"
+        with self.session.lock:
+            self._n_inserts += 1
+            self._writes[('insert', self._n_inserts)] = (exec_str, (value,))
+            self._n_buffered += 1
+
+    def flush(self):
+        """Execute the buffered writes, committing them in 'chunk' mode"""
+        with self.session.lock:
+            if not self._writes:
+                return
+            writes = list(self._writes.values())
+            self._writes.clear()
+            connection = self.session.connection
+            try:
+                for exec_str, params in writes:
+                    connection.execute(exec_str, params)
+                    self._n_executed += 1
+                    self._n_uncommitted += 1
+                    if self.mode == 'chunk' and self._n_uncommitted >= self.chunk_size:
+                        connection.commit()
+                        self._n_uncommitted = 0
+            except sqlite3.Error:
+                connection.rollback()
+                raise
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def _register_session(session):
+    key = os.path.abspath(session.name)
+    with _sessions_lock:
+        previous = _sessions.get(key)
+        _sessions[key] = session
+    return previous
+
+def _unregister_session(session, previous=None):
+    key = os.path.abspath(session.name)
+    with _sessions_lock:
+        if _sessions.get(key) is session:
+            if previous is None:
+                del _sessions[key]
+            else:
+                _sessions[key] = previous
+
+
+def quote_identifier(name):
+    """Quote a table or column name, e.g. a date used as column name.
+    Enclosing single quotes, which SQLite drops from column names, are removed.
+
+    Args:
+        name (str): the name to quote
+
+    Returns:
+        str: the quoted name
+    """
+    if len(name) > 1 and name[0] == name[-1] == "'":
+        name = name[1:-1]
+    return '"' + name.replace('"', '""') + '"'
+
+
+def get_tables(name):
+    """Get the tables of a database
+
+    Args:
+        name (str): the file name containing the database
+
+    Returns:
+        list: the names of the tables
+    """
+    tables, _ = get_session(name).query("SELECT name FROM sqlite_master WHERE type = 'table'")
+    return [table[0] for table in tables]
+
+
+def get_session(name, pragmas=None):
+    """Returns the session shared by all the calls on a database file, opening it if needed
+
+    Args:
+        name (str): the file name containing the database
+        pragmas (str or dict, optional): pragmas to apply to the session. Defaults to None.
+
+    Returns:
+        Session: the session of the database
+    """
+    key = os.path.abspath(name)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = Session(name, pragmas or 'default')
+            _sessions[key] = session
+            return session
+    if pragmas is not None:
+        session.set_pragmas(pragmas)
+    return session
+
+
+def close_session(name):
+    """Closes the shared session of a database file, if any
+
+    Args:
+        name (str): the file name containing the database
+    """
+    with _sessions_lock:
+        session = _sessions.pop(os.path.abspath(name), None)
+    if session is not None:
+        session.commit()
+        session.close()
+
+
+def close_all_sessions():
+    """Closes all the shared sessions"""
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.commit()
+        session.close()
+
+atexit.register(close_all_sessions)
+
 
 def create_database(name, table_name='students',
                     structure={'cognome':'text','nome':'text','matricola':'integer','mail':'text','coorte':'text','gruppo':'integer'}, 
@@ -24,6 +427,8 @@ def create_database(name, table_name='students',
         overwrite (bool, optional): if True, overwrites the file if it already exists. Defaults to False.
     """
     # Check if the file already exists
+    close_session(name)
+    invalidate_schema_cache(name)
     if os.path.exists(name): 
         if overwrite: 
             os.remove(name)
@@ -31,40 +436,89 @@ def create_database(name, table_name='students',
             raise ValueError(f'Database {name} already exists!')
     # Connect to a database (or create it if it doesn't exist)
     if not os.path.exists(name[:name.rfind('/')]): os.makedirs(name[:name.rfind('/')])
-    connection = sqlite3.connect(name)
-    # Create a cursor object to interact with the database
-    cursor = connection.cursor()
+    create_table(name, table_name, structure)
+    return
+
+
+def create_table(name, table_name, structure):
+    """Creates a table with user-defined structure in a database, if not
+    already present, along with its indexes declared in `DB_INDEXES` and its
+    search index declared in `SEARCH_INDEXES`
+
+    Args:
+        name (str): the file name containing the database
+        table_name (str): the name of the table
+        structure (dict): the structure of the table
+    """
+    session = get_session(name)
     # Create a table
     exec_str = f"CREATE TABLE IF NOT EXISTS {table_name} ("
     for key, value in structure.items():
-        exec_str += f"{key} {value},"
+        exec_str += f"{quote_identifier(key)} {value},"
     exec_str = exec_str[:-1] + ")"
-    cursor.execute(exec_str)
-    # Commit the changes and close the connection
-    connection.commit()
-    connection.close()
+    session.execute(exec_str)
+    invalidate_schema_cache(name, table_name)
+    create_indexes(name, table_name)
+    if table_name in SEARCH_INDEXES:
+        create_search_index(name, table_name)
     return
 
 
+# Columns of the tables, keyed by (file, table) and stored along with the
+# file identity and schema version they were read at
+_schema_cache = {}
+_schema_cache_lock = threading.Lock()
+
+def invalidate_schema_cache(name=None, table_name=None):
+    """Drop the cached columns of a table, of all the tables of a database or of everything
+
+    Args:
+        name (str, optional): the file name containing the database. Defaults to None.
+        table_name (str, optional): the name of the table. Defaults to None.
+    """
+    with _schema_cache_lock:
+        if name is None:
+            _schema_cache.clear()
+            return
+        path = os.path.abspath(name)
+        for key in list(_schema_cache.keys()):
+            if key[0] == path and table_name in (None, key[1]):
+                del _schema_cache[key]
+
+
 def get_db_columns(name, table_name='students'):
-    """Get the columns of the database
+    """Get the columns of the database.
+
+    The columns are cached per database file and table, and read again only
+    if the file is replaced or its `PRAGMA schema_version` changes.
 
     Args:
         name (str): the file name containing the database
         table_name (str, optional): the name of the table. Defaults to 'students'.
 
+    Raises:
+        ValueError: file name does not exist
+
     Returns:
         list: a list of the columns of the database
     """    
-    # Connect to a database
-    connection = sqlite3.connect(name)
-    # Create a cursor object to interact with the database
-    cursor = connection.cursor()
+    try:
+        stat = os.stat(name)
+    except FileNotFoundError:
+        raise ValueError(f'Database {name} does not exist!')
+    session = get_session(name)
+    identity = (stat.st_dev, stat.st_ino, session.query("PRAGMA schema_version")[0][0][0])
+    key = (os.path.abspath(name), table_name)
+    with _schema_cache_lock:
+        cached = _schema_cache.get(key)
+    if cached is not None and cached[0] == identity:
+        return list(cached[1])
     # Get the columns
-    cursor.execute(f"PRAGMA table_info({table_name})")
-    columns = cursor.fetchall()
-    connection.close()
-    return [col[1] for col in columns]
+    columns, _ = session.query(f"PRAGMA table_info({table_name})")
+    columns = [col[1] for col in columns]
+    with _schema_cache_lock:
+        _schema_cache[key] = (identity, columns)
+    return list(columns)
 
 
 def create_query(name, table_name='students', columns=None, filter=None, order=None):
@@ -77,13 +531,13 @@ def create_query(name, table_name='students', columns=None, filter=None, order=N
         order (str, optional): a specific column to order the output. Defaults to None.
 
     Raises:
+        ValueError: file name does not exist
         ValueError: One or more columns not found in the database
         ValueError: `order` column is not found in the database
 
     Returns:
         str: the query to be used with the database
     """
-    if not os.path.exists(name): raise ValueError(f'Database {name} does not exist!')
     db_columns = get_db_columns(name,table_name)
     query = "SELECT "
     if columns is None:
@@ -117,67 +571,149 @@ def query_database(name,query):
         tuple: a tuple with the result of the query
     """    
     if not os.path.exists(name): raise ValueError(f'Database {name} does not exist!')
-    # Connect to a database
-    connection = sqlite3.connect(name)
-    # Create a cursor object to interact with the database
-    cursor = connection.cursor()
     # Return all results of query
-    cursor.execute(query)
-    result = cursor.fetchall()
-    description = cursor.description
-    return result, description
+    return get_session(name).query(query)
 
 
 def insert_items(name, items, table_name='students', ignore_keys=[],
-                 verbose=False):
-    """Add many items at once to the database
+                 verbose=False, chunk_size=None):
+    """Add many items at once to the database, in a single transaction
+    (see `bulk_insert`)
 
     Args:
         name (str): the file name containing the database
-        items (list): a list of db_items
+        items (iterable): a list (or a generator) of db_items
         table_name(str, optional): the name of the table. Defaults to 'students'.
         ignore_keys (list, optional): a list of keys to ignore when checking for duplicates. Defaults to [].
         verbose (bool, optional): if True, prints the query. Defaults to False.
+        chunk_size (int, optional): if given, the new items are inserted this many at a time, so that
+            a generator of items is never held in memory at once. Defaults to None.
+
+    Returns:
+        int: the number of items added
     """    
-    # Connect to a database
-    connection = sqlite3.connect(name)
-    # Create a cursor object to interact with the database
-    cursor = connection.cursor()
-    # Check if item exists in database
-    items_to_add = []
-    for it in items:
-        if verbose:
-            print(it)
-        if check_item(name, it, table_name, ignore_keys):
-            continue
-        items_to_add.append(it)
-    if items_to_add == []:
-        print('All items already present in the database!')
-        connection.close()
-        return
+    # Load the keys already in the database once
+    key_ids, existing_keys = get_item_keys(name, table_name, ignore_keys)
+    # Check if item exists in database (or earlier in the items)
+    def new_items():
+        for it in items:
+            if verbose:
+                print(it)
+            key = item_key(it[i] for i in key_ids)
+            if key in existing_keys:
+                continue
+            existing_keys.add(key)
+            yield it
     # Insert items
-    exec_str = f"INSERT INTO {table_name} VALUES "
-    for it in items_to_add:
-        exec_str += print_db_item_as_tuple(it) + ','
-    exec_str = exec_str[:-1]
-    if verbose:
-        print(exec_str)
     try:
-        cursor.execute(exec_str)
-        # Check if any rows were affected
-        if verbose:
-            if cursor.rowcount > 0:
-                print(f"Query successful, {cursor.rowcount} rows affected.")
-            else:
-                print("Query did not affect any rows.")
-        # Commit the changes
-        connection.commit()
+        n_added, _ = bulk_insert(name, new_items(), table_name, chunk_size=chunk_size, verbose=verbose)
     except sqlite3.Error as e:
         print(f"An error occurred: {e.args[0]}")
-    finally:
-        # Close the connection
-        connection.close()
-    return
+        return 0
+    if n_added == 0:
+        print('All items already present in the database!')
+    return n_added
+
+
+def bulk_insert(name, items, table_name='students', chunk_size=1000, verbose=False):
+    """Insert many items at once with bound parameters.
+
+    The items are inserted with `executemany` in chunks of `chunk_size` rows,
+    all within a single transaction. The values of each item are bound
+    positionally to the columns of the table, so any namedtuple of
+    `lborg.db_items.db_item` can be inserted in its table. The search index
+    of the table, if any, is kept up to date by its triggers, unless the rows
+    exceed `SEARCH_REBUILD_ROWS` and `SEARCH_REBUILD_FRACTION` of the rows
+    already in the table: the triggers are then dropped, and the index rebuilt
+    and the triggers created again at the end, within the same transaction.
+
+    Args:
+        name (str): the file name containing the database
+        items (iterable): the db_items (or tuples) to insert
+        table_name (str, optional): the name of the table. Defaults to 'students'.
+        chunk_size (int, optional): the number of rows sent to each `executemany`,
+            all of them if None. Defaults to 1000.
+        verbose (bool, optional): if True, prints the insertion rate. Defaults to False.
+
+    Raises:
+        sqlite3.Error: the insertion failed, no row is inserted
+
+    Returns:
+        tuple: the number of rows inserted and the insertion rate in rows/second
+    """
+    session = get_session(name)
+    n_columns = len(get_db_columns(name, table_name))
+    exec_str = f"INSERT INTO {table_name} VALUES ({', '.join(['?']*n_columns)})"
+    if verbose:
+        print(exec_str)
+    items = iter(items)
+    n_rows = 0
+    start = time.perf_counter()
+    with session.lock:
+        # the rows above which rebuilding the search index is faster than its triggers
+        rebuild_rows = None
+        if table_name in SEARCH_INDEXES:
+            last_row = session.query(f"SELECT MAX(rowid) FROM {table_name}")[0][0][0] or 0
+            rebuild_rows = max(SEARCH_REBUILD_ROWS, SEARCH_REBUILD_FRACTION*last_row)
+        suspended = False
+        try:
+            while True:
+                chunk = [tuple(it) for it in islice(items, chunk_size)]
+                if not chunk: break
+                if rebuild_rows is not None and not suspended and n_rows + len(chunk) > rebuild_rows:
+                    # the triggers are dropped within the transaction, so that they are never left missing
+                    if not session.connection.in_transaction:
+                        session.connection.execute("BEGIN")
+                    suspended = drop_search_triggers(name, table_name, commit=False)
+                session.executemany(exec_str, chunk, commit=False)
+                n_rows += len(chunk)
+            if suspended:
+                create_search_index(name, table_name, rebuild=True, commit=False)
+            session.commit()
+        except Exception:
+            # also on the errors of the items, which would leave the triggers dropped
+            session.rollback()
+            raise
+    elapsed = time.perf_counter() - start
+    rate = n_rows/elapsed if elapsed > 0 else float('inf')
+    if verbose:
+        print(f"Inserted {n_rows} rows in {elapsed:.3f} s ({rate:.0f} rows/s)")
+    return n_rows, rate
+
+def item_key(values):
+    """Normalises the values of an item to a hashable key, so that values read
+    from the database compare equal to the ones given by the user (e.g. the
+    integer 1 and the string '1')
+
+    Args:
+        values (iterable): the values of the item
+
+    Returns:
+        tuple: the key of the item
+    """
+    return tuple(None if v is None else str(int(v) if isinstance(v, bool) else v)
+                 for v in values)
+
+
+def get_item_keys(name, table_name='students', ignore_keys=[]):
+    """Get the keys of the items present in a table with a single query.
+
+    Items are matched to the table columns by position, as they are inserted.
+
+    Args:
+        name (str): the file name containing the database
+        table_name (str, optional): the name of the table. Defaults to 'students'.
+        ignore_keys (list, optional): a list of columns to leave out of the keys. Defaults to [].
+
+    Returns:
+        tuple: the positions of the columns used in the keys and the set of keys in the table
+    """
+    db_columns = get_db_columns(name, table_name)
+    key_ids = [i for i, col in enumerate(db_columns) if col not in ignore_keys]
+    query = create_query(name, table_name, columns=[db_columns[i] for i in key_ids])
+    result, _ = get_session(name).query(query)
+    return key_ids, set(item_key(row) for row in result)
+
 
 def check_item(name, item, table_name='students',ignore_keys=[]):
     """Check if an item is present in the database
@@ -190,56 +726,34 @@ def check_item(name, item, table_name='students',ignore_keys=[]):
     Returns:
         bool: True if the item is present, False otherwise
     """    
-    # Connect to a database
-    connection = sqlite3.connect(name)
-    # Create a cursor object to interact with the database
-    cursor = connection.cursor()
-    # Check if item exists in database
-    filter = ''
-    for key in item._fields:
+    # Check if item exists in database (items are matched by position)
+    filter, params = [], []
+    for key, value in zip(get_db_columns(name, table_name), item):
         if key in ignore_keys: continue
-        value = getattr(item, key)
-        if isinstance(value, str):
-            value = value.replace("'", "''")  # Escape single quotes
-        filter += f"{key} = '{value}' AND "
-    filter = filter[:-5]
-    query= create_query(name, table_name, filter=filter)
-    cursor.execute(query)
-    result = cursor.fetchall()
-    connection.close()
+        filter.append(f"{key} = ?")
+        params.append(value)
+    query= create_query(name, table_name, filter=' AND '.join(filter))
+    result, _ = get_session(name).query(query, params)
     return len(result) > 0
 
 def check_entry(name, column, value, table_name='students'):
-    # Connect to a database
-    connection = sqlite3.connect(name)
-    # Create a cursor object to interact with the database
-    cursor = connection.cursor()
     # Check if item exists in database
-    filter = f'{column} = \'{value}\'' if type(value)==str else f'{column} = {value}'
-    query= create_query(name, table_name, filter=filter)
-    cursor.execute(query)
-    result = cursor.fetchall()
-    connection.close()
+    query= create_query(name, table_name, filter=f'{column} = ?')
+    result, _ = get_session(name).query(query, (value,))
     return len(result) > 0
 
 def get_entry(name, column, value, table_name='students', db_item=None):
-    # Connect to a database
-    connection = sqlite3.connect(name)
-    # Create a cursor object to interact with the database
-    cursor = connection.cursor()
     # Check if item exists in database
-    filter = f'{column} = \'{value}\'' if type(value)==str else f'{column} = {value}'
-    query= create_query(name, table_name, filter=filter)
-    cursor.execute(query)
-    result = cursor.fetchall()
-    connection.close()
+    query= create_query(name, table_name, filter=f'{column} = ?')
+    result, _ = get_session(name).query(query, (value,))
     if db_item is None:
         return result
     return db_item(*result[0]) if len(result) > 0 else None
 
 def add_row(name, column, value, table_name='students',
             verbose=False):
-    """Add a row to the database by setting the value of a single column
+    """Add a row to the database by setting the value of a single column.
+    Within a `Batch` on the database the insertion is buffered.
 
     Args:
         name (str): the file name containing the database
@@ -248,60 +762,54 @@ def add_row(name, column, value, table_name='students',
         table_name (str, optional): the name of the table. Defaults to 'students'.
         verbose (bool, optional): if True, prints the query. Defaults to False.
     """    
-    # Connect to a database
-    connection = sqlite3.connect(name)
-    # Create a cursor object to interact with the database
-    cursor = connection.cursor()
+    session = get_session(name)
+    if session.batch is not None:
+        session.batch.insert(table_name, column, value)
+        return
     # Insert the item
-    exec_str = f"INSERT INTO {table_name} ({column}) VALUES ("
-    exec_str += f"'{value}')" if type(value) == str else f"{value})"
+    exec_str = f"INSERT INTO {table_name} ({column}) VALUES (?)"
     if verbose: 
-        print(exec_str)
-    cursor.execute(exec_str)
-    # Commit the changes
-    connection.commit()
-    # Close the connection
-    connection.close()
+        print(exec_str, (value,))
+    session.execute(exec_str, (value,))
     return
 
 
 def update_db(name, column, value, filter='', table_name='students', 
-              verbose=False):
-    """Update a column of a database item
+              verbose=False, params=()):
+    """Update a column of a database item.
+    Within a `Batch` on the database the update is buffered and coalesced.
 
     Args:
         name (str): the file name containing the database
-        item (db_item): the item to update
         column (str): the column to update
         value (str): the new value for the column
+        filter (str, optional): the condition selecting the rows to update, can use `?` placeholders. Defaults to ''.
         table_name (str, optional): the name of the table. Defaults to 'students'.
-        verbose (bool, optional): if True, prints the query. Defaults to False.
+        verbose (bool, optional): if True, prints the query and the number of rows affected. Defaults to False.
+        params (tuple, optional): the parameters bound to the placeholders in `filter`. Defaults to ().
     """    
-    # Connect to a database
-    connection = sqlite3.connect(name)
-    # Create a cursor object to interact with the database
-    cursor = connection.cursor()
+    session = get_session(name)
+    if session.batch is not None:
+        session.batch.update(table_name, column, value, filter, params)
+        return
     # Update the column
-    exec_str = f"UPDATE {table_name} SET {column} = "
-    exec_str += f"'{value}'" if type(value) == str else f"{value}"
+    exec_str = f"UPDATE {table_name} SET {column} = ?"
+    params = (value,) + tuple(params)
     if filter!='': 
         exec_str += f" WHERE {filter}"
     if verbose:
-        print(exec_str)
+        print(exec_str, params)
     try:
-        cursor.execute(exec_str)
+        rowcount = session.execute(exec_str, params)
         # Check if any rows were affected
-        if cursor.rowcount > 0:
-            print(f"Query successful, {cursor.rowcount} rows affected.")
-        else:
-            print("Query did not affect any rows.")
-        # Commit the changes
-        connection.commit()
+        if verbose:
+            if rowcount > 0:
+                print(f"Query successful, {rowcount} rows affected.")
+            else:
+                print("Query did not affect any rows.")
     except sqlite3.Error as e:
+        session.rollback()
         print(f"An error occurred: {e.args[0]}")
-    finally:
-        # Close the connection
-        connection.close()
     return
 
 def check_column(name, column, table_name='students'):
@@ -315,15 +823,8 @@ def check_column(name, column, table_name='students'):
     Returns:
         bool: True if the column is present, False otherwise
     """    
-    # Connect to a database
-    connection = sqlite3.connect(name)
-    # Create a cursor object to interact with the database
-    cursor = connection.cursor()
     # Check if the column is present
-    cursor.execute(f"PRAGMA table_info({table_name})")
-    columns = cursor.fetchall()
-    connection.close()
-    return column in [col[1] for col in columns]
+    return column in get_db_columns(name, table_name)
 
 def add_column(name, column, type, default=None, table_name='students'):
     """Add a column to the database
@@ -338,17 +839,529 @@ def add_column(name, column, type, default=None, table_name='students'):
     if check_column(name, column, table_name):
         print(f'Column {column} already present in the database {name}!')
         return
-    # Connect to a database
-    connection = sqlite3.connect(name)
-    # Create a cursor object to interact with the database
-    cursor = connection.cursor()
     # Add a column
     exec_str = f"ALTER TABLE {table_name} ADD COLUMN {column} {type}"
     if default is not None:
         exec_str += f" DEFAULT {default}"
-    cursor.execute(exec_str)
-    # Commit the changes
-    connection.commit()
-    # Close the connection
-    connection.close()
-    return
\ No newline at end of file
+    get_session(name).execute(exec_str)
+    invalidate_schema_cache(name, table_name)
+    return
+
+
+def get_db_indexes(name, table_name='students'):
+    """Get the indexes of a table
+
+    Args:
+        name (str): the file name containing the database
+        table_name (str, optional): the name of the table. Defaults to 'students'.
+
+    Returns:
+        dict: the columns and the uniqueness of each index, keyed by index name
+    """
+    session = get_session(name)
+    indexes = {}
+    index_list, _ = session.query(f"PRAGMA index_list({table_name})")
+    for index in index_list:
+        index_info, _ = session.query(f"PRAGMA index_info({index[1]})")
+        indexes[index[1]] = (tuple(col[2] for col in index_info), bool(index[2]))
+    return indexes
+
+
+def create_indexes(name, table_name='students', indexes=None):
+    """Create the indexes of a table, if not already present.
+
+    Indexes on columns missing from the table are skipped. If a unique index
+    cannot be created because of duplicated values, a plain index is created
+    instead and a warning is printed.
+
+    Args:
+        name (str): the file name containing the database
+        table_name (str, optional): the name of the table. Defaults to 'students'.
+        indexes (list, optional): a list of (columns, unique) tuples. Defaults to the ones in `DB_INDEXES`.
+
+    Returns:
+        list: the names of the indexes of the table that have been checked
+    """
+    if indexes is None:
+        indexes = DB_INDEXES.get(table_name, [])
+    if not indexes:
+        return []
+    session = get_session(name)
+    db_columns = get_db_columns(name, table_name)
+    index_names = []
+    for columns, unique in indexes:
+        if not all([col in db_columns for col in columns]):
+            continue
+        index_name = f"idx_{table_name}_{'_'.join(columns)}"
+        exec_str = f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {index_name} ON {table_name} ({', '.join(columns)})"
+        try:
+            session.execute(exec_str)
+        except sqlite3.IntegrityError:
+            session.rollback()
+            print(f'Warning: duplicated values of {columns} in {name}, a non-unique index is created')
+            session.execute(exec_str.replace('UNIQUE ', ''))
+        index_names.append(index_name)
+    return index_names
+
+
+def migrate_indexes(name):
+    """Create the indexes declared in `DB_INDEXES` for all the tables of an existing database
+
+    Args:
+        name (str): the file name containing the database
+
+    Raises:
+        ValueError: file name does not exist
+
+    Returns:
+        list: the names of the indexes that have been checked
+    """
+    if not os.path.exists(name): raise ValueError(f'Database {name} does not exist!')
+    index_names = []
+    for table_name in get_tables(name):
+        index_names += create_indexes(name, table_name)
+        # rebuild the search indexes, as VACUUM may renumber the rows
+        if table_name in SEARCH_INDEXES and create_search_index(name, table_name, rebuild=True):
+            index_names.append(f'{table_name}_search')
+    return index_names
+
+
+def migrate_dates(name):
+    """Rewrites the dates stored in the columns declared in `DATE_COLUMNS` as
+    ISO keys, for the databases written before the dates were normalised, so
+    that they sort and compare as dates. The values which are not dates are
+    left as they are. If the new key of a row clashes with a unique index,
+    the row already stored in ISO format is kept and the old one is deleted.
+
+    Args:
+        name (str): the file name containing the database
+
+    Raises:
+        ValueError: file name does not exist
+
+    Returns:
+        dict: the number of rows rewritten, keyed by table and column
+    """
+    if not os.path.exists(name): raise ValueError(f'Database {name} does not exist!')
+    session = get_session(name)
+    n_rows = {}
+    with session.lock:
+        try:
+            for table_name in get_tables(name):
+                if table_name not in DATE_COLUMNS:
+                    continue
+                columns = get_db_columns(name, table_name)
+                for column in DATE_COLUMNS[table_name]:
+                    if column not in columns:
+                        continue
+                    values, _ = session.query(f"SELECT DISTINCT {column} FROM {table_name} WHERE {column} IS NOT NULL")
+                    n_rewritten = 0
+                    for value in (v[0] for v in values):
+                        try:
+                            key = normalize_date(value)
+                        except ValueError:
+                            continue
+                        if key == value:
+                            continue
+                        n_rewritten += session.execute(f"UPDATE OR IGNORE {table_name} SET {column} = ? WHERE {column} = ?",
+                                                       (key, value), commit=False)
+                        # the rows left clash with the ones already stored with the new key
+                        session.execute(f"DELETE FROM {table_name} WHERE {column} = ?", (value,), commit=False)
+                    n_rows[f'{table_name}.{column}'] = n_rewritten
+            session.commit()
+        except sqlite3.Error:
+            session.rollback()
+            raise
+    return n_rows
+
+
+def fold_text(text):
+    """Folds a text for the search indexes: lower case, without accents and apostrophes
+
+    Args:
+        text (str): the text
+
+    Returns:
+        str: the folded text
+    """
+    text = unicodedata.normalize('NFKD', str(text).translate(_FOLDING_TABLE))
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return text.replace("'", '').replace('\u2019', '').lower()
+
+
+def _fold_sql(expr):
+    """SQL expressions folding a column as `fold_text` does, but for the lower
+    case, with built-in functions only. The replacements are split in stages,
+    each to be applied to the result of the previous one"""
+    replacements = [(c, base) for base, chars in SEARCH_FOLDING.items() for c in chars + chars.upper()]
+    replacements += [("''", ''), ('\u2019', '')]
+    stages = []
+    for i in range(0, len(replacements), FOLDING_STAGE_SIZE):
+        stage = expr
+        for c, base in replacements[i:i+FOLDING_STAGE_SIZE]:
+            stage = f"replace({stage}, '{c}', '{base}')"
+        stages.append(stage)
+    return stages
+
+
+def create_search_index(name, table_name='students', columns=None, rebuild=False, commit=True):
+    """Creates a full-text search index on some columns of a table, if not
+    already present: a FTS5 table with the trigram tokenizer indexing the
+    folded text of the columns, read from a view of the table, and kept up to
+    date by triggers on insert, update and delete, so that any client writing
+    the table maintains it.
+
+    Args:
+        name (str): the file name containing the database
+        table_name (str, optional): the name of the table. Defaults to 'students'.
+        columns (list, optional): the columns to index. Defaults to the ones in `SEARCH_INDEXES`.
+        rebuild (bool, optional): index again all the rows of the table. Defaults to False.
+        commit (bool, optional): if False, the changes are left in the open transaction
+            and the errors are raised. Defaults to True.
+
+    Returns:
+        bool: True if the index is available, False if SQLite has no FTS5 trigram tokenizer
+    """
+    if columns is None:
+        columns = SEARCH_INDEXES[table_name]
+    session = get_session(name)
+    fts_name = f'{table_name}_search'
+    view_name = f'{table_name}_search_text'
+    db_columns = get_db_columns(name, table_name)
+    columns = [col for col in columns if col in db_columns]
+    names = ', '.join(columns)
+    exists = fts_name in get_tables(name)
+    # each folding stage selects from the previous one, as SQLite limits the nesting of the expressions
+    folded = [f'{col}_folded' for col in columns]
+    stage = ', '.join(f'{col} AS {fold}' for col, fold in zip(columns, folded))
+    select = f"SELECT rowid AS id, {names}, {stage} FROM {table_name}"
+    for stage in zip(*[_fold_sql(fold) for fold in folded]):
+        stage = ', '.join(f'{expr} AS {fold}' for fold, expr in zip(folded, stage))
+        select = f"SELECT id, {names}, {stage} FROM ({select})"
+    # the texts in plain ASCII without apostrophes, most of them, are only turned to lower case
+    text = ', '.join(f"lower(CASE WHEN {col} GLOB {FOLDING_PATTERN} THEN {fold} ELSE {col} END) AS {col}"
+                     for col, fold in zip(columns, folded))
+    select = f"SELECT id, {text} FROM ({select})"
+    index_row = f"INSERT INTO {fts_name} (rowid, {names}) SELECT id, {names} FROM {view_name} WHERE id = new.rowid; "
+    remove_row = (f"INSERT INTO {fts_name} ({fts_name}, rowid, {names}) "
+                  f"SELECT 'delete', id, {names} FROM {view_name} WHERE id = old.rowid; ")
+    with session.lock:
+        try:
+            session.execute(f"CREATE VIEW IF NOT EXISTS {view_name} AS {select}", commit=False)
+            if not exists:
+                session.execute(f"CREATE VIRTUAL TABLE {fts_name} USING fts5({names}, content='{view_name}', "
+                                f"content_rowid='id', tokenize='trigram')", commit=False)
+            # the indexed text of a row is removed before the row is changed, then indexed again
+            session.execute(f"CREATE TRIGGER IF NOT EXISTS {fts_name}_insert AFTER INSERT ON {table_name} "
+                            f"BEGIN {index_row}END", commit=False)
+            session.execute(f"CREATE TRIGGER IF NOT EXISTS {fts_name}_remove BEFORE UPDATE OF {names} ON {table_name} "
+                            f"BEGIN {remove_row}END", commit=False)
+            session.execute(f"CREATE TRIGGER IF NOT EXISTS {fts_name}_update AFTER UPDATE OF {names} ON {table_name} "
+                            f"BEGIN {index_row}END", commit=False)
+            session.execute(f"CREATE TRIGGER IF NOT EXISTS {fts_name}_delete BEFORE DELETE ON {table_name} "
+                            f"BEGIN {remove_row}END", commit=False)
+            if rebuild or not exists:
+                session.execute(f"INSERT INTO {fts_name} ({fts_name}) VALUES ('rebuild')", commit=False)
+            if commit:
+                session.commit()
+        except sqlite3.OperationalError as e:
+            if not commit:
+                raise
+            session.rollback()
+            print(f'Warning: cannot create the search index of {table_name} in {name} ({e.args[0]})')
+            return False
+    return True
+
+
+def drop_search_triggers(name, table_name='students', commit=True):
+    """Drops the triggers updating the search index of a table, before writing
+    many rows at once: the index is then rebuilt once with `create_search_index`
+
+    Args:
+        name (str): the file name containing the database
+        table_name (str, optional): the name of the table. Defaults to 'students'.
+        commit (bool, optional): if True, commits the changes. Defaults to True.
+
+    Returns:
+        bool: True if the table had triggers for a search index
+    """
+    session = get_session(name)
+    triggers, _ = session.query("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ? AND name IN "
+                                f"({', '.join(['?']*len(SEARCH_TRIGGERS))})",
+                                (table_name,) + tuple(f'{table_name}_search_{t}' for t in SEARCH_TRIGGERS))
+    for trigger in triggers:
+        session.execute(f"DROP TRIGGER {trigger[0]}", commit=commit)
+    return len(triggers) > 0
+
+
+def search_table(name, text, table_name='students', columns=None, filter=None, params=(), 
+                 limit=20, min_similarity=0.6, candidates=200):
+    """Searches a table through its full-text search index, ranking the rows
+    by how well the searched text matches the indexed columns. The text is
+    matched without accents and case, by prefix or substring of every word,
+    and rows with typos are found through the trigrams they share with the text.
+
+    Args:
+        name (str): the file name containing the database
+        text (str): the searched text, e.g. a name and a surname
+        table_name (str, optional): the name of the table. Defaults to 'students'.
+        columns (list, optional): the columns returned. Defaults to all the columns of the table.
+        filter (str, optional): a condition on the rows of the table, prefixed by 't.' (e.g. 't.coorte = ?'). Defaults to None.
+        params (tuple, optional): the values bound to the placeholders of the filter. Defaults to ().
+        limit (int, optional): the maximum number of rows returned. Defaults to 20.
+        min_similarity (float, optional): the minimum similarity (0 to 1) of the rows matched with typos. Defaults to 0.6.
+        candidates (int, optional): the maximum number of rows compared for typos. Defaults to 200.
+
+    Raises:
+        ValueError: the table has no search index, created with the table or by `migrate_indexes`
+
+    Returns:
+        list: the rows (with the columns and the score, higher is better) sorted by score
+    """
+    if columns is None:
+        columns = get_db_columns(name, table_name)
+    fts_name = f'{table_name}_search'
+    if fts_name not in get_tables(name):
+        raise ValueError(f'No search index for {table_name} in {name}, run macros/migrate_indexes.py to create it')
+    indexed = SEARCH_INDEXES[table_name]
+    words = fold_text(text).split()
+    if not words:
+        return []
+    session = get_session(name)
+    select = (f"SELECT {', '.join('t.'+col for col in columns)}, {', '.join('t.'+col for col in indexed)} "
+              f"FROM {fts_name} AS f JOIN {table_name} AS t ON t.rowid = f.rowid WHERE ")
+    if filter:
+        select += f"({filter}) AND "
+    # rows where every word is a substring of a column (words shorter than a trigram are prefixes)
+    long_words = [w for w in words if len(w) >= 3]
+    conditions, values = [], []
+    if long_words:
+        conditions.append(f"{fts_name} MATCH ?")
+        values.append(' '.join('"' + w.replace('"', '""') + '"' for w in long_words))
+    for w in words:
+        if len(w) < 3:
+            conditions.append('(' + ' OR '.join(f"f.{col} LIKE ?" for col in indexed) + ')')
+            values += [w.replace('%', '').replace('_', '') + '%'] * len(indexed)
+    exact, _ = session.query(select + ' AND '.join(conditions) + f" LIMIT {candidates}", tuple(params) + tuple(values))
+    # rows sharing trigrams with the words, for typos
+    trigrams = sorted(set(w[i:i+3] for w in long_words for i in range(len(w)-2)))
+    fuzzy = []
+    if trigrams:
+        fuzzy, _ = session.query(select + f"{fts_name} MATCH ? ORDER BY rank LIMIT {candidates}",
+                                 tuple(params) + (' OR '.join('"' + t.replace('"', '""') + '"' for t in trigrams),))
+    query = ' '.join(words)
+    results = {}
+    for tier, rows in ((1., exact), (0., fuzzy)):
+        for row in rows:
+            key = row[:len(columns)]
+            if key in results:
+                continue
+            similarity = _similarity(query, [fold_text(v) for v in row[len(columns):] if v is not None])
+            if tier or similarity >= min_similarity:
+                results[key] = tier + similarity
+    ranked = sorted(results.items(), key=lambda item: -item[1])[:limit]
+    return [key + (round(score, 3),) for key, score in ranked]
+
+
+def _similarity(query, values):
+    """Best similarity between the query and the indexed values of a row,
+    taken alone or joined in any order (e.g. name and surname)"""
+    values = [v.split('@')[0] if '@' in v else v for v in values]
+    targets = values + [' '.join(values[:2]), ' '.join(values[:2][::-1])]
+    best = 0.
+    for target in targets:
+        if target.startswith(query):
+            return 1.
+        best = max(best, difflib.SequenceMatcher(None, query, target).ratio())
+    return best
+
+
+class CohortDB:
+    """The databases of a cohort attached to a single connection.
+
+    The students database is the main one, while the attendance, exams and
+    dates databases are attached as the `attendance`, `exams` and `dates`
+    schemas, so that they can be joined in a single SQL statement.
+
+    Args:
+        cohort (str): the academic year of attendance
+        students (str, optional): the file name of the students database. Defaults to 'data/students.db'.
+        attendance (str, optional): the file name of the attendance database. Defaults to 'data/attendance.db'.
+        exams (str, optional): the file name of the exams database. Defaults to 'data/exams.db'.
+        dates (str, optional): the file name of the dates database. Defaults to 'data/dates_<cohort>.db'.
+        pragmas (str or dict, optional): a preset in `PRAGMA_PRESETS` or a dictionary of pragmas. Defaults to 'read'.
+
+    Raises:
+        ValueError: the students database does not exist
+    """
+    def __init__(self, cohort, students='data/students.db', attendance='data/attendance.db',
+                 exams='data/exams.db', dates=None, pragmas='read'):
+        if dates is None:
+            dates = f'data/dates_{cohort.replace("/","_")}.db'
+        if not os.path.exists(students): raise ValueError(f'Database {students} does not exist!')
+        self.cohort = cohort
+        self.files = {'students': students, 'attendance': attendance, 'exams': exams, 'dates': dates}
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(students, check_same_thread=False)
+        if isinstance(pragmas, str):
+            pragmas = PRAGMA_PRESETS[pragmas]
+        for key, value in pragmas.items():
+            self.connection.execute(f"PRAGMA {key} = {value}")
+        # attach only the databases that exist, ATTACH would create them
+        self.schemas = ['main']
+        for schema in ('attendance', 'exams', 'dates'):
+            if os.path.exists(self.files[schema]):
+                self.connection.execute(f"ATTACH DATABASE ? AS {schema}", (self.files[schema],))
+                self.schemas.append(schema)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def query(self, query, params=()):
+        """Run a query on the attached databases and fetch its results
+
+        Args:
+            query (str): the query
+            params (tuple, optional): the parameters bound to the query. Defaults to ().
+
+        Returns:
+            tuple: the result of the query and its description
+        """
+        with self.lock:
+            cursor = self.connection.execute(query, params)
+            return cursor.fetchall(), cursor.description
+
+    def get_columns(self, schema, table_name):
+        """Get the columns of a table of an attached database
+
+        Args:
+            schema (str): the name of the attached database
+            table_name (str): the name of the table
+
+        Returns:
+            list: a list of the columns of the table
+        """
+        columns, _ = self.query(f"PRAGMA {schema}.table_info({table_name})")
+        return [col[1] for col in columns]
+
+    def attendance_query(self, max_hours=56):
+        """Creates the query of the attendance fraction of the students.
+
+        The hours of presence are divided by the hours of the dates with data,
+        capped at `max_hours`, and the fraction is capped at 1 (0 if no date
+        has hours). The attendance is matched to the dates by their `date_key`,
+        as in `lborg.data_helpers.get_attendance_matrix`, so that dates stored
+        in different formats agree: the attendance dates without a date in the
+        dates database count no hours.
+
+        Args:
+            max_hours (int, optional): the maximum number of hours required. Defaults to 56.
+
+        Returns:
+            tuple: the query, with `matricola` and `attendance` columns, and its parameters
+        """
+        if 'attendance' not in self.schemas or 'dates' not in self.schemas:
+            return "SELECT NULL AS matricola, NULL AS attendance WHERE 0", ()
+        tables, _ = self.query("SELECT name FROM attendance.sqlite_master WHERE type = 'table'")
+        dates, _ = self.query("SELECT date, hours FROM dates.dates")
+        dates = {date_key(d[0]): d[1] for d in dates}
+        if 'attendance_log' in [t[0] for t in tables]:
+            # the hours of the dates of the attendance, as stored in the log
+            log_dates, _ = self.query("SELECT DISTINCT date FROM attendance.attendance_log")
+            if not log_dates:
+                return "SELECT matricola, 0.0 AS attendance FROM attendance.attendance_log", ()
+            hours = tuple(chain.from_iterable((d[0], dates.get(date_key(d[0]), 0)) for d in log_dates))
+            query = (f"WITH h(date, hours) AS (VALUES {', '.join(['(?, ?)']*len(log_dates))}) "
+                     "SELECT l.matricola AS matricola, CASE WHEN v.hours > 0 THEN "
+                     "MIN(1.0, SUM(CASE WHEN l.present THEN h.hours ELSE 0 END)*1.0/v.hours) ELSE 0.0 END AS attendance "
+                     "FROM attendance.attendance_log l JOIN h ON h.date = l.date, "
+                     "(SELECT MIN(?, TOTAL(hours)) AS hours FROM h "
+                     "WHERE date IN (SELECT date FROM attendance.attendance_log WHERE present IS NOT NULL)) v "
+                     "GROUP BY l.matricola")
+            return query, hours + (max_hours,)
+        # match the columns to the dates by name, whatever the order of the columns
+        columns = [col for col in self.get_columns('attendance', 'attendance')[1:] if date_key(col) in dates]
+        hours = [dates[date_key(col)] for col in columns]
+        columns = [quote_identifier(col) for col in columns]
+        if not columns:
+            return "SELECT matricola, 0.0 AS attendance FROM attendance.attendance", ()
+        present = ' + '.join(f"(COALESCE(a.{col}, 0) != 0)*?" for col in columns)
+        valid = ' + '.join(f"MAX({col} IS NOT NULL)*?" for col in columns)
+        query = (f"SELECT a.matricola AS matricola, "
+                 f"CASE WHEN v.hours > 0 THEN MIN(1.0, ({present})*1.0/v.hours) ELSE 0.0 END AS attendance "
+                 f"FROM attendance.attendance a, "
+                 f"(SELECT MIN(?, {valid}) AS hours FROM attendance.attendance) v")
+        return query, tuple(hours) + (max_hours,) + tuple(hours)
+
+    def student_results(self, filter=None, params=(), order='cognome', max_hours=56):
+        """Returns the students of the cohort joined with their exam results and
+        attendance fraction, in a single query
+
+        Args:
+            filter (str, optional): an additional condition on the students table `s`, can use `?` placeholders. Defaults to None.
+            params (tuple, optional): the parameters bound to the placeholders in `filter`. Defaults to ().
+            order (str, optional): a column of the students table to order the output. Defaults to 'cognome'.
+            max_hours (int, optional): the maximum number of hours required for attendance. Defaults to 56.
+
+        Returns:
+            tuple: the result of the query and its description
+        """
+        exam_columns = self.get_columns('exams', 'exams')[1:] if 'exams' in self.schemas else []
+        attendance_query, attendance_params = self.attendance_query(max_hours)
+        query = "SELECT s.*"
+        for col in exam_columns:
+            query += f", e.{col}"
+        query += ", a.attendance FROM main.students s"
+        if exam_columns:
+            query += " LEFT JOIN exams.exams e ON e.matricola = s.matricola"
+        query += f" LEFT JOIN ({attendance_query}) a ON a.matricola = s.matricola"
+        query += " WHERE s.coorte = ?"
+        if filter is not None:
+            query += f" AND ({filter})"
+        if order is not None:
+            query += f" ORDER BY s.{order}"
+        return self.query(query, tuple(attendance_params) + (self.cohort,) + tuple(params))
+
+
+_cohort_dbs = {}
+_cohort_dbs_lock = threading.Lock()
+
+def get_cohort_db(cohort, **files):
+    """Returns the registered databases of a cohort, attaching them if needed
+
+    Args:
+        cohort (str): the academic year of attendance
+        **files: the file names of the databases, as in `CohortDB`
+
+    Returns:
+        CohortDB: the databases of the cohort
+    """
+    with _cohort_dbs_lock:
+        cohort_db = _cohort_dbs.get(cohort)
+        if cohort_db is not None and any(cohort_db.files[key] != value
+                                         for key, value in files.items() if value is not None):
+            cohort_db.close()
+            cohort_db = None
+        if cohort_db is None:
+            cohort_db = CohortDB(cohort, **files)
+            _cohort_dbs[cohort] = cohort_db
+    return cohort_db
+
+
+def close_cohort_dbs():
+    """Closes all the registered cohort databases"""
+    with _cohort_dbs_lock:
+        cohort_dbs = list(_cohort_dbs.values())
+        _cohort_dbs.clear()
+    for cohort_db in cohort_dbs:
+        cohort_db.close()
+
+atexit.register(close_cohort_dbs)
@@ -1,23 +1,19 @@
-from datetime import datetime
+import numpy as np
+import pandas as pd
+from itertools import islice
+from openpyxl import load_workbook
+from lborg.cache_helpers import cached_parse, cached_parse_chunks
+from lborg.date_helpers import normalize_date
 
-MONTHS_IT_TO_EN = {
-    'gen': 'jan', 'feb': 'feb', 'mar': 'mar', 'apr': 'apr',
-    'mag': 'may', 'giu': 'jun', 'lug': 'jul', 'ago': 'aug',
-    'set': 'sep', 'ott': 'oct', 'nov': 'nov', 'dic': 'dec'
-}
 
 def translate_date(date):
     """Translate dates from Italian to English format.
     Args:
-        date (list): List of dates in Italian
+        date (str): the date in Italian, e.g. '5 mar 2024'
     Returns:
-        list: List of dates in English format
+        str: the date in ISO format
     """
-    for it, en in MONTHS_IT_TO_EN.items():
-        date = date.replace(it, en)
-    td = datetime.strptime(date, '%d %b %Y')
-    formatted_date = td.strftime('%Y-%m-%d')
-    return formatted_date
+    return normalize_date(date)
 
 
 def get_dates_from_excel_columns(columns):
@@ -27,16 +23,91 @@ def get_dates_from_excel_columns(columns):
         columns (list): List of column names from an Excel sheet.
     
     Returns:
-        dict: Dictionary mapping dates to their corresponding column names.
+        dict: Dictionary mapping dates (in ISO format) to their corresponding column names.
     """
     dates_and_cols = {}
     for col in columns:
         if '10.30AM' in col:
-            date = "\'"+translate_date(col[:col.find('10.30AM')-1])+"\'"
+            date = normalize_date(col[:col.find('10.30AM')-1])
             dates_and_cols[date] = col
     return dates_and_cols
 
 
+def _header(row):
+    """Column names of a header row, named as pandas does for empty cells"""
+    return [str(col) if col is not None else f'Unnamed: {i}' for i, col in enumerate(row)]
+
+
+def get_excel_headers(excel_file):
+    """Read the header (first row) of each sheet of an Excel workbook, without
+    loading the rest of the workbook.
+    
+    Args:
+        excel_file (str): the Excel file name.
+    
+    Returns:
+        dict: the column names keyed by sheet name.
+    """
+    workbook = load_workbook(excel_file, read_only=True, data_only=True)
+    try:
+        headers = {}
+        for sheet in workbook.worksheets:
+            for row in sheet.iter_rows(max_row=1, values_only=True):
+                headers[sheet.title] = _header(row)
+        return headers
+    finally:
+        workbook.close()
+
+
+def iter_excel_chunks(excel_file, chunk_size=1000, columns=('Cognome', 'Nome')):
+    """Read an Excel workbook lazily, in read-only mode, yielding its rows in
+    chunks so that large registers are read in bounded memory. Only the sheets
+    whose header (first row) contains `columns` are read.
+    
+    Args:
+        excel_file (str): the Excel file name.
+        chunk_size (int, optional): the number of rows per chunk. Defaults to 1000.
+        columns (tuple, optional): the columns required in a sheet. Defaults to ('Cognome', 'Nome').
+    
+    Yields:
+        pd.DataFrame: a chunk of rows of a sheet, with the header as column names.
+    """
+    workbook = load_workbook(excel_file, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            rows = sheet.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None: continue
+            header = _header(header)
+            if not all(col in header for col in columns): continue
+            while True:
+                chunk = list(islice(rows, chunk_size))
+                if not chunk: break
+                yield pd.DataFrame(chunk, columns=header)
+    finally:
+        workbook.close()
+
+
+def get_attendance_matrix_from_excel(data):
+    """Extract the attendance from an Excel sheet as a presence matrix, parsing
+    a whole date column at once with pandas string operations.
+    
+    Args:
+        data (pd.DataFrame): the Excel sheet, with 'Cognome', 'Nome' and date columns.
+    
+    Returns:
+        tuple: the (cognome, nome) of the students, the dates and the presence
+        matrix (students x dates, 1 if the cell contains P, R or G)
+    """
+    dates_and_cols = get_dates_from_excel_columns(data.keys())
+    names = list(zip(data['Cognome'], data['Nome']))
+    cells = data[list(dates_and_cols.values())].fillna('').astype(str)
+    presence = np.empty((len(data), len(dates_and_cols)), dtype=np.uint8)
+    for i, col in enumerate(dates_and_cols.values()):
+        presence[:, i] = cells[col].str.contains('[PRG]', regex=True).to_numpy()
+    return names, list(dates_and_cols.keys()), presence
+
+
 def get_attendance_from_excel(data):
     """Extract attendance data from Excel rows.
     
@@ -46,15 +117,52 @@ def get_attendance_from_excel(data):
     Returns:
         dict: Dictionary with student IDs as keys and their attendance as values.
     """
+    names, dates, presence = get_attendance_matrix_from_excel(data)
     attendance = {}
-    dates_and_cols = get_dates_from_excel_columns(data.keys())  # Assuming first row contains column names
-    for date, col in dates_and_cols.items():
-        attendance_info = []
-        for index, row in data.iterrows():
-            attendance_info += [{
-                "nome": row['Nome'],
-                "cognome": row['Cognome'],
-                "presente": 1 if any(x in row[dates_and_cols[date]] for x in ('P', 'R', 'G')) else 0
-            }]
-        attendance[date] = attendance_info
-    return attendance
\ No newline at end of file
+    for i, date in enumerate(dates):
+        attendance[date] = [{"nome": nome, "cognome": cognome, "presente": int(p)} 
+                            for (cognome, nome), p in zip(names, presence[:, i])]
+    return attendance
+
+
+def read_attendance_from_excel(excel_file, chunk_size=1000):
+    """Parse the attendance of an Excel workbook, reading it in chunks of rows.
+    
+    Args:
+        excel_file (str): the Excel file name.
+        chunk_size (int, optional): the number of rows per chunk. Defaults to 1000.
+    
+    Yields:
+        tuple: the (names, dates, presence) of a chunk, as in `get_attendance_matrix_from_excel`.
+    """
+    for data in iter_excel_chunks(excel_file, chunk_size):
+        yield get_attendance_matrix_from_excel(data)
+
+
+def load_attendance_from_excel(excel_file, chunk_size=1000, cache_dir=None):
+    """Parse the attendance of an Excel workbook through the parse cache, a
+    chunk at a time, whether the chunks are parsed or read from the cache.
+    
+    Args:
+        excel_file (str): the Excel file name.
+        chunk_size (int, optional): the number of rows per chunk. Defaults to 1000.
+        cache_dir (str, optional): the cache directory. Defaults to `lborg.cache_helpers.CACHE_DIR`.
+    
+    Yields:
+        tuple: the (names, dates, presence) of a chunk, as in `get_attendance_matrix_from_excel`.
+    """
+    yield from cached_parse_chunks(excel_file, lambda f: read_attendance_from_excel(f, chunk_size), 
+                                   f'excel_attendance_{chunk_size}', cache_dir)
+
+
+def load_excel_headers(excel_file, cache_dir=None):
+    """Read the header of each sheet of an Excel workbook through the parse cache.
+    
+    Args:
+        excel_file (str): the Excel file name.
+        cache_dir (str, optional): the cache directory. Defaults to `lborg.cache_helpers.CACHE_DIR`.
+    
+    Returns:
+        dict: the column names keyed by sheet name.
+    """
+    return cached_parse(excel_file, get_excel_headers, 'excel_headers', cache_dir)
@@ -0,0 +1,159 @@
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from lborg.record_helpers import iter_records
+from lborg.db import Session, migrate_indexes, create_indexes
+from lborg.data_helpers import (get_students_ids, resolve_attendance, resolve_attendance_from_excel,
+                                write_attendance, get_exams_ids, resolve_exams, get_exams_marks,
+                                merge_exams_marks, write_exams_marks)
+
+EXCEL_EXTENSIONS = ('.xlsx', '.xlsm')
+
+
+def _resolve_attendance_file(file_name, ids):
+    """Parses an attendance file (json, NDJSON, CSV or excel) and resolves it to the student ids"""
+    if os.path.splitext(file_name)[1].lower() in EXCEL_EXTENSIONS:
+        cells = {}
+        n_rows = 0
+        for n_chunk, chunk in resolve_attendance_from_excel(file_name, ids):
+            cells.update(chunk)
+            n_rows += n_chunk
+        if not n_rows:
+            raise ValueError(f'No data found in {file_name}')
+        return cells
+    return resolve_attendance(iter_records(file_name, 'attendance'), ids)
+
+
+def _resolve_exams_file(file_name, ids):
+    """Parses an exams file (json, NDJSON or CSV) and resolves it to the student ids"""
+    return resolve_exams(iter_records(file_name, 'marks'), ids)
+
+
+def _writer(results, apply, batch_size, errors):
+    """Applies the results in the queue in batches, until a None is found"""
+    done = False
+    while not done:
+        batch = [results.get()]
+        # take what is already available, up to the batch size
+        while len(batch) < batch_size:
+            try:
+                batch.append(results.get_nowait())
+            except queue.Empty:
+                break
+        if None in batch:
+            batch = batch[:batch.index(None)]
+            done = True
+        if batch and not errors:
+            try:
+                apply(batch)
+            except Exception as e:
+                errors.append(e)
+
+
+def run_pipeline(files, resolve, args, apply, jobs=None, batch_size=8):
+    """Parses and resolves many input files in a pool of processes, while a
+    single writer thread applies the results to the database in batches.
+    The results are applied in the order of the files, whatever the order
+    in which they are parsed, so the outcome is the same as for a sequential run.
+
+    Args:
+        files (list): the input file names
+        resolve (callable): the function parsing a file, called as resolve(file_name, *args) in a worker process
+        args (tuple): the extra arguments of `resolve`, which must be picklable
+        apply (callable): the function writing a list of results to the database, in the writer thread
+        jobs (int, optional): the number of worker processes, parsing in the calling process if 1. Defaults to the number of CPUs.
+        batch_size (int, optional): the maximum number of results written at once. Defaults to 8.
+
+    Raises:
+        Exception: the first error raised by the writer
+
+    Returns:
+        int: the number of files applied
+    """
+    results = queue.Queue(maxsize=2*batch_size)
+    errors = []
+    writer = threading.Thread(target=_writer, args=(results, apply, batch_size, errors), daemon=True)
+    writer.start()
+    try:
+        if jobs == 1 or len(files) < 2:
+            for file_name in files:
+                results.put(resolve(file_name, *args))
+        else:
+            with ProcessPoolExecutor(min(jobs or os.cpu_count() or 1, len(files))) as pool:
+                futures = [pool.submit(resolve, file_name, *args) for file_name in files]
+                for future in futures:
+                    results.put(future.result())
+    finally:
+        results.put(None)
+        writer.join()
+    if errors:
+        raise errors[0]
+    return len(files)
+
+
+def ingest_attendance_files(files, db_students_name, db_attendance_name, jobs=None, batch_size=8):
+    """Updates the attendance database with many json or excel files, parsed
+    in parallel and written by a single thread, a transaction per batch of files
+
+    Args:
+        files (list): the json or excel file names with attendance data
+        db_students_name (str): the file name of the database with students
+        db_attendance_name (str): the file name of the database with attendance
+        jobs (int, optional): the number of worker processes. Defaults to the number of CPUs.
+        batch_size (int, optional): the maximum number of files written at once. Defaults to 8.
+
+    Returns:
+        int: the number of attendance entries written
+    """
+    written = [0]
+    def apply(batch):
+        # later files override the earlier ones
+        cells = {}
+        for result in batch:
+            cells.update(result)
+        write_attendance(db_attendance_name, cells)
+        written[0] += len(cells)
+    with Session(db_students_name, 'read'), Session(db_attendance_name, 'bulk'):
+        migrate_indexes(db_attendance_name)
+        # resolve the students once, for all the workers
+        ids = get_students_ids(db_students_name)
+        run_pipeline(files, _resolve_attendance_file, (ids,), apply, jobs, batch_size)
+    print(f'Updated {written[0]} attendance entries in {db_attendance_name} from {len(files)} files')
+    return written[0]
+
+
+def ingest_exams_files(files, db_students_name, db_exams_name, exam_type='written', force=False,
+                       jobs=None, batch_size=8):
+    """Updates the exams database with many json files, parsed in parallel and
+    written by a single thread, a transaction per batch of files
+
+    Args:
+        files (list): the json file names with the exams results
+        db_students_name (str): the file name of the database with students
+        db_exams_name (str): the file name of the database with the exams results
+        exam_type (str, optional): the type of exams given (written, reports, result). Defaults to 'written'.
+        force (bool, optional): force the update of the database. Defaults to False.
+        jobs (int, optional): the number of worker processes. Defaults to the number of CPUs.
+        batch_size (int, optional): the maximum number of files written at once. Defaults to 8.
+
+    Returns:
+        int: the number of students whose mark has been updated
+    """
+    updated = set()
+    with Session(db_students_name, 'read'), Session(db_exams_name, 'bulk'):
+        create_indexes(db_students_name, 'students')
+        create_indexes(db_exams_name, 'exams')
+        # resolve the students ids and the groups once, for all the workers
+        ids = get_exams_ids(db_students_name, exam_type)
+        marks = get_exams_marks(db_exams_name, exam_type)
+        def apply(batch):
+            batch_updated = set()
+            for results in batch:
+                batch_updated |= merge_exams_marks(marks, results, exam_type, force)
+            write_exams_marks(db_exams_name, exam_type,
+                              [(matricola,) + marks[matricola] for matricola in sorted(batch_updated)])
+            updated.update(batch_updated)
+        run_pipeline(files, _resolve_exams_file, (ids,), apply, jobs, batch_size)
+    print(f'Updated {len(updated)} {exam_type} marks in {db_exams_name} from {len(files)} files')
+    return len(updated)
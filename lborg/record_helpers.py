@@ -0,0 +1,153 @@
+import os
+import csv
+import json
+from itertools import islice
+from lborg.cache_helpers import load_json
+
+# Extensions of the line-delimited formats, read lazily a record at a time
+NDJSON_EXTENSIONS = ('.ndjson', '.jsonl')
+CSV_EXTENSIONS = ('.csv',)
+
+# Layouts of the records, i.e. the nesting of the json files they are read from:
+#   roster:     [[{cognome, nome, matricola, indirizzoemail}, ...]]
+#   groups:     [[{cognome, nome, gruppo, [matricola], [indirizzoemail]}, ...]]
+#   attendance: {date: [{cognome, nome, presente}, ...]}
+#   marks:      {date: {matricola or gruppo: mark}}
+# In the line-delimited formats each record is flat and carries its 'date',
+# the marks records give the student or group in 'key', 'matricola' or 'gruppo'
+RECORD_LAYOUTS = ('roster', 'groups', 'attendance', 'marks')
+
+
+def is_record_file(file_name):
+    """Whether a file is in one of the line-delimited formats (NDJSON or CSV)
+
+    Args:
+        file_name (str): the file name
+
+    Returns:
+        bool: True for NDJSON and CSV files
+    """
+    return os.path.splitext(file_name)[1].lower() in NDJSON_EXTENSIONS + CSV_EXTENSIONS
+
+
+def iter_ndjson(file_name):
+    """Reads the records of a NDJSON file, one line at a time
+
+    Args:
+        file_name (str): the file name
+
+    Raises:
+        ValueError: a line is not a json object
+
+    Yields:
+        dict: the records
+    """
+    with open(file_name, encoding='utf-8') as f:
+        for n, line in enumerate(f):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError(f'Line {n+1} of {file_name} is not a json object')
+            yield record
+
+
+def iter_csv(file_name):
+    """Reads the records of a CSV file with a header line, one line at a time.
+    The delimiter (comma, semicolon or tab) is guessed from the first lines
+
+    Args:
+        file_name (str): the file name
+
+    Yields:
+        dict: the records, with the empty values set to None
+    """
+    with open(file_name, newline='', encoding='utf-8-sig') as f:
+        try:
+            dialect = csv.Sniffer().sniff(f.read(4096), delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+        f.seek(0)
+        for record in csv.DictReader(f, dialect=dialect):
+            yield {key.strip(): value if value != '' else None
+                   for key, value in record.items() if key is not None}
+
+
+def _iter_json(file_name, layout):
+    """Reads the records of a json file, flattening its nested layout"""
+    data = load_json(file_name)
+    if layout in ('roster', 'groups'):
+        yield from (data[0] if data else [])
+    elif layout == 'attendance':
+        for date, students in data.items():
+            for student in students:
+                yield dict(student, date=date)
+    else:
+        for date, results in data.items():
+            for key, mark in results.items():
+                yield {'date': date, 'key': key, 'mark': mark}
+
+
+def iter_records(file_name, layout):
+    """Reads the records of an input file as flat dictionaries, whatever its
+    format: NDJSON and CSV files are read lazily a line at a time, the json
+    files in the nested layouts are loaded (through the parse cache) and flattened
+
+    Args:
+        file_name (str): the file name
+        layout (str): the layout of the records, one of `RECORD_LAYOUTS`
+
+    Raises:
+        ValueError: unknown layout
+
+    Yields:
+        dict: the records
+    """
+    if layout not in RECORD_LAYOUTS:
+        raise ValueError(f'Unknown record layout {layout}')
+    ext = os.path.splitext(file_name)[1].lower()
+    if ext in NDJSON_EXTENSIONS:
+        records = iter_ndjson(file_name)
+    elif ext in CSV_EXTENSIONS:
+        records = iter_csv(file_name)
+    else:
+        records = _iter_json(file_name, layout)
+    if layout != 'marks':
+        yield from records
+        return
+    for record in records:
+        if 'key' not in record:
+            record['key'] = record['matricola'] if record.get('matricola') is not None else record.get('gruppo')
+        yield record
+
+
+def batched(iterable, size):
+    """Splits an iterable in lists of fixed size (the last one can be shorter)
+
+    Args:
+        iterable (iterable): the items
+        size (int): the number of items in each list
+
+    Yields:
+        list: the items, `size` at a time
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def as_bool(value):
+    """Converts the value of a flag read from json or CSV (1, '1', 'true', 'si'...) to a boolean
+
+    Args:
+        value (any): the value
+
+    Returns:
+        bool: the flag
+    """
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'si', 'sì', 'x')
+    return value == 1
@@ -0,0 +1,152 @@
+import os
+import json
+import hashlib
+import threading
+from lborg.db import get_session, quote_identifier
+from lborg.cache_helpers import _write_atomic
+from lborg.snapshot_helpers import source_signature
+
+# Version of the reports, to be increased when their layout changes so that they are all regenerated
+REPORT_VERSION = 2
+# File in the latex directory with the fingerprints of the generated reports
+REPORTS_MANIFEST = 'reports.json'
+
+_reports_lock = threading.Lock()
+
+
+def table_checksum(name, table_name, filter=None, params=()):
+    """Computes the SHA-256 checksum of the rows of a table, in storage order
+
+    Args:
+        name (str): the file name containing the database
+        table_name (str): the name of the table
+        filter (str, optional): a condition on the rows, with `?` placeholders. Defaults to None.
+        params (tuple, optional): the values bound to the placeholders of the filter. Defaults to ().
+
+    Returns:
+        str: the hexadecimal digest
+    """
+    query = f"SELECT * FROM {quote_identifier(table_name)}"
+    if filter:
+        query += f" WHERE {filter}"
+    data, desc = get_session(name).query(query + " ORDER BY rowid", tuple(params))
+    sha = hashlib.sha256(repr([d[0] for d in desc]).encode())
+    for row in data:
+        sha.update(repr(row).encode())
+    return sha.hexdigest()
+
+
+def report_fingerprint(kind, cohort, params, inputs):
+    """Computes the fingerprint of a report from its inputs
+
+    Args:
+        kind (str): the kind of report, e.g. 'attendance'
+        cohort (str): the cohort of the report
+        params (dict): the parameters of the report (json serialisable)
+        inputs (list): the (db_name, table_name, filter, params) tuples of the tables read by the report
+
+    Returns:
+        str: the hexadecimal digest
+    """
+    tables = [[os.path.abspath(name), table_name, filter, list(table_params),
+               table_checksum(name, table_name, filter, table_params)]
+              for name, table_name, filter, table_params in inputs]
+    content = json.dumps([REPORT_VERSION, kind, cohort, params, tables], sort_keys=True, default=str)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def _read_reports(output_dir):
+    try:
+        with open(os.path.join(output_dir, 'latex', REPORTS_MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _update_reports(output_dir, report_id, record):
+    with _reports_lock:
+        reports = _read_reports(output_dir)
+        reports[report_id] = record
+        os.makedirs(os.path.join(output_dir, 'latex'), exist_ok=True)
+        _write_atomic(os.path.join(output_dir, 'latex', REPORTS_MANIFEST), json.dumps(reports, indent=1), 'w')
+
+
+def _sources(inputs):
+    names = sorted(set(name for name, *_ in inputs))
+    return [names, source_signature(*names)]
+
+
+def _is_fresh(output_dir, report_id, record):
+    """Checks whether a recorded report is up to date: its artifacts exist
+    and either its input files or the fingerprint of its inputs did not change"""
+    if record is None or not all(os.path.exists(artifact) for artifact in record['artifacts']):
+        return False
+    inputs = [tuple(i) for i in record['inputs']]
+    if any(not os.path.exists(name) for name, *_ in inputs):
+        return False
+    if record.get('sources') == _sources(inputs):
+        return True
+    if report_fingerprint(record['kind'], record['cohort'], record['params'], inputs) != record['fingerprint']:
+        return False
+    # the files changed but not the data read by the report
+    _update_reports(output_dir, report_id, dict(record, sources=_sources(inputs)))
+    return True
+
+
+def get_report(output_dir, report_id, kind, cohort, params, inputs):
+    """Returns the artifacts of a report if it was already generated from the
+    same inputs, cohort and parameters
+
+    Args:
+        output_dir (str): the output directory of the report
+        report_id (str): the name of the report
+        kind (str): the kind of report, e.g. 'attendance'
+        cohort (str): the cohort of the report
+        params (dict): the parameters of the report (json serialisable)
+        inputs (list): the (db_name, table_name, filter, params) tuples of the tables read by the report
+
+    Returns:
+        list: the file names of the artifacts, None if the report has to be generated
+    """
+    record = _read_reports(output_dir).get(report_id)
+    if record is None or [record['kind'], record['cohort'], record['params']] != \
+            json.loads(json.dumps([kind, cohort, params], default=str)):
+        return None
+    if record['inputs'] != json.loads(json.dumps([list(i) for i in inputs], default=str)):
+        return None
+    return record['artifacts'] if _is_fresh(output_dir, report_id, record) else None
+
+
+def record_report(output_dir, report_id, kind, cohort, params, inputs, artifacts):
+    """Records the fingerprint of the inputs of a generated report, along with its artifacts
+
+    Args:
+        output_dir (str): the output directory of the report
+        report_id (str): the name of the report
+        kind (str): the kind of report, e.g. 'attendance'
+        cohort (str): the cohort of the report
+        params (dict): the parameters of the report (json serialisable)
+        inputs (list): the (db_name, table_name, filter, params) tuples of the tables read by the report
+        artifacts (list): the file names of the files generated
+    """
+    record = {'kind': kind, 'cohort': cohort, 'params': params,
+              'inputs': [list(i) for i in inputs], 'artifacts': list(artifacts),
+              'fingerprint': report_fingerprint(kind, cohort, params, inputs),
+              'sources': _sources(inputs)}
+    _update_reports(output_dir, report_id, json.loads(json.dumps(record, default=str)))
+
+
+def stale_reports(output_dir='pdfs', cohort=None):
+    """Returns the reports whose inputs changed since they were generated, or
+    whose artifacts are missing. Reports whose input files did not change are
+    checked without reading the databases
+
+    Args:
+        output_dir (str, optional): the output directory of the reports. Defaults to 'pdfs'.
+        cohort (str, optional): check only the reports of a cohort. Defaults to None.
+
+    Returns:
+        list: the names of the stale reports
+    """
+    return [report_id for report_id, record in sorted(_read_reports(output_dir).items())
+            if (cohort is None or record['cohort'] == cohort) and not _is_fresh(output_dir, report_id, record)]
@@ -0,0 +1,284 @@
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+from lborg.cache_helpers import CACHE_DIR, _write_atomic
+from lborg.db import get_session
+from lborg.data_helpers import get_attendance_matrix
+
+# Version of the snapshot files, to be increased when their content changes
+SNAPSHOT_VERSION = 2
+# Minimum attendance fraction required to take the exams
+ELIGIBILITY_THRESHOLD = 0.75
+# Number of bits set in each byte
+POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+SNAPSHOT_ARRAYS = ('ids', 'dates', 'hours', 'presence', 'recorded')
+
+
+class AttendanceSnapshot:
+    """The attendance of a cohort as bit-packed arrays (students x dates):
+    a bit for the presence and a bit for whether the attendance was recorded,
+    along with the student ids, the dates and their hours.
+
+    The arrays are memory-mapped when the snapshot is loaded from disk.
+    """
+    def __init__(self, ids, dates, hours, presence, recorded, source=None):
+        """
+        Args:
+            ids (np.array): the student ids, one per row
+            dates (np.array): the dates (ISO format), one per column
+            hours (np.array): the hours of each date
+            presence (np.array): the packed presence bits (students x ceil(dates/8))
+            recorded (np.array): the packed bits of the recorded entries (students x ceil(dates/8))
+            source (list, optional): the signature of the databases the snapshot was built from. Defaults to None.
+        """
+        self.ids = ids
+        self.dates = dates
+        self.hours = hours
+        self.presence = presence
+        self.recorded = recorded
+        self.source = source
+        self._rows = None
+
+    @classmethod
+    def from_matrix(cls, ids, presence, hours, dates, source=None):
+        """Packs the presence matrix (students x dates, NaN where there is no data)
+
+        Returns:
+            AttendanceSnapshot: the snapshot
+        """
+        recorded = ~np.isnan(presence)
+        present = np.nan_to_num(presence) != 0
+        return cls(np.asarray(ids, dtype=np.int64), np.asarray(dates, dtype=str),
+                   np.asarray(hours, dtype=float), np.packbits(present, axis=1),
+                   np.packbits(recorded, axis=1), source)
+
+    @property
+    def n_dates(self):
+        return len(self.dates)
+
+    def row(self, matricola):
+        """Returns the row of a student, or None if the student is not in the snapshot"""
+        if self._rows is None:
+            self._rows = {matr.item(): i for i, matr in enumerate(self.ids)}
+        return self._rows.get(matricola)
+
+    def unpack(self, bits):
+        """Unpacks a bit array to a boolean matrix (students x dates)"""
+        return np.unpackbits(bits, axis=1, count=self.n_dates).astype(bool)
+
+    def presence_matrix(self):
+        """Returns the presence matrix (students x dates, NaN where there is no data)"""
+        presence = self.unpack(self.presence).astype(float)
+        presence[~self.unpack(self.recorded)] = np.nan
+        return presence
+
+    def student_counts(self):
+        """Returns the number of presences of each student"""
+        return POPCOUNT[self.presence].sum(axis=1, dtype=np.int64)
+
+    def date_counts(self):
+        """Returns the number of presences and of recorded entries of each date"""
+        return (self.unpack(self.presence).sum(axis=0, dtype=np.int64),
+                self.unpack(self.recorded).sum(axis=0, dtype=np.int64))
+
+    def recorded_dates(self):
+        """Returns the mask of the dates with data for any student"""
+        if not len(self.ids):
+            return np.zeros(self.n_dates, dtype=bool)
+        return np.unpackbits(np.bitwise_or.reduce(self.recorded, axis=0), count=self.n_dates).astype(bool)
+
+    def fractions(self, max_hours=56):
+        """Computes the attendance fraction of all the students: the hours of
+        presence are divided by the hours of the dates with data for any
+        student, capped at `max_hours`, and the fraction is capped at 1
+
+        Args:
+            max_hours (int, optional): the maximum number of hours required. Defaults to 56.
+
+        Returns:
+            np.array: the attendance fraction of each student
+        """
+        valid_hours = min(self.hours[self.recorded_dates()].sum(), max_hours)
+        if valid_hours <= 0:
+            return np.zeros(len(self.ids))
+        attended = self.unpack(self.presence) @ self.hours
+        return np.minimum(attended/valid_hours, 1.)
+
+    def attendance(self, matricola=None, max_hours=56):
+        """Returns the attendance fractions keyed by student id, as `calculate_attendance` does
+
+        Args:
+            matricola (int, optional): the id of a single student. Defaults to None.
+            max_hours (int, optional): the maximum number of hours required. Defaults to 56.
+
+        Returns:
+            dict: the attendance fraction keyed by student id
+        """
+        fractions = self.fractions(max_hours)
+        if matricola is None:
+            return {matr.item(): frac.item() for matr, frac in zip(self.ids, fractions)}
+        i = self.row(matricola)
+        return {} if i is None else {matricola: fractions[i].item()}
+
+    def eligible(self, threshold=ELIGIBILITY_THRESHOLD, max_hours=56):
+        """Returns the ids of the students with an attendance fraction above the threshold
+
+        Args:
+            threshold (float, optional): the minimum attendance fraction. Defaults to `ELIGIBILITY_THRESHOLD`.
+            max_hours (int, optional): the maximum number of hours required. Defaults to 56.
+
+        Returns:
+            np.array: the ids of the eligible students
+        """
+        return self.ids[self.fractions(max_hours) > threshold]
+
+    def save(self, snapshot_dir):
+        """Saves the arrays in a directory, the metadata last so that a
+        partially written snapshot is never loaded
+
+        Args:
+            snapshot_dir (str): the directory of the snapshot
+        """
+        os.makedirs(snapshot_dir, exist_ok=True)
+        meta_file = os.path.join(snapshot_dir, 'meta.json')
+        if os.path.exists(meta_file):
+            os.remove(meta_file)
+        for name in SNAPSHOT_ARRAYS:
+            tmp_name = os.path.join(snapshot_dir, f'{name}.{os.getpid()}.{threading.get_ident()}.tmp.npy')
+            np.save(tmp_name, getattr(self, name))
+            os.replace(tmp_name, os.path.join(snapshot_dir, f'{name}.npy'))
+        _write_atomic(meta_file, json.dumps({'version': SNAPSHOT_VERSION, 'source': self.source}), 'w')
+
+    @classmethod
+    def load(cls, snapshot_dir):
+        """Loads a snapshot from a directory, memory-mapping its arrays
+
+        Args:
+            snapshot_dir (str): the directory of the snapshot
+
+        Returns:
+            AttendanceSnapshot: the snapshot, None if missing or from another version
+        """
+        try:
+            with open(os.path.join(snapshot_dir, 'meta.json')) as f:
+                meta = json.load(f)
+            if meta.get('version') != SNAPSHOT_VERSION:
+                return None
+            arrays = {}
+            for name in SNAPSHOT_ARRAYS:
+                file_name = os.path.join(snapshot_dir, f'{name}.npy')
+                try:
+                    arrays[name] = np.load(file_name, mmap_mode='r')
+                except ValueError:
+                    # empty arrays cannot be memory-mapped
+                    arrays[name] = np.load(file_name)
+        except (OSError, ValueError):
+            return None
+        return cls(source=meta['source'], **arrays)
+
+
+def source_signature(*db_names):
+    """Returns a signature of the content of databases, changing whenever
+    they are written by any process: size and modification time of the
+    files (and of their write-ahead logs) along with the change counter in
+    the database header
+
+    Args:
+        db_names (str): the file names of the databases
+
+    Returns:
+        list: the signature
+    """
+    signature = []
+    for name in db_names:
+        for file_name in (name, name+'-wal'):
+            try:
+                stat = os.stat(file_name)
+            except OSError:
+                signature.append(None)
+                continue
+            signature.append([stat.st_size, stat.st_mtime_ns])
+        with open(name, 'rb') as f:
+            f.seek(24)
+            signature.append(int.from_bytes(f.read(4), 'big'))
+    return signature
+
+
+def snapshot_path(db_name, db_dates, snapshot_dir=None):
+    """Returns the directory of the snapshot of an attendance database
+
+    Args:
+        db_name (str): the file name with the attendance database
+        db_dates (str): the file name with the dates database
+        snapshot_dir (str, optional): the directory of the snapshots. Defaults to 'snapshots' in `CACHE_DIR`.
+
+    Returns:
+        str: the directory of the snapshot, None if the cache is disabled
+    """
+    if snapshot_dir is None:
+        if not CACHE_DIR:
+            return None
+        snapshot_dir = os.path.join(CACHE_DIR, 'snapshots')
+    key = hashlib.sha1(f'{os.path.abspath(db_name)}\n{os.path.abspath(db_dates)}'.encode()).hexdigest()[:16]
+    return os.path.join(snapshot_dir, f'{os.path.splitext(os.path.basename(db_name))[0]}-{key}')
+
+
+def build_snapshot(db_name, db_dates, snapshot_dir=None):
+    """Builds the snapshot of an attendance database and saves it
+
+    Args:
+        db_name (str): the file name with the attendance database
+        db_dates (str): the file name with the dates database
+        snapshot_dir (str, optional): the directory of the snapshots. Defaults to 'snapshots' in `CACHE_DIR`.
+
+    Returns:
+        AttendanceSnapshot: the snapshot
+    """
+    source = source_signature(db_name, db_dates)
+    ids, presence, hours, dates = get_attendance_matrix(db_name, db_dates, with_dates=True)
+    snapshot = AttendanceSnapshot.from_matrix(ids, presence, hours, dates, source)
+    path = snapshot_path(db_name, db_dates, snapshot_dir)
+    if path is not None:
+        snapshot.save(path)
+    return snapshot
+
+
+# Snapshots in use, keyed by the databases and stored along with the version of their data
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+def get_attendance_snapshot(db_name='data/dummy_attendance.db', db_dates='data/dummy_dates.db', snapshot_dir=None):
+    """Returns the snapshot of an attendance database. The snapshot in use is
+    kept until the data version of the databases changes, then the one on
+    disk is loaded if built from the same data, or a new one is built
+
+    Args:
+        db_name (str, optional): the file name with the attendance database. Defaults to 'data/dummy_attendance.db'.
+        db_dates (str, optional): the file name with the dates database. Defaults to 'data/dummy_dates.db'.
+        snapshot_dir (str, optional): the directory of the snapshots. Defaults to 'snapshots' in `CACHE_DIR`.
+
+    Raises:
+        ValueError: database not found
+
+    Returns:
+        AttendanceSnapshot: the snapshot
+    """
+    for name in (db_name, db_dates):
+        if not os.path.exists(name):
+            raise ValueError(f'Database {name} not found!')
+    key = (os.path.abspath(db_name), os.path.abspath(db_dates), snapshot_dir)
+    version = (get_session(db_name).data_version(), get_session(db_dates).data_version())
+    with _snapshots_lock:
+        cached = _snapshots.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    path = snapshot_path(db_name, db_dates, snapshot_dir)
+    snapshot = AttendanceSnapshot.load(path) if path is not None else None
+    if snapshot is None or snapshot.source != source_signature(db_name, db_dates):
+        snapshot = build_snapshot(db_name, db_dates, snapshot_dir)
+    with _snapshots_lock:
+        _snapshots[key] = (version, snapshot)
+    return snapshot
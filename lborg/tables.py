@@ -1,7 +1,14 @@
+import io
 import os
-import numpy as np
+import json
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from tabulate import tabulate
-from lborg.data_helpers import get_groups, get_attendance, get_hours, calculate_attendance
+from lborg.data_helpers import get_groups, get_attendance, get_attendance_layout, get_dates
+from lborg.snapshot_helpers import get_attendance_snapshot
+from lborg.cache_helpers import file_hash, _write_atomic
+from lborg.report_helpers import get_report, record_report
 
 def make_table(data, columns=['cognome','nome','matricola','mail']):
     """Creates a table from a list of db_student items
@@ -17,165 +24,466 @@ def make_table(data, columns=['cognome','nome','matricola','mail']):
     print(table)
     return
 
+# Escapes of the characters with a special meaning in LaTeX
+LATEX_ESCAPES = str.maketrans({
+    '\\': r'\textbackslash{}', '&': r'\&', '%': r'\%', '$': r'\$', '#': r'\#',
+    '_': r'\_', '{': r'\{', '}': r'\}', '~': r'\textasciitilde{}', '^': r'\textasciicircum{}'
+})
+
+# Symbols of the attendance in the attendance table
+ATTENDANCE_SYMBOLS = {1: 'P', 0: 'A', None: ''}
+
+
+def latex_escape(text):
+    """Escapes the LaTeX special characters of a text
+
+    Args:
+        text (any): the text, converted to a string
+
+    Returns:
+        str: the escaped text
+    """
+    return str(text).translate(LATEX_ESCAPES)
+
+
+def write_latex_preamble(out, lhead='', rhead='', landscape=False):
+    """Writes the preamble of a document, up to the beginning of the document
+
+    Args:
+        out (file): the stream to write to
+        lhead (str, optional): the text on the top left of the pages. Defaults to ''.
+        rhead (str, optional): the text on the top right of the pages. Defaults to ''.
+        landscape (bool, optional): landscape pages. Defaults to False.
+    """
+    out.write(r'\documentclass[12pt'+(',landscape' if landscape else '')+r']{article}'+'\n'
+              r'\usepackage{multirow}'+'\n'
+              r'\usepackage{tabularx}'+'\n'
+              r'\usepackage[margin=1in]{geometry} % Set all margins to 1 inch'+'\n'
+              r'\usepackage{fancyhdr}'+'\n\n'
+              r'% Set fancy headers'+'\n'
+              r'\pagestyle{fancy}'+'\n'
+              r'\fancyhf{} % Clear header and footer'+'\n'
+              f'\\lhead{{{latex_escape(lhead)}}} % Set title on the top left'+'\n\n'
+              f'\\rhead{{{latex_escape(rhead)}}} % Set date on the top right'+'\n\n'
+              r'\begin{document}'+'\n\n')
+
+
+def write_latex_tables(out, tables):
+    """Writes floating tables
+
+    Args:
+        out (file): the stream to write to
+        tables (list): the tables, either LaTeX strings or functions writing the table to a stream
+    """
+    for table in tables:
+        out.write(r'\begin{table}[t]'+'\n'+r'\centering'+'\n')
+        if callable(table):
+            table(out)
+        else:
+            out.write(table)
+        out.write('\n'+r'\end{table}'+'\n\n')
+
+
+def write_latex_document(out, tables, lhead='', rhead='', landscape=False):
+    """Writes a document with some tables, in a single pass
+
+    Args:
+        out (file): the stream to write to
+        tables (list): the tables, either LaTeX strings or functions writing the table to a stream
+        lhead (str, optional): the text on the top left of the pages. Defaults to ''.
+        rhead (str, optional): the text on the top right of the pages. Defaults to ''.
+        landscape (bool, optional): landscape pages. Defaults to False.
+    """
+    write_latex_preamble(out, lhead, rhead, landscape)
+    write_latex_tables(out, tables)
+    out.write(r'\end{document}'+'\n')
+
+
+def write_group_table(out, data, columns=['Gruppo','Studente','Firma']):
+    """Writes the signature table of some groups, with a multirow cell per group
+
+    Args:
+        out (file): the stream to write to
+        data (dict): the students (cognome, nome, ...) keyed by group
+        columns (list, optional): list of column names. Defaults to ['Gruppo','Studente','Firma'].
+    """
+    out.write(r'\begin{tabularx}{\textwidth}{|r|l|X|}'+'\n'+r'\hline'+'\n')
+    out.write(' & '.join(latex_escape(col) for col in columns)+r' \\'+'\n'+r'\hline'+'\n')
+    first = True
+    for group, students in data.items():
+        if not students:
+            continue
+        if not first:
+            out.write(r'\hline'+'\n')
+        first = False
+        for i, student in enumerate(students):
+            name = latex_escape(f'{student[0]} {student[1]}')
+            if i == 0:
+                out.write(f'\\multirow{{{len(students)}}}{{*}}{{{latex_escape(group)}}} & {name} & '+r'\\'+'\n')
+            else:
+                out.write(r'\cline{2-3} & '+name+r' & \\'+'\n')
+    out.write(r'\hline'+'\n'+r'\end{tabularx}')
+
+
 def make_latex_table(data, columns=['Gruppo','Studente','Firma']):
     """Creates a latex table from a list of db_student items
 
     Args:
-        data (list): list of db_student items
+        data (dict): the db_student items keyed by group
         columns (list, optional): list of column names. Defaults to ['Gruppo','Studente','Firma'].
+
+    Returns:
+        str: the latex table
     """
-    # modify to get table data
-    data_table = []
-    group_ids = [ key for key in data.keys() if data[key] ]
-    for group, item in data.items():
-        print(group, item)
-        for it in item:
-            data_table.append([group, f'{it[0]} {it[1]}', ''])
-    table = tabulate(data_table, headers=columns, tablefmt="latex_longtable")
-    # Fix table
-    table = table.replace(r'{longtable}', r'{tabularx}')
-    table = table.replace(r'\endhead', '')
-    table = table.replace(r'\begin{tabularx}{rll}', r'\begin{tabularx}{\textwidth}{|r|l|X|}')
-    # Index of groups on multirow
-    for group_id in group_ids:
-        n_students = table.count(f' {group_id} &')
-        table = table.replace(f' {group_id} &', ("\\hline" if group_id>1 else "")+f' \\multirow{{{n_students}}}{{*}}{{{group_id}}} &', 1)
-        table = table.replace(f' {group_id} &', r'\cline{2-3} &', n_students-1)
-    return table
+    out = io.StringIO()
+    write_group_table(out, data, columns)
+    return out.getvalue()
+
+
+def write_attendance_table(out, data, dates, attendance):
+    """Writes the attendance table of some students, with a column per date
+    and the attendance percentage
+
+    Args:
+        out (file): the stream to write to
+        data (list): the attendance rows (matricola and the presence on each date)
+        dates (list): the dates of the columns
+        attendance (dict): the attendance fraction keyed by student id
+    """
+    out.write(r'\begin{tabular}{r'+'c'*len(dates)+'r}\n'+r'\hline'+'\n')
+    # dates are shown without the year
+    headers = ['Matricola'] + [date[5:] if len(date) == 10 and date[4] == '-' else date for date in dates] + ['%']
+    out.write(' & '.join(latex_escape(h) for h in headers)+r' \\'+'\n'+r'\hline'+'\n')
+    for row in data:
+        att_val = float(attendance.get(row[0], 0))*100
+        cells = [str(row[0])] + [ATTENDANCE_SYMBOLS.get(p, latex_escape(p)) for p in row[1:len(dates)+1]]
+        cells.append(f'{att_val:.0f}')
+        out.write(' & '.join(cells)+r' \\'+'\n')
+    out.write(r'\hline'+'\n'+r'\end{tabular}')
+
 
 def get_latex_tables(tables, lhead='', rhead='', landscape=False):
-    # write the latex table to file
-    latex = r'\documentclass[12pt'+(',landscape' if landscape else '')+r']{article}'+'\n'
-    latex +=r'\usepackage{multirow}'+'\n'
-    latex +=r'\usepackage{tabularx}'+'\n'
-    latex +=r'\usepackage[margin=1in]{geometry} % Set all margins to 1 inch'+'\n'
-    latex +=r'\usepackage{fancyhdr}'+'\n\n'
-    latex +=r'% Set fancy headers'+'\n'
-    latex +=r'\pagestyle{fancy}'+'\n'
-    latex +=r'\fancyhf{} % Clear header and footer'+'\n'
-    latex +=f'\\lhead{{{lhead}}} % Set title on the top left'+'\n\n'
-    latex +=f'\\rhead{{{rhead}}} % Set date on the top right'+'\n\n'
-    latex +=r'\begin{document}'+'\n\n'
-    for table in tables:
-        latex +=r'\begin{table}[t]'+'\n'
-        latex +=r'\centering'
-        latex +=table
-        latex +=r'\end{table}'+'\n\n'
-    latex +=r'\end{document}'+'\n'
-    return latex
-
-def save_latex_table(latex_table, fname, output_dir):
+    """Creates a document with some tables
+
+    Args:
+        tables (list): the tables, either LaTeX strings or functions writing the table to a stream
+        lhead (str, optional): the text on the top left of the pages. Defaults to ''.
+        rhead (str, optional): the text on the top right of the pages. Defaults to ''.
+        landscape (bool, optional): landscape pages. Defaults to False.
+
+    Returns:
+        str: the latex document
+    """
+    out = io.StringIO()
+    write_latex_document(out, tables, lhead, rhead, landscape)
+    return out.getvalue()
+
+# Command compiling the latex documents, and the seconds allowed to each run
+PDFLATEX = 'pdflatex'
+PDFLATEX_TIMEOUT = 120
+# File in the latex directory with the hashes of the documents last compiled successfully
+LATEX_MANIFEST = 'manifest.json'
+
+_manifest_lock = threading.Lock()
+
+
+def save_latex_table(latex_table, fname, output_dir, compile_pdf=True):
+    """Saves a latex document in the 'latex' directory of the output
+    directory and compiles it, unless unchanged since the last compilation
+
+    Args:
+        latex_table (str): the latex document
+        fname (str): the file name of the document
+        output_dir (str): the output directory
+        compile_pdf (bool, optional): compile the document. Defaults to True.
+
+    Returns:
+        tuple: the file name of the saved document and the outcome of its compilation,
+        as returned by `compile_latex` (None if not compiled)
+    """
     if not os.path.exists(f'{output_dir}/latex'):
         os.makedirs(f'{output_dir}/latex')
-    with open(f'{output_dir}/latex/{fname}', 'w') as f:
+    tex_file = f'{output_dir}/latex/{fname}'
+    with open(tex_file, 'w') as f:
         f.write(latex_table)
     # create pdf
-    os.system(f'pdflatex -output-directory={output_dir} {output_dir}/latex/{fname}')
-    return
+    outcome = compile_latex([tex_file], output_dir)[tex_file] if compile_pdf else None
+    return tex_file, outcome
 
-def make_signature_table(db_name, cohort, date='', title='Laboratorio I - Turno Beta', output_dir='pdfs'):
-    """Creates a table from a list of db_student items
+
+def _read_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, 'latex', LATEX_MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _update_manifest(output_dir, hashes):
+    with _manifest_lock:
+        manifest = _read_manifest(output_dir)
+        manifest.update(hashes)
+        _write_atomic(os.path.join(output_dir, 'latex', LATEX_MANIFEST), json.dumps(manifest, indent=1), 'w')
+
+
+def run_pdflatex(tex_file, output_dir, jobname=None, timeout=PDFLATEX_TIMEOUT):
+    """Runs pdflatex on a document, without interaction
+
+    Args:
+        tex_file (str): the file name of the document
+        output_dir (str): the directory of the pdf
+        jobname (str, optional): the name of the pdf (without extension). Defaults to the name of the document.
+        timeout (int, optional): the seconds allowed to the run. Defaults to `PDFLATEX_TIMEOUT`.
+
+    Returns:
+        str: the outcome, one of 'compiled', 'failed', 'timeout'
+    """
+    command = [PDFLATEX, '-interaction=nonstopmode', '-halt-on-error', f'-output-directory={output_dir}']
+    if jobname is not None:
+        command.append(f'-jobname={jobname}')
+    try:
+        result = subprocess.run(command + [tex_file], capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        print(f'Error: {PDFLATEX} timed out on {tex_file} after {timeout} s')
+        return 'timeout'
+    except OSError as e:
+        print(f'Error: cannot run {PDFLATEX} on {tex_file}: {e}')
+        return 'failed'
+    if result.returncode != 0:
+        # the errors of pdflatex are on the lines starting with '!'
+        errors = [line for line in result.stdout.splitlines() if line.startswith('!')]
+        print(f'Error: {PDFLATEX} failed on {tex_file}' + (f': {errors[0]}' if errors else ''))
+        return 'failed'
+    return 'compiled'
+
+
+def merge_latex_documents(tex_files, merged_file):
+    """Merges documents with the same preamble into one, a document per page:
+    the headers of each document are set before its body
+
+    Args:
+        tex_files (list): the file names of the documents
+        merged_file (str): the file name of the merged document
+
+    Raises:
+        ValueError: the documents have different preambles
+    """
+    preamble = None
+    with open(merged_file, 'w') as out:
+        for i, tex_file in enumerate(tex_files):
+            with open(tex_file) as f:
+                latex = f.read()
+            head, _, body = latex.partition('\\begin{document}')
+            body = body.rpartition('\\end{document}')[0]
+            lines = head.splitlines()
+            headers = [line for line in lines if line.startswith(('\\lhead', '\\rhead'))]
+            common = [line for line in lines if not line.startswith(('\\lhead', '\\rhead'))]
+            if preamble is None:
+                preamble = common
+                out.write('\n'.join(common) + '\n\\begin{document}\n')
+            elif common != preamble:
+                raise ValueError(f'Cannot merge {tex_file}: its preamble differs from the one of {tex_files[0]}')
+            if i > 0:
+                out.write('\\clearpage\n')
+            out.write('\n'.join(headers) + '\n' + body)
+        out.write('\\end{document}\n')
+
+
+def pdf_name(tex_file, output_dir):
+    """Returns the file name of the pdf compiled from a latex document"""
+    return os.path.join(output_dir, os.path.splitext(os.path.basename(tex_file))[0] + '.pdf')
+
+
+def compile_latex(tex_files, output_dir='pdfs', jobs=None, timeout=PDFLATEX_TIMEOUT, force=False, merge=None):
+    """Compiles latex documents with pdflatex, running up to `jobs` processes
+    at once. The documents whose content did not change since their last
+    successful compilation (as recorded in the manifest in the 'latex'
+    directory) are skipped, unless forced.
+
+    Args:
+        tex_files (list): the file names of the documents
+        output_dir (str, optional): the directory of the pdfs. Defaults to 'pdfs'.
+        jobs (int, optional): the maximum number of pdflatex processes. Defaults to the number of CPUs.
+        timeout (int, optional): the seconds allowed to each run. Defaults to `PDFLATEX_TIMEOUT`.
+        force (bool, optional): compile also the unchanged documents. Defaults to False.
+        merge (str, optional): if given, the documents are merged and compiled in a single
+            run to a pdf with this name (without extension). Defaults to None.
+
+    Returns:
+        dict: the outcome keyed by document, one of 'compiled', 'skipped', 'failed', 'timeout'
+    """
+    os.makedirs(os.path.join(output_dir, 'latex'), exist_ok=True)
+    if merge is not None:
+        merged_file = os.path.join(output_dir, 'latex', f'{merge}.tex')
+        merge_latex_documents(tex_files, merged_file)
+        outcome = compile_latex([merged_file], output_dir, jobs, timeout, force)[merged_file]
+        return {tex_file: outcome for tex_file in tex_files}
+    manifest = _read_manifest(output_dir)
+    hashes = {tex_file: file_hash(tex_file) for tex_file in tex_files}
+    outcomes = {}
+    to_compile = []
+    for tex_file, digest in hashes.items():
+        if not force and manifest.get(os.path.abspath(tex_file)) == digest and os.path.exists(pdf_name(tex_file, output_dir)):
+            outcomes[tex_file] = 'skipped'
+        else:
+            to_compile.append(tex_file)
+    if to_compile:
+        with ThreadPoolExecutor(min(jobs or os.cpu_count() or 1, len(to_compile))) as pool:
+            results = pool.map(lambda tex_file: run_pdflatex(tex_file, output_dir, timeout=timeout), to_compile)
+            outcomes.update(zip(to_compile, results))
+        _update_manifest(output_dir, {os.path.abspath(tex_file): hashes[tex_file] 
+                                      for tex_file in to_compile if outcomes[tex_file] == 'compiled'})
+    return outcomes
+
+
+def compiled(outcomes):
+    """Checks that all the documents have an up to date pdf after `compile_latex`
+
+    Args:
+        outcomes (dict): the outcomes returned by `compile_latex`
+
+    Returns:
+        bool: True if all the documents were compiled or skipped as unchanged
+    """
+    return all(outcome in ('compiled', 'skipped') for outcome in outcomes.values())
+
+def write_signature_sheets(out, tables, dates, title=''):
+    """Writes a document with a signature sheet per date, all with the same tables
+
+    Args:
+        out (file): the stream to write to
+        tables (list): the tables, either LaTeX strings or functions writing the table to a stream
+        dates (list): the dates of the sheets, shown on the top right
+        title (str, optional): the title on the top left. Defaults to ''.
+    """
+    write_latex_preamble(out, lhead=title)
+    for i, date in enumerate(dates):
+        if i > 0:
+            out.write(r'\clearpage'+'\n')
+        out.write(f'\\rhead{{{latex_escape(date)}}}'+'\n\n')
+        write_latex_tables(out, tables)
+    out.write(r'\end{document}'+'\n')
+
+
+def make_signature_table(db_name, cohort, date='', title='Laboratorio I - Turno Beta', output_dir='pdfs',
+                         db_dates=None, single_file=True, jobs=None, force=False):
+    """Creates the signature sheets of the groups of a cohort, for one or many dates.
+    The group tables are rendered once and shared by all the sheets, which are
+    written in a single multi-page document or in a document per date, compiled in parallel.
 
     Args:
         db_name (str): database name
         cohort (str): cohort name
-        date (str, optional): date on the signature table. Defaults to ''.
+        date (str/list, optional): date (or list of dates) on the signature table. Defaults to ''.
         title (str, optional): title of the signature table. Defaults to 'Laboratorio I - Turno Beta'.
         output_dir (str, optional): output directory. Defaults to 'pdfs'.
+        db_dates (str, optional): the dates database, whose dates are used if no date is given. Defaults to None.
+        single_file (bool, optional): write all the dates in a single document. Defaults to True.
+        jobs (int, optional): the maximum number of pdflatex processes. Defaults to the number of CPUs.
+        force (bool, optional): regenerate the sheets even if their inputs did not change. Defaults to False.
+
+    Raises:
+        ValueError: no dates given, or found in the dates database
+
+    Returns:
+        list: the file names of the latex documents
     """
+    # get the dates
+    dates = [date] if isinstance(date, str) else list(date)
+    inputs = [(db_name, 'students', 'coorte = ?', (cohort,))]
+    if dates == [''] and db_dates is not None:
+        dates = [d[0] for d in get_dates(db_dates)[0]]
+        inputs.append((db_dates, 'dates', None, ()))
+        if not dates:
+            raise ValueError(f'No dates found in {db_dates}!')
+    if not dates:
+        raise ValueError('No dates given!')
+    if len(dates) > 1 and single_file:
+        tex_files = [f'{output_dir}/latex/'+cohort.replace("/","_")+'_signature_sheets.tex']
+    else:
+        tex_files = [f'{output_dir}/latex/'+(cohort.replace("/","_") if d=='' else d.replace("/","_"))+'_signature_table.tex' 
+                     for d in dates]
+    # check if the sheets are up to date
+    report_id = os.path.basename(tex_files[0]) + (f'+{len(tex_files)-1}' if len(tex_files) > 1 else '')
+    params = {'dates': dates, 'title': title, 'single_file': single_file}
+    artifacts = get_report(output_dir, report_id, 'signature', cohort, params, inputs)
+    if artifacts is not None and not force:
+        return tex_files
     # get the data
     data = get_groups(cohort, db_name)
-    # get tables
+    # get tables, rendered once for all the dates
     tables = []
     group_ids = [ key for key in data.keys() if data[key] ]
     groups_id_split = int(len(group_ids)/2)
-    data_split = {
-        1 : {key: data[key] if key in data.keys() else [] for key in group_ids[:groups_id_split]},
-        groups_id_split: {key: data[key] if key in data.keys() else [] for key in group_ids[groups_id_split:]}
-    }
-    for group_id, data_table in data_split.items():
-        filtered_data_table = {key: value for key, value in data_table.items() if value}
-        print(filtered_data_table)
-        tables += [make_latex_table(filtered_data_table)]
-
-    # write the latex table to file
-    latex = r'\documentclass[12pt]{article}'+'\n'
-    latex +=r'\usepackage{multirow}'+'\n'
-    latex +=r'\usepackage{tabularx}'+'\n'
-    latex +=r'\usepackage[margin=1in]{geometry} % Set all margins to 1 inch'+'\n'
-    latex +=r'\usepackage{fancyhdr}'+'\n\n'
-    latex +=r'% Set fancy headers'+'\n'
-    latex +=r'\pagestyle{fancy}'+'\n'
-    latex +=r'\fancyhf{} % Clear header and footer'+'\n'
-    latex +=f'\\lhead{{{title}}} % Set title on the top left'+'\n\n'
-    latex +=f'\\rhead{{{date}}} % Set date on the top right'+'\n\n'
-    latex +=r'\begin{document}'+'\n\n'
-    for table in tables:
-        latex +=r'\begin{table}[t]'+'\n'
-        latex +=r'\centering'
-        latex +=table
-        latex +=r'\end{table}'+'\n\n'
-    latex +=r'\end{document}'+'\n'
+    data_split = [
+        {key: data[key] for key in group_ids[:groups_id_split]},
+        {key: data[key] for key in group_ids[groups_id_split:]}
+    ]
+    for data_table in data_split:
+        tables += [make_latex_table(data_table)]
 
+    # write the latex tables to file
     if not os.path.exists(f'{output_dir}/latex'):
         os.makedirs(f'{output_dir}/latex')
-    fname= cohort.replace("/","_") if date=='' else date
-    fname+='_signature_table.tex'
-    with open(f'{output_dir}/latex/{fname}', 'w') as f:
-        f.write(latex)
+    if len(dates) > 1 and single_file:
+        with open(tex_files[0], 'w') as f:
+            write_signature_sheets(f, tables, dates, title)
+    else:
+        for d, tex_file in zip(dates, tex_files):
+            with open(tex_file, 'w') as f:
+                write_latex_document(f, tables, lhead=title, rhead=d)
     
-    # create pdf
-    os.system(f'pdflatex -output-directory={output_dir} {output_dir}/latex/{fname}')
-    return 
+    # create pdf, recording the report only if all the pdfs are up to date
+    if compiled(compile_latex(tex_files, output_dir, jobs=jobs)):
+        record_report(output_dir, report_id, 'signature', cohort, params, inputs, 
+                      tex_files + [pdf_name(tex_file, output_dir) for tex_file in tex_files])
+    return tex_files
+
+def make_attendance_table(db_name, cohort, output_dir='pdfs', force=False):
+    """Creates an attendance table for a given cohort, unless already created
+    from the same attendance and dates
 
-def make_attendance_table(db_name, cohort, output_dir='pdfs'):
-    """Creates an attendance table for a given cohort
+    Args:
+        db_name (str): the attendance database name
+        cohort (str): cohort name
+        output_dir (str, optional): output directory. Defaults to 'pdfs'.
+        force (bool, optional): regenerate the table even if its inputs did not change. Defaults to False.
+
+    Raises:
+        ValueError: database not found
+
+    Returns:
+        list: the file names of the latex document and of the pdf
     """
     # checks
     if not os.path.exists(db_name):
         raise ValueError(f'Database {db_name} not found!')
+    db_dates = f'data/dates_{cohort.replace("/","_")}.db'
+    fname=f'{cohort.replace("/","_")}_attendance_table.tex'
+    # check if the table is up to date
+    table_name = 'attendance_log' if get_attendance_layout(db_name) == 'long' else 'attendance'
+    inputs = [(db_name, table_name, None, ()), (db_dates, 'dates', None, ())]
+    artifacts = get_report(output_dir, fname, 'attendance', cohort, {}, inputs)
+    if artifacts is not None and not force:
+        return artifacts
 
     # get the data
     data, desc = get_attendance(db_name)
-    # add a column for percentage
-    columns = [description[0].capitalize() for description in desc]
-    columns.append('%')
-    db_dates = f'data/dates_{cohort.replace("/","_")}.db'
-    hours = get_hours(db_dates)
-    print(hours)
-    data_table = []
-    attendance = calculate_attendance(db_name, db_dates)
-    for d in data:
-        d_tab = list(d)
-        att_val = float(attendance[d_tab[0]])*100
-        # if att_val < 70:
-        #     d_tab.append(r'\textcolor{red}{'+f'{att_val:.0f}'+r'}')
-        # elif att_val < 80:
-        #     d_tab.append(r'\textcolor{orange}{'+f'{att_val:.0f}'+r'}')
-        # else:
-        d_tab.append(f'{float(att_val):.0f}' if att_val else '-')
-        data_table.append(d_tab)
+    attendance = get_attendance_snapshot(db_name, db_dates).attendance()
+    dates = [description[0] for description in desc[1:]]
     # split the tables
-    data_split_id = int(len(data_table)/2)
+    data_split_id = int(len(data)/2)
     data_split = [
-        data_table[:data_split_id],
-        data_table[data_split_id:]
+        data[:data_split_id],
+        data[data_split_id:]
         ]
-    tables = []
-    for dt in data_split:
-        # Tabulate the rows
-        table = tabulate(dt, headers=columns, tablefmt="latex")
-        table = table.replace(' 1 ',' P ')
-        table = table.replace(' 0 ',' A ')
-        table = table.replace(' - ',' 0 ')
-        table = table.replace(f' 20{cohort[-2:]}-', ' ')
-        tables += [table]
+    tables = [lambda out, rows=rows: write_attendance_table(out, rows, dates, attendance) for rows in data_split]
     # create latex table
     latex = get_latex_tables(tables,lhead='Laboratorio I - Turno Beta',rhead=cohort.replace('_','/'), landscape=True)
 
-    print(table)
-
-    fname=f'{cohort.replace("/","_")}_attendance_table.tex'
-    save_latex_table(latex, fname, output_dir)
-
-    return
\ No newline at end of file
+    tex_file, outcome = save_latex_table(latex, fname, output_dir)
+    artifacts = [tex_file, pdf_name(tex_file, output_dir)]
+    # a failed compilation leaves the previous pdf, which must not be taken as up to date
+    if compiled({tex_file: outcome}):
+        record_report(output_dir, fname, 'attendance', cohort, {}, inputs, artifacts)
+    return artifacts
\ No newline at end of file
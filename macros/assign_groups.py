@@ -6,8 +6,9 @@ from lborg.tables import make_table
 import argparse
 parser = argparse.ArgumentParser('Assign Groups Options')
 parser.add_argument('--db_name', type=str, default='data/students.db', help='Database name')
-parser.add_argument('--cohort', type=str, default='2023/24', help='Cohort name')
-parser.add_argument('--json_name', type=str, help='Input JSON name', required=True)
+parser.add_argument('--cohort', type=str, default=None, help='Cohort name, to match only the participants of a cohort')
+parser.add_argument('--json_name', type=str, help='Input JSON (or NDJSON/CSV) name', required=True)
+parser.add_argument('--by_matricola', action='store_true', help='Match the participants by id instead of by name')
 parser.add_argument('--dryrun', action='store_true', help='Dry run')
 parser.add_argument('--verbose', action='store_true', help='Verbose mode')
 args = parser.parse_args()
@@ -16,7 +17,12 @@ def main():
     # add "gruppo" column to database
     #add_column(args.db_name, 'gruppo', 'INTEGER', 0)
     # assign group to participants in database
-    assign_group(args.json_name, db_name=args.db_name, verbose=args.verbose)
+    summary = assign_group(args.json_name, db_name=args.db_name, verbose=args.verbose,
+                           cohort=args.cohort, by_matricola=args.by_matricola)
+    for status in ['unmatched', 'ambiguous']:
+        if summary[status]:
+            print(f'{status.capitalize()} participants:')
+            make_table(summary[status], columns=['cognome','nome','matricola'])
 
     #print(get_db_columns('test/dummy.db'))
 
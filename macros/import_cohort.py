@@ -7,7 +7,7 @@ import argparse
 parser = argparse.ArgumentParser('Import Cohort Options')
 parser.add_argument('--db_name', type=str, default='data/students.db', help='Database name')
 parser.add_argument('--cohort', type=str, help='Cohort name', required=True)
-parser.add_argument('--json_name', type=str, help='Input JSON name')
+parser.add_argument('--json_name', type=str, help='Input JSON (or NDJSON/CSV) name')
 parser.add_argument('--dryrun', action='store_true', help='Dry run')
 parser.add_argument('--verbose', action='store_true', help='Verbose mode')
 args = parser.parse_args()
@@ -7,13 +7,14 @@ parser = argparse.ArgumentParser('Print a table with attandance information\n'+
                                  '   $ python $LBORG/macros/make_attendance_table.py --db_name data/attendance.db --cohort 2023/24\n')
 parser.add_argument('--db_name', type=str, default='data/attendance.db', help='Database name')
 parser.add_argument('--cohort', type=str, default='2023/24', help='Cohort name')
+parser.add_argument('--force', action='store_true', help='Regenerate the table even if the data did not change')
 parser.add_argument('--dryrun', action='store_true', help='Dry run')
 args = parser.parse_args()
 
 def main():
     # get groups
     #groups = get_groups(args.cohort, db_name=args.db_name)
-    make_attendance_table(args.db_name, args.cohort)
+    make_attendance_table(args.db_name, args.cohort, force=args.force)
     return
 
 if __name__ == '__main__':
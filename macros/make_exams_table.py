@@ -1,8 +1,8 @@
 from context import lborg
 from collections import namedtuple
-from lborg.db import create_query, query_database, get_entry
+from lborg.db import create_query, get_session, get_cohort_db
 from lborg.tables import make_table
-from lborg.data_helpers import calculate_attendance, int_mark
+from lborg.data_helpers import int_mark
 from lborg.db_items import db_student, db_exam_results
 
 import argparse
@@ -19,20 +19,37 @@ args = parser.parse_args()
 
 db_student_plus_exam = namedtuple('StudentExam', db_student._fields + db_exam_results._fields[1:] + ('attendance',))
 
+def get_students_exams(ids):
+    """Query the students joined with their exam results and attendance,
+    with a single query per cohort
+
+    Args:
+        ids (list): list of student ids
+
+    Returns:
+        list: list of students (as db_student_plus_exam items)
+    """
+    fltr = 'matricola IN ({})'.format(', '.join(['?']*len(ids)))
+    query = create_query(args.db_name, columns=['coorte'], filter=fltr)
+    cohorts, desc = get_session(args.db_name).query(query, ids)
+    data = []
+    for cohort in sorted(set(c[0] for c in cohorts)):
+        cohort_db = get_cohort_db(cohort, students=args.db_name, 
+                                  attendance=args.db_attendance_name, exams=args.db_exams_name)
+        result, desc = cohort_db.student_results(filter='s.'+fltr, params=ids, order=args.order)
+        data += [db_student_plus_exam(*(r[:-1] + (r[-1] or 0.0,))) for r in result]
+    return data
+
 def check_exams_db(data):
     """Cross-check the list of students with the exams database
 
     Args:
-        data (list): list of students (as db_student items)
+        data (list): list of students (as db_student_plus_exam items)
     """
     valid_students = []
-    for d in data:
-        student = db_student(*d)
-        exam = get_entry(args.db_exams_name, 'matricola', student.matricola, 'exams', db_exam_results)
-        if exam is not None and exam.written is not None and int_mark(exam.written) > 17:
-            # merge information
-            StudentExam = db_student_plus_exam(*(student + exam[1:] + (0.0,)))
-            valid_students.append(StudentExam)
+    for student in data:
+        if student.written is not None and int_mark(student.written) > 17:
+            valid_students.append(student)
     return valid_students
 
 def check_attendance_db(data):
@@ -40,29 +57,19 @@ def check_attendance_db(data):
     that their attendance is above 75%
 
     Args:
-        data (list): list of students (as db_student items)
+        data (list): list of students (as db_student_plus_exam items)
     """
     valid_students = []
-    for d in data:
-        #student = db_student(*d)
-        student = db_student_plus_exam(*d)
-        attendance = calculate_attendance(args.db_attendance_name, 
-                                          f'data/dates_{student.coorte.replace("/","_")}.db',
-                                          student.matricola)
-        if attendance[student.matricola] > 0.75:
-            valid_students.append(student._replace(attendance=attendance[student.matricola]))
+    for student in data:
+        if student.attendance > 0.75:
+            valid_students.append(student)
         else:
             print(f'Student {student.nome} {student.cognome} has an attendance of {student.attendance*100:.0f}% and is not added to the list')
     return valid_students
 
 def main():
     # query the database for id
-    fltr = 'matricola = {}'.format(args.ids[0])
-    for i in args.ids[1:]:
-        fltr += ' OR matricola = {}'.format(i)
-    query = create_query(args.db_name,columns=None,#['cognome','nome','mail','gruppo','coorte','matricola'], 
-                         order=args.order, filter=fltr)
-    data, desc = query_database(args.db_name,query)
+    data = get_students_exams(args.ids)
     valid_data = check_exams_db(data)
     valid_data = check_attendance_db(valid_data)
     if not len(valid_data):
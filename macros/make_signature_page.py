@@ -2,18 +2,28 @@ from context import lborg
 from lborg.tables import make_signature_table
 
 import argparse
-parser = argparse.ArgumentParser('Assign Groups Options')
+parser = argparse.ArgumentParser('Make Signature Sheets Options\n'+
+                                 'This script creates the signature sheets of the groups for one or many dates.\n'+
+                                 '   $ python $LBORG/macros/make_signature_page.py --cohort 2024/25 --date 2024-10-07\n'+
+                                 '   $ python $LBORG/macros/make_signature_page.py --cohort 2024/25 --dates_db_name data/dates_2024_25.db\n')
 parser.add_argument('--db_name', type=str, default='data/students.db', help='Database name')
 parser.add_argument('--cohort', type=str, default='2023/24', help='Cohort name')
-parser.add_argument('--date', type=str, help='date', required=True)
+parser.add_argument('--date', type=str, help='date (or list of dates)', nargs='+')
+parser.add_argument('--dates_db_name', type=str, help='Dates database, all its dates are used if no date is given')
+parser.add_argument('--split', action='store_true', help='Write a document per date instead of a single one')
+parser.add_argument('--jobs', type=int, default=None, help='Number of pdflatex processes run in parallel')
+parser.add_argument('--force', action='store_true', help='Regenerate the sheets even if the data did not change')
 parser.add_argument('--dryrun', action='store_true', help='Dry run')
 args = parser.parse_args()
 
 def main():
+    if args.date is None and args.dates_db_name is None:
+        raise ValueError('Please provide either the dates or the dates database.')
     # get groups
     #groups = get_groups(args.cohort, db_name=args.db_name)
-    fname = make_signature_table(args.db_name, args.cohort, args.date)
+    fname = make_signature_table(args.db_name, args.cohort, args.date if args.date is not None else '',
+                                 db_dates=args.dates_db_name, single_file=not args.split, jobs=args.jobs, force=args.force)
     return
 
 if __name__ == '__main__':
-    if not args.dryrun: main()
\ No newline at end of file
+    if not args.dryrun: main()
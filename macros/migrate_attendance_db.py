@@ -0,0 +1,22 @@
+from context import lborg
+from lborg.data_helpers import migrate_attendance_to_long, get_attendance
+from lborg.tables import make_table
+
+import argparse
+parser = argparse.ArgumentParser('Migrate Attendance Database Options\n'+
+                                 'This script copies the attendance from the layout with a column per date to the one with a row per student and date.\n'+
+                                 '   $ python $LBORG/macros/migrate_attendance_db.py --db_name data/attendance.db --drop\n')
+parser.add_argument('--db_name', type=str, default='data/attendance.db', help='Database name')
+parser.add_argument('--drop', action='store_true', help='Drop the table with a column per date')
+parser.add_argument('--dryrun', action='store_true', help='Dry run')
+args = parser.parse_args()
+
+def main():
+    migrate_attendance_to_long(args.db_name, drop=args.drop)
+    # print database
+    data, desc = get_attendance(args.db_name)
+    make_table(data, columns=[description[0] for description in desc])
+    return
+
+if __name__ == '__main__':
+    if not args.dryrun: main()
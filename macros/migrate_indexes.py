@@ -0,0 +1,23 @@
+from context import lborg
+from lborg.db import migrate_indexes, migrate_dates
+
+import argparse
+parser = argparse.ArgumentParser('Migrate Indexes Options\n'+
+                                 'This script rewrites the dates as ISO keys and creates the indexes of the tables in existing databases.\n'+
+                                 '   $ python $LBORG/macros/migrate_indexes.py --db_names data/students.db data/attendance.db data/exams.db\n')
+parser.add_argument('--db_names', type=str, help='Database names', nargs='+', required=True)
+parser.add_argument('--dryrun', action='store_true', help='Dry run')
+args = parser.parse_args()
+
+def main():
+    for db_name in args.db_names:
+        # the dates are rewritten first, so that the indexes are built on the new keys
+        n_rows = migrate_dates(db_name)
+        if n_rows:
+            print(f'{db_name}: ' + ', '.join(f'{n} dates rewritten in {column}' for column, n in n_rows.items()))
+        index_names = migrate_indexes(db_name)
+        print(f'{db_name}: {", ".join(index_names) if index_names else "no index declared"}')
+    return
+
+if __name__ == '__main__':
+    if not args.dryrun: main()
@@ -1,42 +1,53 @@
 from context import lborg
-from lborg.db import create_query, query_database
+from lborg.db import create_query, get_session
+from lborg.data_helpers import search_students
 from lborg.tables import make_table
 
 import argparse
-parser = argparse.ArgumentParser('Search Student Options')
+parser = argparse.ArgumentParser('Search Student Options\n'+
+                                 'This script searches the students by id, by exact name and surname, or by any text.\n'+
+                                 '   $ python $LBORG/macros/search_student.py --surname Rossi --name Mario\n'+
+                                 '   $ python $LBORG/macros/search_student.py --search "rosi mar" --cohort 2024/25\n')
 parser.add_argument('--db_name', type=str, default='data/students.db', help='Database name')
 parser.add_argument('--ids', type=int, default=None, nargs='+', help='Student id number')
 parser.add_argument('--name', type=str, default=None, help='Student name')
 parser.add_argument('--surname', type=str, default=None, help='Student surname')
+parser.add_argument('--search', type=str, default=None, help='Text searched in names, surnames and mails, by prefix and with typos')
+parser.add_argument('--cohort', type=str, default=None, help='Cohort name')
+parser.add_argument('--limit', type=int, default=20, help='Maximum number of students found by --search')
 parser.add_argument('--dryrun', action='store_true', help='Dry run')
 args = parser.parse_args()
 
 def main():
-    if args.ids is None and args.name is None and args.surname is None:
-        print('Please provide at least one of the following options: --id, --name, --surname')
+    if args.ids is None and args.name is None and args.surname is None and args.search is None:
+        print('Please provide at least one of the following options: --id, --name, --surname, --search')
         return
-    if args.ids is not None:
-        # query the database for id
-        fltr = 'matricola = {}'.format(args.ids[0])
-        for i in args.ids[1:]:
-            fltr += ' OR matricola = {}'.format(i)
-        query = create_query(args.db_name,columns=['cognome','nome','mail','gruppo','coorte'], 
-                             order='cognome', filter=fltr)
+    columns = ['cognome','nome','mail','gruppo','coorte']
+    if args.search is not None:
+        # search the database through the search index
+        data = search_students(args.search, args.db_name, args.cohort, args.limit)
+        columns = ['cognome','nome','matricola','mail','coorte','gruppo','score']
     else:
-        # query the database for name
-        fltr = 'nome = {}'.format(args.name) if args.name is not None else ''
-        if args.name is not None and args.surname is not None:
-            fltr += ' AND '
-        fltr += 'cognome = {}'.format(args.surname) if args.surname is not None else ''
-        query = create_query(args.db_name,columns=['cognome','nome','mail','gruppo','coorte'], 
-                             order='cognome', filter=fltr)
-    data, desc = query_database(args.db_name,query)
+        if args.ids is not None:
+            # query the database for id
+            fltr = 'matricola IN ({})'.format(', '.join(['?']*len(args.ids)))
+            params = list(args.ids)
+        else:
+            # query the database for name
+            fltr = ' AND '.join([f'{col} = ?' for col, value in [('nome', args.name), ('cognome', args.surname)] 
+                                 if value is not None])
+            params = [value for value in [args.name, args.surname] if value is not None]
+        if args.cohort is not None:
+            fltr = f'({fltr}) AND coorte = ?'
+            params.append(args.cohort)
+        query = create_query(args.db_name, columns=columns, order='cognome', filter=fltr)
+        data, desc = get_session(args.db_name).query(query, tuple(params))
     if not len(data):
         print('No student found with the given parameters')
         return
-    # print table out of data and omit column 'coorte'
-    make_table(data, columns=[description[0] for description in desc])
+    # print table out of data
+    make_table(data, columns=columns)
     return
 
 if __name__ == '__main__':
-    if not args.dryrun: main()
\ No newline at end of file
+    if not args.dryrun: main()
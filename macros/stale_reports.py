@@ -0,0 +1,22 @@
+from context import lborg
+from lborg.report_helpers import stale_reports
+
+import argparse
+parser = argparse.ArgumentParser('Stale Reports Options\n'+
+                                 'This script lists the reports whose data changed since they were generated.\n'+
+                                 '   $ python $LBORG/macros/stale_reports.py --cohort 2024/25\n')
+parser.add_argument('--output_dir', type=str, default='pdfs', help='Output directory of the reports')
+parser.add_argument('--cohort', type=str, help='Cohort name')
+parser.add_argument('--dryrun', action='store_true', help='Dry run')
+args = parser.parse_args()
+
+def main():
+    reports = stale_reports(args.output_dir, args.cohort)
+    for report in reports:
+        print(report)
+    if not reports:
+        print('All reports are up to date')
+    return
+
+if __name__ == '__main__':
+    if not args.dryrun: main()
@@ -1,19 +1,23 @@
 import os
 from context import lborg
-from lborg.data_helpers import create_attendance_db, create_attendance_db_from_excel, create_query, query_database, update_attendance_db, update_attendance_db_from_excel
+from lborg.data_helpers import create_attendance_db, create_attendance_db_from_excel, get_attendance, update_attendance_db, update_attendance_db_from_excel
+from lborg.ingest_helpers import ingest_attendance_files
 from lborg.tables import make_table
 
 import argparse
 parser = argparse.ArgumentParser('Create Attendance Database Options\n'+
                                  'This script creates the attendance database and updates it with the given JSON files or Excel files.\n'+
                                  '   $ python $LBORG/macros/update_attendance_db.py --json_dates dates.json --json_attendance attendance.json --cohort 2024_25\n'+
-                                 '   $ python $LBORG/macros/update_attendance_db.py --excel_attendance attendance.xlsx --cohort 2024_25\n')
+                                 '   $ python $LBORG/macros/update_attendance_db.py --excel_attendance attendance.xlsx --cohort 2024_25\n'+
+                                 '   $ python $LBORG/macros/update_attendance_db.py --json_attendance data/attendance_*.json --jobs 4\n')
 parser.add_argument('--db_name', type=str, default='data/attendance.db', help='Database name')
 parser.add_argument('--students_db_name', type=str, default='data/students.db', help='Database name')
 parser.add_argument('--cohort', type=str, help='Cohort name')
 parser.add_argument('--json_dates', type=str, help='Input JSON with course dates')
-parser.add_argument('--json_attendance', type=str, help='Input JSON with attendance results', nargs='+')
+parser.add_argument('--json_attendance', type=str, help='Input JSON (or NDJSON/CSV) with attendance results', nargs='+')
 parser.add_argument('--excel_attendance', type=str, help='Input excel file with attendance results')
+parser.add_argument('--layout', type=str, default='wide', choices=['wide','long'], help='Layout of a new attendance database')
+parser.add_argument('--jobs', type=int, default=1, help='Number of processes parsing the input files in parallel, 0 for all the CPUs')
 parser.add_argument('--dryrun', action='store_true', help='Dry run')
 args = parser.parse_args()
 
@@ -24,18 +28,20 @@ def main():
         if args.json_dates is None and args.excel_attendance is None:
             raise ValueError('Please provide either a JSON file with course dates or an Excel file with attendance results.')
         if args.json_dates is not None:
-            create_attendance_db(args.json_dates, args.db_name)
+            create_attendance_db(args.json_dates, args.db_name, layout=args.layout)
         elif args.excel_attendance is not None:
-            create_attendance_db_from_excel(args.excel_attendance, args.db_name)
+            create_attendance_db_from_excel(args.excel_attendance, args.db_name, layout=args.layout)
     # update the attendance database
-    if args.json_attendance is not None:
+    if args.jobs != 1:
+        files = (args.json_attendance or []) + ([args.excel_attendance] if args.excel_attendance is not None else [])
+        ingest_attendance_files(files, args.students_db_name, args.db_name, jobs=args.jobs or None)
+    elif args.json_attendance is not None:
         for jat in args.json_attendance:
             update_attendance_db(jat, args.students_db_name, args.db_name)
-    if args.excel_attendance is not None:
+    if args.excel_attendance is not None and args.jobs == 1:
         update_attendance_db_from_excel(args.excel_attendance, args.students_db_name, args.db_name)
     # print database
-    query = create_query(args.db_name, 'attendance', order='matricola')
-    data, desc = query_database(args.db_name,query)
+    data, desc = get_attendance(args.db_name)
     # print table out of data and omit column 'coorte'
     make_table(data, columns=[description[0] for description in desc])
     return
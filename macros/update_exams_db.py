@@ -1,17 +1,21 @@
 import os
 from context import lborg
 from lborg.data_helpers import create_exams_db, create_query, query_database, update_exams_db
+from lborg.ingest_helpers import ingest_exams_files
 from lborg.tables import make_table
 
 import argparse
 parser = argparse.ArgumentParser('Create Attendance Database Options\n'+
                                  'This script creates the exams database and updates it with the given JSON files.\n'+
-                                 '   $ python $LBORG/macros/update_exams_db.py --json_exams exams.json --cohort 2024_25\n')
+                                 '   $ python $LBORG/macros/update_exams_db.py --json_exams exams.json --cohort 2024_25\n'+
+                                 '   $ python $LBORG/macros/update_exams_db.py --json_exams data/exams_*.json --jobs 4\n')
 parser.add_argument('--db_name', type=str, default='data/exams.db', help='Database name')
 parser.add_argument('--students_db_name', type=str, default='data/students.db', help='Database name')
 parser.add_argument('--cohort', type=str, help='Cohort name')
-parser.add_argument('--json_exams', type=str, help='Input JSON with exams dates', nargs='+', required=True)
+parser.add_argument('--json_exams', type=str, help='Input JSON (or NDJSON/CSV) with exams results', nargs='+', required=True)
 parser.add_argument('--exam_type', type=str, default='written', help='Exam Type')
+parser.add_argument('--force', action='store_true', help='Replace marks from earlier dates even if better')
+parser.add_argument('--jobs', type=int, default=1, help='Number of processes parsing the input files in parallel, 0 for all the CPUs')
 parser.add_argument('--dryrun', action='store_true', help='Dry run')
 args = parser.parse_args()
 
@@ -21,8 +25,12 @@ def main():
     if not os.path.exists(args.db_name):
         create_exams_db(args.db_name)
     # update the exams database
-    for jex in args.json_exams:
-        update_exams_db(jex, args.students_db_name, args.db_name, args.exam_type)
+    if args.jobs != 1:
+        ingest_exams_files(args.json_exams, args.students_db_name, args.db_name, args.exam_type, 
+                           force=args.force, jobs=args.jobs or None)
+    else:
+        for jex in args.json_exams:
+            update_exams_db(jex, args.students_db_name, args.db_name, args.exam_type, force=args.force)
     # print database
     query = create_query(args.db_name, 'exams', order='matricola')
     data, desc = query_database(args.db_name,query)
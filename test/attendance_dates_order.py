@@ -0,0 +1,212 @@
+from context import lborg
+import os
+import json
+import shutil
+import tempfile
+import numpy as np
+from lborg.db import create_database, insert_items, get_session, migrate_dates, CohortDB
+from lborg.db_items import db_student, db_date
+from lborg.date_helpers import date_key
+from lborg.snapshot_helpers import (AttendanceSnapshot, SNAPSHOT_VERSION, get_attendance_snapshot,
+                                    snapshot_path, source_signature)
+from lborg.data_helpers import (create_attendance_table, write_attendance, add_dates_db, get_attendance,
+                                get_dates, get_attendance_matrix, calculate_attendance, migrate_attendance_to_long,
+                                create_exams_db, write_exams_marks)
+
+COHORT = '2023/24'
+
+# Hours of the dates of the course
+HOURS = {'2024-03-01': 2, '2024-03-04': 6, '2024-03-08': 1}
+# Presence of the students, the date in the middle being added last
+PRESENCE = {1: {'2024-03-01': False, '2024-03-04': True,  '2024-03-08': False},
+            2: {'2024-03-01': True,  '2024-03-04': False, '2024-03-08': True},
+            3: {'2024-03-01': False, '2024-03-04': False, '2024-03-08': True},
+            4: {'2024-03-01': True,  '2024-03-04': True,  '2024-03-08': False}}
+# Attendance fractions, from the hours of the days of presence out of the 9 hours of the course
+EXPECTED = {1: 6/9, 2: 3/9, 3: 1/9, 4: 8/9}
+# Students with an attendance above 75%, admitted to the exams
+ADMITTED = {4}
+
+
+def make_databases(tmp_dir):
+    """Creates the students and dates databases, and an attendance database
+    in the 'wide' layout whose columns are not in date order"""
+    db_students = os.path.join(tmp_dir, 'students.db')
+    create_database(db_students)
+    insert_items(db_students, [db_student(nome='Nome', cognome=f'Cognome{matricola}', matricola=matricola,
+                                          mail='', coorte=COHORT, gruppo=0) for matricola in PRESENCE])
+    with open(os.path.join(tmp_dir, 'dates.json'), 'w') as f:
+        json.dump(HOURS, f)
+    db_dates = os.path.join(tmp_dir, 'dates.db')
+    add_dates_db(os.path.join(tmp_dir, 'dates.json'), db_dates)
+    db_attendance = os.path.join(tmp_dir, 'attendance.db')
+    create_attendance_table(db_attendance, ['2024-03-01', '2024-03-08'])
+    write_attendance(db_attendance, {(matricola, date): present for matricola, days in PRESENCE.items()
+                                     for date, present in days.items() if date != '2024-03-04'})
+    # the new date is added as the last column
+    write_attendance(db_attendance, {(matricola, '2024-03-04'): days['2024-03-04']
+                                     for matricola, days in PRESENCE.items()})
+    return db_students, db_attendance, db_dates
+
+
+def make_legacy_dates(tmp_dir):
+    """Creates a dates database written before the dates were stored in ISO
+    format, with the dates as day/month/year"""
+    db_dates = os.path.join(tmp_dir, 'legacy_dates.db')
+    create_database(db_dates, 'dates', {'date':'text','hours':'INTEGER'})
+    insert_items(db_dates, [db_date('/'.join(reversed(date.split('-'))), hours) for date, hours in HOURS.items()], 'dates')
+    return db_dates
+
+
+def check_matrix(db_attendance, db_dates):
+    ids, presence, hours, dates = get_attendance_matrix(db_attendance, db_dates, with_dates=True)
+    assert dates == sorted(HOURS), dates
+    assert list(hours) == [HOURS[date] for date in dates], hours
+    for matricola, row in zip(ids, presence):
+        assert list(row) == [PRESENCE[matricola][date] for date in dates], (matricola, row)
+
+
+def loop_attendance(db_attendance, db_dates, max_hours=56):
+    """The attendance fractions computed a student at a time, as in the
+    original loop of `calculate_attendance`, with the hours of each column
+    found by its date"""
+    data, desc = get_attendance(db_attendance)
+    dates, _ = get_dates(db_dates)
+    hours = {date_key(d[0]): d[1] for d in dates}
+    hours = [hours.get(date_key(column[0]), 0) for column in desc[1:]]
+    valid_hours = 0
+    attendance = {}
+    for student in data:
+        days = student[1:]
+        if valid_hours == 0:
+            valid_hours = min(sum(h for h, p in zip(hours, days) if p is not None), max_hours)
+        attended = sum(h for h, p in zip(hours, days) if p)
+        attendance[student[0]] = min(float(attended)/valid_hours, 1.)
+    return attendance
+
+
+def check_fractions(db_attendance, db_dates):
+    expected = loop_attendance(db_attendance, db_dates)
+    assert expected.keys() == EXPECTED.keys(), expected
+    assert all(np.isclose(expected[matricola], fraction) for matricola, fraction in EXPECTED.items()), expected
+    # computed once for the cohort, then answered from the cache
+    for _ in range(2):
+        attendance = calculate_attendance(db_attendance, db_dates)
+        assert attendance.keys() == expected.keys(), attendance
+        for matricola, fraction in expected.items():
+            assert np.isclose(attendance[matricola], fraction), (matricola, attendance[matricola])
+            assert np.isclose(calculate_attendance(db_attendance, db_dates, matricola)[matricola], fraction)
+
+
+def check_query(db_students, db_attendance, db_dates):
+    with CohortDB(COHORT, db_students, db_attendance, dates=db_dates) as cohort_db:
+        data, _ = cohort_db.query(*cohort_db.attendance_query())
+    attendance = dict(data)
+    assert attendance.keys() == EXPECTED.keys(), attendance
+    for matricola, fraction in EXPECTED.items():
+        assert np.isclose(attendance[matricola], fraction), (matricola, attendance[matricola])
+
+
+def check_results(db_students, db_attendance, db_exams, db_dates):
+    """Checks the attendance joined to the students and their exams, with the
+    attendance and dates databases attached to the students one"""
+    with CohortDB(COHORT, db_students, db_attendance, db_exams, db_dates) as cohort_db:
+        data, desc = cohort_db.student_results(order='matricola')
+    columns = [d[0] for d in desc]
+    results = {row[columns.index('matricola')]: row for row in data}
+    assert results.keys() == EXPECTED.keys(), results
+    for matricola, fraction in EXPECTED.items():
+        assert results[matricola][columns.index('written')] == '28', results[matricola]
+        assert np.isclose(results[matricola][-1], fraction), (matricola, results[matricola][-1])
+    admitted = set(matricola for matricola, row in results.items() if row[-1] > 0.75)
+    assert admitted == ADMITTED, admitted
+
+
+def check_snapshot(db_attendance, db_dates, snapshot_dir):
+    """Checks the snapshot of the attendance, replacing a snapshot of an older
+    version saved with the hours in the order of the columns"""
+    path = snapshot_path(db_attendance, db_dates, snapshot_dir)
+    ids, presence, hours, dates = get_attendance_matrix(db_attendance, db_dates, with_dates=True)
+    AttendanceSnapshot.from_matrix(ids, presence, hours[::-1], dates,
+                                   source_signature(db_attendance, db_dates)).save(path)
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump({'version': SNAPSHOT_VERSION-1, 'source': source_signature(db_attendance, db_dates)}, f)
+    for snapshot in (get_attendance_snapshot(db_attendance, db_dates, snapshot_dir), AttendanceSnapshot.load(path)):
+        assert list(snapshot.dates) == sorted(HOURS), snapshot.dates
+        attendance = snapshot.attendance()
+        assert attendance.keys() == EXPECTED.keys(), attendance
+        for matricola, fraction in EXPECTED.items():
+            assert np.isclose(attendance[matricola], fraction), (matricola, attendance[matricola])
+        assert set(snapshot.eligible().tolist()) == ADMITTED, snapshot.eligible()
+
+
+def check_migration(db_students, db_attendance, db_exams, db_legacy):
+    """Rewrites the dates of the databases written before the dates were
+    normalised, a log entry clashing with one already in ISO format"""
+    session = get_session(db_exams)
+    session.execute("UPDATE exams SET written_date = '20240610' WHERE matricola = 1")
+    session.execute("UPDATE exams SET written_date = '10/06/2024', oral_date = 'to be defined' WHERE matricola = 2")
+    session = get_session(db_attendance)
+    session.execute("UPDATE attendance_log SET date = '01/03/2024' WHERE matricola IN (1, 2) AND date = '2024-03-01'")
+    session.execute("INSERT INTO attendance_log (matricola, date, present) VALUES (2, '2024-03-01', 1)")
+    assert migrate_dates(db_legacy) == {'dates.date': 3}
+    assert migrate_dates(db_exams) == {'exams.written_date': 2, 'exams.reports_date': 0, 'exams.oral_date': 0}
+    assert migrate_dates(db_attendance) == {'attendance_log.date': 1}
+    assert migrate_dates(db_attendance) == {'attendance_log.date': 0}
+    data, _ = get_session(db_legacy).query("SELECT date, hours FROM dates ORDER BY date")
+    assert dict(data) == HOURS, data
+    data, _ = get_session(db_exams).query("SELECT DISTINCT written_date, oral_date FROM exams ORDER BY oral_date")
+    assert data == [('2024-06-10', None), ('2024-06-10', 'to be defined')], data
+    data, _ = get_session(db_attendance).query("SELECT DISTINCT date FROM attendance_log ORDER BY date")
+    assert [d[0] for d in data] == sorted(HOURS), data
+    check_fractions(db_attendance, db_legacy)
+    check_results(db_students, db_attendance, db_exams, db_legacy)
+
+
+def main():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        db_students, db_attendance, db_dates = make_databases(tmp_dir)
+        check_matrix(db_attendance, db_dates)
+        check_fractions(db_attendance, db_dates)
+        check_query(db_students, db_attendance, db_dates)
+        db_exams = os.path.join(tmp_dir, 'exams.db')
+        create_exams_db(db_exams)
+        write_exams_marks(db_exams, 'written', [(matricola, '28', '2024-06-10') for matricola in PRESENCE])
+        check_results(db_students, db_attendance, db_exams, db_dates)
+        check_snapshot(db_attendance, db_dates, os.path.join(tmp_dir, 'snapshots'))
+        # the dates stored in another format are matched as well
+        db_legacy = make_legacy_dates(tmp_dir)
+        check_fractions(db_attendance, db_legacy)
+        check_results(db_students, db_attendance, db_exams, db_legacy)
+        # the same matrix is found in the 'long' layout
+        db_long = os.path.join(tmp_dir, 'attendance_long.db')
+        shutil.copy(db_attendance, db_long)
+        migrate_attendance_to_long(db_long, drop=True)
+        check_matrix(db_long, db_dates)
+        check_fractions(db_long, db_dates)
+        check_query(db_students, db_long, db_dates)
+        check_results(db_students, db_long, db_exams, db_dates)
+        check_snapshot(db_long, db_dates, os.path.join(tmp_dir, 'snapshots'))
+        check_fractions(db_long, db_legacy)
+        check_results(db_students, db_long, db_exams, db_legacy)
+        check_migration(db_students, db_long, db_exams, db_legacy)
+        # the cached fractions follow the changes of the data
+        write_attendance(db_attendance, {(1, '2024-03-01'): True})
+        assert np.isclose(calculate_attendance(db_attendance, db_dates)[1], 8/9)
+        assert np.isclose(loop_attendance(db_attendance, db_dates)[1], 8/9)
+        # a missing dates database is reported, not created
+        db_missing = os.path.join(tmp_dir, 'missing_dates.db')
+        try:
+            calculate_attendance(db_attendance, db_missing)
+            raise AssertionError('missing dates database not reported')
+        except ValueError:
+            pass
+        assert not os.path.exists(db_missing)
+    finally:
+        shutil.rmtree(tmp_dir)
+    print('Attendance matched to the dates by name')
+    return
+
+if __name__ == '__main__':
+    main()
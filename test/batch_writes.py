@@ -0,0 +1,95 @@
+from context import lborg
+import os
+import shutil
+import tempfile
+from lborg.db import Batch, Session, create_database, insert_items, update_db, add_row, get_session, close_session
+from lborg.db_items import db_student
+
+COHORT = '2023/24'
+
+
+def make_database(tmp_dir):
+    db_name = os.path.join(tmp_dir, 'students.db')
+    create_database(db_name)
+    insert_items(db_name, [db_student(f'Cognome{matricola}', 'Nome', matricola, '', COHORT, 0)
+                           for matricola in range(1, 5)])
+    return db_name
+
+
+def groups(db_name):
+    data, _ = get_session(db_name).query("SELECT matricola, gruppo FROM students ORDER BY matricola")
+    return dict(data)
+
+
+def check_coalesced(db_name):
+    """Repeated updates of the same cell are written once, with the last value,
+    and the reads within the batch see the buffered writes"""
+    with Batch(db_name) as batch:
+        for group in range(1, 4):
+            for matricola in range(1, 5):
+                update_db(db_name, 'gruppo', group, 'matricola = ?', params=(matricola,))
+        assert batch._n_buffered == 12 and batch._n_executed == 0, batch._n_buffered
+        assert groups(db_name) == {1: 3, 2: 3, 3: 3, 4: 3}, groups(db_name)
+        assert batch._n_executed == 4, batch._n_executed
+    mode = get_session(db_name).query("PRAGMA journal_mode")[0][0][0]
+    assert mode == 'wal', mode
+
+
+def check_atomic(db_name):
+    """Nothing is written by an atomic batch failing halfway"""
+    try:
+        with Batch(db_name):
+            update_db(db_name, 'gruppo', 5, 'matricola = ?', params=(1,))
+            add_row(db_name, 'matricola', 5)
+            groups(db_name)
+            raise RuntimeError('failed')
+    except RuntimeError:
+        pass
+    assert groups(db_name) == {1: 3, 2: 3, 3: 3, 4: 3}, groups(db_name)
+
+
+def check_chunks(db_name):
+    """The chunks committed by a batch failing halfway are kept"""
+    try:
+        with Batch(db_name, mode='chunk', chunk_size=2):
+            for matricola in range(1, 5):
+                update_db(db_name, 'gruppo', 6, 'matricola = ?', params=(matricola,))
+                groups(db_name)
+            update_db(db_name, 'no_such_column', 6)
+            groups(db_name)
+    except Exception:
+        pass
+    assert groups(db_name) == {1: 6, 2: 6, 3: 6, 4: 6}, groups(db_name)
+
+
+def check_shared_session(db_name):
+    """The shared session used in a `with` block is left open and shared,
+    while a new session is closed and replaced by the shared one at the end"""
+    shared = get_session(db_name)
+    with get_session(db_name):
+        with get_session(db_name):
+            pass
+    assert get_session(db_name) is shared
+    assert groups(db_name) == {1: 6, 2: 6, 3: 6, 4: 6}, groups(db_name)
+    with Session(db_name) as session:
+        assert get_session(db_name) is session
+    assert get_session(db_name) is shared
+    assert groups(db_name) == {1: 6, 2: 6, 3: 6, 4: 6}, groups(db_name)
+
+
+def main():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        db_name = make_database(tmp_dir)
+        check_coalesced(db_name)
+        check_atomic(db_name)
+        check_chunks(db_name)
+        check_shared_session(db_name)
+        close_session(db_name)
+    finally:
+        shutil.rmtree(tmp_dir)
+    print('Batched writes coalesced and committed')
+    return
+
+if __name__ == '__main__':
+    main()
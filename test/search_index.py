@@ -0,0 +1,60 @@
+from context import lborg
+import os
+import sqlite3
+import shutil
+import tempfile
+from lborg.db import create_database, insert_items, bulk_insert, get_session, search_table, close_session
+from lborg.db_items import db_student
+
+COHORT = '2023/24'
+
+
+def students(first, n, surname='Rossì'):
+    return (db_student(f'{surname}{matricola}', 'Màrio', matricola, '', COHORT, 0)
+            for matricola in range(first, first + n))
+
+
+def schema_version(db_name):
+    return get_session(db_name).query("PRAGMA schema_version")[0][0][0]
+
+
+def check_index(db_name, n_students):
+    """The index has all the rows of the table, and its triggers"""
+    session = get_session(db_name)
+    session.execute("INSERT INTO students_search(students_search, rank) VALUES ('integrity-check', 1)")
+    triggers, _ = session.query("SELECT name FROM sqlite_master WHERE type = 'trigger'")
+    assert len(triggers) == 4, triggers
+    data, _ = session.query("SELECT COUNT(*) FROM students_search")
+    assert data[0][0] == n_students, data
+
+
+def main():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        db_name = os.path.join(tmp_dir, 'students.db')
+        create_database(db_name)
+        # a large import rebuilds the index once
+        assert insert_items(db_name, students(1, 5000), chunk_size=1000) == 5000
+        check_index(db_name, 5000)
+        # a small one, or one with no new students, is indexed by the triggers without changing the schema
+        version = schema_version(db_name)
+        assert insert_items(db_name, students(10001, 3, 'Bianchì')) == 3
+        assert insert_items(db_name, students(10001, 3, 'Bianchì')) == 0
+        assert schema_version(db_name) == version
+        check_index(db_name, 5003)
+        assert search_table(db_name, 'bianchi10002 mario', limit=1)[0][2] == 10002
+        # a failed import leaves neither rows nor the triggers dropped
+        try:
+            bulk_insert(db_name, list(students(20001, 5000)) + [(1, 2)])
+            raise AssertionError('failed import not reported')
+        except sqlite3.Error:
+            pass
+        check_index(db_name, 5003)
+        close_session(db_name)
+    finally:
+        shutil.rmtree(tmp_dir)
+    print('Search index kept up to date by the imports')
+    return
+
+if __name__ == '__main__':
+    main()